@@ -7,10 +7,14 @@ from .computer_control_agent import ComputerControlAgent
 from .computer_use_adapter import ComputerUseAdapter
 from .visual_analyzer import VisualAnalyzer
 from .action_executor import ActionExecutor
+from .screen_capture import Frame, ScreenCaptureService, SyntheticFrameSource
 
 __all__ = [
     'ComputerControlAgent',
     'ComputerUseAdapter', 
     'VisualAnalyzer',
-    'ActionExecutor'
+    'ActionExecutor',
+    'Frame',
+    'ScreenCaptureService',
+    'SyntheticFrameSource'
 ]
@@ -5,6 +5,7 @@
 
 import asyncio
 import logging
+from contextvars import ContextVar
 from typing import Dict, Any, Optional, Tuple, List
 from dataclasses import dataclass
 from enum import Enum
@@ -30,6 +31,27 @@ class ActionResult:
     message: str
     data: Optional[Dict[str, Any]] = None
     error: Optional[str] = None
+    step_id: Optional[str] = None
+
+# 不改变屏幕内容的动作，同一分组内的这些步骤共用一帧截图
+_OBSERVE_ACTIONS = {ActionType.FIND_ELEMENT.value, ActionType.ANALYZE.value, ActionType.SCREENSHOT.value}
+
+class _SequenceState:
+    """步骤序列执行期间的屏幕状态"""
+    
+    def __init__(self):
+        self.frame = None  # 当前分组共用的帧
+        self.needs_settle = False  # 上一步可能改变了画面，下次取帧前先等待画面稳定
+        self.index = -1  # 正在执行的步骤序号
+        self.lookups: Dict[int, asyncio.Task] = {}  # 步骤序号 -> 预取的元素定位任务
+    
+    def drop_lookups(self):
+        for task in self.lookups.values():
+            task.cancel()
+        self.lookups.clear()
+
+# 当前协程所在的步骤序列（并发执行的多个序列互不影响）
+_sequence_state: ContextVar[Optional[_SequenceState]] = ContextVar("computer_control_sequence", default=None)
 
 class ActionExecutor:
     """动作执行器，执行具体的鼠标键盘操作"""
@@ -116,12 +138,20 @@ class ActionExecutor:
             if x is not None and y is not None:
                 # 直接坐标
                 x, y = self._parse_coordinates(x, y)
-            elif isinstance(target, str) and (target.startswith(('点击', 'click', 'Click')) or 
-                                           any(keyword in target.lower() for keyword in ['按钮', 'button', '图标', 'icon'])):
+            elif parameters.get("template") and self.visual_analyzer:
+                # 模板匹配定位（可用roi限定搜索区域）
+                matches = await self._lookup("template", target, parameters)
+                if not matches:
+                    return ActionResult(
+                        success=False,
+                        message=f"模板匹配失败: {parameters['template']}",
+                        error="模板匹配失败"
+                    )
+                x, y = matches[0]["center"]
+            elif self._is_locate_target(target):
                 # 尝试AI定位
                 if self.visual_analyzer:
-                    screenshot = await self.computer_adapter.take_screenshot()
-                    location = await self.visual_analyzer.locate_element(target, screenshot)
+                    location = await self._lookup("locate", target, parameters)
                     if location:
                         x, y = location
                     else:
@@ -166,6 +196,47 @@ class ActionExecutor:
                 error=str(e)
             )
     
+    @staticmethod
+    def _is_locate_target(target) -> bool:
+        """点击目标是否需要通过视觉定位"""
+        return isinstance(target, str) and (target.startswith(('点击', 'click', 'Click')) or
+                                            any(keyword in target.lower() for keyword in ['按钮', 'button', '图标', 'icon']))
+    
+    async def _observe(self):
+        """获取当前画面：步骤序列中沿用分组共用的帧（画面刚变化过则先等待稳定），否则直接截图"""
+        state = _sequence_state.get()
+        if state is None:
+            return await self.computer_adapter.capture_frame()
+        if state.frame is None:
+            if state.needs_settle:
+                state.frame = await self.computer_adapter.wait_for_stable_frame()
+                state.needs_settle = False
+            else:
+                state.frame = await self.computer_adapter.capture_frame()
+        return state.frame
+    
+    async def _run_lookup(self, kind: str, target: str, parameters: Dict[str, Any], frame):
+        """在指定帧上定位元素：template 返回匹配列表，locate 返回坐标"""
+        if kind == "template":
+            return await self.visual_analyzer.match_template(
+                frame, parameters["template"], roi=parameters.get("roi"),
+                top_k=int(parameters.get("top_k", 1)), threshold=parameters.get("threshold")
+            )
+        return await self.visual_analyzer.locate_element(target, frame)
+    
+    async def _lookup(self, kind: str, target: str, parameters: Dict[str, Any], frame=None):
+        """元素定位：优先使用步骤序列为当前步骤预取的结果"""
+        state = _sequence_state.get()
+        if state is not None:
+            task = state.lookups.pop(state.index, None)
+            if task is not None:
+                return await task
+        if frame is None:
+            frame = await self._observe()
+            if frame is None:
+                return None
+        return await self._run_lookup(kind, target, parameters, frame)
+    
     def _parse_coordinates(self, x, y) -> Tuple[int, int]:
         """解析坐标，支持多种格式"""
         try:
@@ -236,7 +307,8 @@ class ActionExecutor:
                 )
             
             # 执行截图
-            screenshot = await self.computer_adapter.take_screenshot()
+            frame = await self._observe()
+            screenshot = await frame.encode_async("PNG") if frame is not None else None
             
             if screenshot:
                 return ActionResult(
@@ -339,8 +411,30 @@ class ActionExecutor:
         try:
             duration = parameters.get("duration", 1.0)
             
+            # 默认按固定时长等待；adaptive=True 时等到画面先变化、再稳定为止（duration 为上限），
+            # 用于等待程序/页面绘制完成后尽早继续。步骤之间的隐式等待才默认使用稳定检测
+            if parameters.get("adaptive") and self.computer_adapter:
+                loop = asyncio.get_running_loop()
+                started = loop.time()
+                frame = await self.computer_adapter.wait_for_stable_frame(timeout=duration, require_change=True)
+                if frame is not None:
+                    waited = loop.time() - started
+                    state = _sequence_state.get()
+                    if state is not None:
+                        state.frame = frame
+                        state.needs_settle = False
+                    return ActionResult(
+                        success=True,
+                        message=f"等待完成: 画面{'已稳定' if not frame.changed else '仍在变化'}，用时{waited:.2f}秒",
+                        data={"duration": duration, "waited": round(waited, 3), "stable": not frame.changed}
+                    )
+            
             # 执行等待
             await asyncio.sleep(duration)
+            state = _sequence_state.get()
+            if state is not None:
+                # 等待期间画面可能已变化，之后重新取帧
+                state.frame = None
             
             return ActionResult(
                 success=True,
@@ -373,7 +467,7 @@ class ActionExecutor:
                 )
             
             # 先截图
-            screenshot = await self.computer_adapter.take_screenshot()
+            screenshot = await self._observe()
             if not screenshot:
                 return ActionResult(
                     success=False,
@@ -381,8 +475,23 @@ class ActionExecutor:
                     error="截图失败"
                 )
             
+            # 指定模板时返回前 top_k 个匹配
+            if parameters.get("template"):
+                matches = await self._lookup("template", target, parameters, screenshot)
+                if matches:
+                    return ActionResult(
+                        success=True,
+                        message=f"找到元素: {target} at {matches[0]['center']}",
+                        data={"location": matches[0]["center"], "matches": matches, "target": target}
+                    )
+                return ActionResult(
+                    success=False,
+                    message=f"未找到元素: {target}",
+                    error="元素未找到"
+                )
+            
             # 查找元素
-            location = await self.visual_analyzer.locate_element(target, screenshot)
+            location = await self._lookup("locate", target, parameters, screenshot)
             
             if location:
                 return ActionResult(
@@ -422,7 +531,7 @@ class ActionExecutor:
                 )
             
             # 先截图
-            screenshot = await self.computer_adapter.take_screenshot()
+            screenshot = await self._observe()
             if not screenshot:
                 return ActionResult(
                     success=False,
@@ -431,9 +540,9 @@ class ActionExecutor:
                 )
             
             # 分析屏幕
-            analysis = await self.visual_analyzer.analyze_screen(screenshot)
+            analysis = await self.visual_analyzer.analyze_screenshot(screenshot)
             
-            if analysis.get("success"):
+            if "error" not in analysis:
                 return ActionResult(
                     success=True,
                     message="屏幕分析完成",
@@ -469,32 +578,125 @@ class ActionExecutor:
         
         return True
     
-    async def execute_step_sequence(self, steps: list) -> List[ActionResult]:
-        """执行步骤序列"""
-        results = []
+    def plan_steps(self, steps: list) -> List[List[int]]:
+        """按屏幕状态把步骤分组
         
+        查找/分析/截图不改变画面，与其后的步骤看到的是同一画面；点击、输入、滚动、拖拽、等待会改变画面，结束当前分组
+        """
+        groups, current = [], []
         for i, step in enumerate(steps):
-            logger.info(f"执行步骤 {i+1}/{len(steps)}: {step.get('action', 'unknown')}")
-            
-            # 检查依赖
-            if not self._check_dependencies(step, results):
-                results.append(ActionResult(
-                    success=False,
-                    message=f"步骤 {i+1} 依赖检查失败",
-                    error="依赖检查失败"
-                ))
-                continue
-            
-            # 执行步骤
-            result = await self.execute_action(step)
-            results.append(result)
-            
-            # 如果步骤失败，可以选择继续或停止
-            if not result.success:
-                logger.warning(f"步骤 {i+1} 执行失败: {result.message}")
-                # 这里可以选择继续执行或停止
-                # break  # 停止执行
-                continue  # 继续执行
+            current.append(i)
+            if step.get("action", "").lower() not in _OBSERVE_ACTIONS:
+                groups.append(current)
+                current = []
+        if current:
+            groups.append(current)
+        return groups
+    
+    def _lookup_kind(self, step: dict) -> Optional[str]:
+        """步骤需要的元素定位类型（template / locate），不需要定位时返回None"""
+        if not self.visual_analyzer:
+            return None
+        action_type = step.get("action", "").lower()
+        target = step.get("target", "")
+        parameters = step.get("parameters", {})
+        if self.safety_mode and not self._is_safe_action(action_type, target):
+            return None
+        if action_type == ActionType.CLICK.value:
+            if parameters.get("x") is not None and parameters.get("y") is not None:
+                return None
+            if parameters.get("template"):
+                return "template"
+            return "locate" if self._is_locate_target(target) else None
+        if action_type == ActionType.FIND_ELEMENT.value:
+            return "template" if parameters.get("template") else "locate"
+        return None
+    
+    async def _prepare_group(self, steps: list, group: List[int], state: _SequenceState):
+        """为一组步骤准备共用的帧，并在该帧上并发预取组内所有元素定位"""
+        lookups = {i: kind for i in group if (kind := self._lookup_kind(steps[i]))}
+        needs_screen = lookups or any(steps[i].get("action", "").lower() in _OBSERVE_ACTIONS for i in group)
+        if not needs_screen or not self.computer_adapter:
+            return
+        
+        def start(frame):
+            state.frame = frame
+            state.drop_lookups()
+            loop = asyncio.get_running_loop()
+            for i, kind in lookups.items():
+                step = steps[i]
+                state.lookups[i] = loop.create_task(
+                    self._run_lookup(kind, step.get("target", ""), step.get("parameters", {}), frame)
+                )
+        
+        if state.needs_settle:
+            # 等待上一步的界面变化稳定；首次出现不变的帧就开始预取，确认稳定后仍是同一画面则直接沿用预取结果
+            frame = await self.computer_adapter.wait_for_stable_frame(on_candidate=start)
+            state.needs_settle = False
+            if frame is None:
+                state.frame = None
+                state.drop_lookups()
+            elif state.frame is None or state.frame.frame_hash != frame.frame_hash:
+                start(frame)
+            else:
+                state.frame = frame
+        else:
+            frame = state.frame or await self.computer_adapter.capture_frame()
+            if frame is not None:
+                start(frame)
+    
+    async def execute_step_sequence(self, steps: list) -> List[ActionResult]:
+        """执行步骤序列
+        
+        同一画面状态下的步骤共用一次截图与分析，组内的元素定位在该帧上并发预取；
+        改变画面的步骤之后，用画面稳定检测代替固定等待
+        """
+        results = []
+        state = _SequenceState()
+        token = _sequence_state.set(state)
+        try:
+            plan = self.plan_steps(steps)
+            logger.info(f"步骤序列共 {len(steps)} 步，按画面状态分为 {len(plan)} 组")
+            
+            for group in plan:
+                await self._prepare_group(steps, group, state)
+                for i in group:
+                    step = steps[i]
+                    state.index = i
+                    step_id = step.get("step_id", step.get("id"))
+                    logger.info(f"执行步骤 {i+1}/{len(steps)}: {step.get('action', 'unknown')}")
+                    
+                    # 检查依赖
+                    if not self._check_dependencies(step, results):
+                        results.append(ActionResult(
+                            success=False,
+                            message=f"步骤 {i+1} 依赖检查失败",
+                            error="依赖检查失败",
+                            step_id=step_id
+                        ))
+                        continue
+                    
+                    # 执行步骤
+                    result = await self.execute_action(step)
+                    result.step_id = step_id
+                    results.append(result)
+                    
+                    action_type = step.get("action", "").lower()
+                    if action_type not in _OBSERVE_ACTIONS and action_type != ActionType.WAIT.value:
+                        # 画面可能已变化，之后取帧前先等待稳定（等待动作自行处理：固定等待后重新取帧，自适应等待已等到稳定）
+                        state.frame = None
+                        state.needs_settle = True
+                    
+                    # 如果步骤失败，可以选择继续或停止
+                    if not result.success:
+                        logger.warning(f"步骤 {i+1} 执行失败: {result.message}")
+                        # 这里可以选择继续执行或停止
+                        # break  # 停止执行
+                        continue  # 继续执行
+                state.drop_lookups()
+        finally:
+            state.drop_lookups()
+            _sequence_state.reset(token)
         
         return results
     
@@ -0,0 +1,210 @@
+"""
+视觉分析缓存 - 按帧哈希缓存整帧分析结果
+同一画面上的重复查找（文本、控件、模板、AI定位）直接命中缓存，不再重新OCR/检测
+"""
+
+import difflib
+import hashlib
+import logging
+import re
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+_PUNCTUATION = re.compile(r"[\s\W_]+", re.UNICODE)
+
+
+def normalize_text(text: str) -> str:
+    """文本归一化：全角转半角、小写、去掉空白与标点"""
+    return _PUNCTUATION.sub("", unicodedata.normalize("NFKC", text).lower())
+
+
+def content_hash(data: bytes) -> str:
+    """编码截图/原始像素的内容哈希，与 Frame.frame_hash 一样用作缓存键"""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def _center(bbox: Dict[str, int]) -> Tuple[int, int]:
+    return bbox["x"] + bbox["width"] // 2, bbox["y"] + bbox["height"] // 2
+
+
+class TextIndex:
+    """OCR文本的空间索引
+
+    - 单词级结果按行合并出整行文本，单词与整行都参与查找，可以匹配跨越多个单词的目标
+    - 归一化文本到条目的倒排表用于精确查找，网格用于按区域查询
+    """
+
+    def __init__(self, ocr_text: List[Dict[str, Any]], cell_size: int = 128):
+        self.cell_size = cell_size
+        self.entries: List[Dict[str, Any]] = []
+        self._by_text: Dict[str, List[int]] = {}
+        self._grid: Dict[Tuple[int, int], List[int]] = {}
+        for item in ocr_text:
+            self._add(item["text"], item["bbox"], item.get("confidence"))
+        for text, bbox in self._group_lines(ocr_text):
+            self._add(text, bbox, None)
+
+    def _add(self, text: str, bbox: Dict[str, int], confidence):
+        key = normalize_text(text)
+        if not key:
+            return
+        idx = len(self.entries)
+        self.entries.append({"text": text, "key": key, "bbox": bbox, "confidence": confidence})
+        self._by_text.setdefault(key, []).append(idx)
+        c = self.cell_size
+        for gx in range(bbox["x"] // c, (bbox["x"] + bbox["width"]) // c + 1):
+            for gy in range(bbox["y"] // c, (bbox["y"] + bbox["height"]) // c + 1):
+                self._grid.setdefault((gx, gy), []).append(idx)
+
+    @staticmethod
+    def _group_lines(ocr_text: List[Dict[str, Any]]) -> List[Tuple[str, Dict[str, int]]]:
+        """把垂直方向对齐、水平间距较小的单词合并为行"""
+        lines: List[List[Dict[str, Any]]] = []
+        for item in sorted(ocr_text, key=lambda t: (t["bbox"]["y"], t["bbox"]["x"])):
+            bbox = item["bbox"]
+            cy = bbox["y"] + bbox["height"] / 2
+            for line in lines:
+                last = line[-1]["bbox"]
+                gap = bbox["x"] - (last["x"] + last["width"])
+                if abs(cy - (last["y"] + last["height"] / 2)) <= last["height"] / 2 and -2 <= gap <= 1.5 * max(last["height"], 1):
+                    line.append(item)
+                    break
+            else:
+                lines.append([item])
+
+        result = []
+        for line in lines:
+            if len(line) < 2:
+                continue
+            x1 = min(t["bbox"]["x"] for t in line)
+            y1 = min(t["bbox"]["y"] for t in line)
+            x2 = max(t["bbox"]["x"] + t["bbox"]["width"] for t in line)
+            y2 = max(t["bbox"]["y"] + t["bbox"]["height"] for t in line)
+            result.append((" ".join(t["text"] for t in line), {"x": x1, "y": y1, "width": x2 - x1, "height": y2 - y1}))
+        return result
+
+    def find(self, target: str, threshold: float = 0.8) -> Optional[Dict[str, Any]]:
+        """查找文本：精确匹配 > 包含匹配（取最短的条目）> 相似度不低于阈值的模糊匹配"""
+        key = normalize_text(target)
+        if not key:
+            return None
+        exact = self._by_text.get(key)
+        if exact:
+            return self.entries[exact[0]]
+
+        containing = [e for e in self.entries if key in e["key"]]
+        if containing:
+            return min(containing, key=lambda e: len(e["key"]))
+
+        best, best_ratio = None, threshold
+        for entry in self.entries:
+            matcher = difflib.SequenceMatcher(None, key, entry["key"])
+            if matcher.real_quick_ratio() < best_ratio or matcher.quick_ratio() < best_ratio:
+                continue
+            ratio = matcher.ratio()
+            if ratio >= best_ratio:
+                best, best_ratio = entry, ratio
+        return best
+
+    def find_center(self, target: str, threshold: float = 0.8) -> Optional[Tuple[int, int]]:
+        entry = self.find(target, threshold)
+        return _center(entry["bbox"]) if entry else None
+
+    def query(self, x: int, y: int, width: int, height: int) -> List[Dict[str, Any]]:
+        """返回与区域相交的条目"""
+        c = self.cell_size
+        seen = set()
+        result = []
+        for gx in range(x // c, (x + width) // c + 1):
+            for gy in range(y // c, (y + height) // c + 1):
+                for idx in self._grid.get((gx, gy), ()):
+                    if idx in seen:
+                        continue
+                    seen.add(idx)
+                    b = self.entries[idx]["bbox"]
+                    if b["x"] < x + width and b["x"] + b["width"] > x and b["y"] < y + height and b["y"] + b["height"] > y:
+                        result.append(self.entries[idx])
+        return result
+
+
+class FrameAnalysis:
+    """一帧画面的分析结果及其派生索引（只做过模板匹配/AI定位的帧，analysis 为 None）"""
+
+    def __init__(self, frame_hash: str):
+        self.frame_hash = frame_hash
+        self.analysis: Optional[Dict[str, Any]] = None
+        self.template_matches: Dict[Any, Any] = {}  # (模板路径, ROI, top_k, 阈值) -> 匹配结果
+        self.ai_locations: Dict[Any, Optional[Tuple[int, int]]] = {}  # (描述, 屏幕尺寸) -> 坐标
+        self.pyramid = None  # 模板匹配用的屏幕灰度金字塔
+        self.pending = None  # 进行中的整帧分析任务
+        self.tile_key = None  # (帧尺寸, 图块边长)，图块哈希可比较的前提
+        self.tile_hashes = None  # 分析时帧的图块哈希，供后续帧做增量分析
+        self._text_index: Optional[TextIndex] = None
+
+    def set_analysis(self, analysis: Dict[str, Any]):
+        self.analysis = analysis
+        self._text_index = None
+
+    @property
+    def text_index(self) -> TextIndex:
+        if self._text_index is None:
+            self._text_index = TextIndex((self.analysis or {}).get("ocr_text", []))
+        return self._text_index
+
+    @property
+    def elements(self) -> List[Dict[str, Any]]:
+        return (self.analysis or {}).get("elements", [])
+
+
+class AnalysisCache:
+    """按帧哈希的LRU缓存；整帧分析、模板匹配与AI定位结果都挂在对应帧的条目上"""
+
+    def __init__(self, max_entries: int = 16):
+        self.max_entries = max(1, max_entries)
+        self._entries: "OrderedDict[str, FrameAnalysis]" = OrderedDict()
+        self._stats: Dict[str, int] = {"evictions": 0}
+
+    def peek(self, frame_hash: Optional[str]) -> Optional[FrameAnalysis]:
+        """查看条目，不调整LRU顺序"""
+        return self._entries.get(frame_hash) if frame_hash else None
+
+    def latest_analyzed(self, tile_key, exclude: Optional[str] = None) -> Optional[FrameAnalysis]:
+        """最近完成分析、且图块哈希可与给定帧比较的条目"""
+        for frame_hash in reversed(self._entries):
+            entry = self._entries[frame_hash]
+            if frame_hash != exclude and entry.analysis is not None and entry.tile_key == tile_key:
+                return entry
+        return None
+
+    def entry(self, frame_hash: str) -> FrameAnalysis:
+        """获取（不存在时创建）帧条目"""
+        entry = self._entries.get(frame_hash)
+        if entry is None:
+            entry = FrameAnalysis(frame_hash)
+            self._entries[frame_hash] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+        else:
+            self._entries.move_to_end(frame_hash)
+        return entry
+
+    def count(self, kind: str, hit: bool):
+        """记录一次缓存查找，kind 如 analysis / text / template / ai"""
+        name = f"{kind}_{'hits' if hit else 'misses'}"
+        self._stats[name] = self._stats.get(name, 0) + 1
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, Any]:
+        stats = dict(self._stats)
+        stats["entries"] = len(self._entries)
+        return stats
@@ -320,8 +320,8 @@ class ComputerControlAgent:
         """处理AI定位任务"""
         try:
             # 获取屏幕截图
-            screenshot = await self.adapter.take_screenshot()
-            if not screenshot:
+            screenshot = await self.adapter.capture_frame()
+            if screenshot is None:
                 return json.dumps({
                     "success": False,
                     "error": "截图失败",
@@ -3,7 +3,6 @@
 提供鼠标键盘控制、屏幕截图、视觉分析等核心功能
 """
 
-import io
 import time
 import platform
 import logging
@@ -14,6 +13,8 @@ if 'nagaagent_core.vendors.pil' in sys.modules:
 from PIL import Image
 import asyncio
 
+from .screen_capture import Frame, ScreenCaptureService, ScreenFrameSource, SyntheticFrameSource
+
 # 尝试导入依赖包
 try:
     import nagaagent_core.vendors.pyautogui as pyautogui
@@ -74,6 +75,9 @@ class ComputerUseAdapter:
                 logger.warning(f"获取屏幕尺寸失败: {e}")
                 # 使用默认值
         
+        # 截图管线
+        self.capture_service = self._create_capture_service()
+        
         # 初始化组件
         self._init_components()
     
@@ -100,6 +104,24 @@ class ComputerUseAdapter:
         logger.info(f"屏幕缩放: {width}x{height} -> {safe_width}x{safe_height}, 缩放因子: {scale_factor:.2f}")
         return safe_width, safe_height
     
+    def _create_capture_service(self) -> Optional[ScreenCaptureService]:
+        """按配置创建屏幕采集服务（真实屏幕需要pyautogui，合成帧源可在无显示环境下使用）"""
+        try:
+            from system.config import config
+            cc = config.computer_control
+            source_name, tile_size = cc.capture_source, cc.capture_tile_size
+        except Exception:
+            source_name, tile_size = "screen", 64
+        
+        if source_name == "synthetic":
+            source = SyntheticFrameSource(self.scaled_width, self.scaled_height)
+            logger.info(f"使用合成帧源: {self.scaled_width}x{self.scaled_height}")
+        elif PYAUTOGUI_AVAILABLE:
+            source = ScreenFrameSource(pyautogui, (self.scaled_width, self.scaled_height))
+        else:
+            return None
+        return ScreenCaptureService(source, tile_size=tile_size)
+    
     def _init_components(self):
         """初始化核心组件"""
         try:
@@ -159,18 +181,39 @@ class ComputerUseAdapter:
             "platform": platform.system()
         }
     
+    async def capture_frame(self) -> Optional[Frame]:
+        """采集一帧逻辑尺寸的屏幕图像（未编码，附带相对上一帧的变化区域）"""
+        if self.capture_service is None:
+            return None
+        return await self.capture_service.capture()
+    
+    async def wait_for_stable_frame(self, timeout: Optional[float] = None, on_candidate=None,
+                                    require_change: bool = False) -> Optional[Frame]:
+        """等待画面稳定后返回该帧（替代固定时长的等待）"""
+        if self.capture_service is None:
+            return None
+        try:
+            from system.config import config
+            cc = config.computer_control
+            settle_timeout, interval, stable_frames = cc.settle_timeout, cc.settle_interval, cc.settle_stable_frames
+        except Exception:
+            settle_timeout, interval, stable_frames = 3.0, 0.1, 2
+        return await self.capture_service.wait_until_stable(
+            timeout=settle_timeout if timeout is None else timeout,
+            interval=interval,
+            stable_frames=stable_frames,
+            on_candidate=on_candidate,
+            require_change=require_change
+        )
+    
     async def take_screenshot(self) -> Optional[bytes]:
-        """截取屏幕截图"""
-        if not PYAUTOGUI_AVAILABLE:
+        """截取屏幕截图（PNG字节）"""
+        frame = await self.capture_frame()
+        if frame is None:
             return None
         
         try:
-            screenshot = pyautogui.screenshot()
-            # 基于博弈论的实现：将截图缩放到逻辑尺寸
-            screenshot = screenshot.resize((self.scaled_width, self.scaled_height), Image.LANCZOS)
-            buf = io.BytesIO()
-            screenshot.save(buf, format="PNG")
-            return buf.getvalue()
+            return await frame.encode_async("PNG")
         except Exception as e:
             logger.error(f"截取屏幕截图失败: {e}")
             return None
@@ -391,11 +434,11 @@ class ComputerUseAdapter:
                 logger.info(f"执行迭代 {iteration + 1}/{max_iterations}")
                 
                 # 获取屏幕截图
-                screenshot = await self.take_screenshot()
-                if not screenshot:
+                frame = await self.capture_frame()
+                if frame is None:
                     return {"success": False, "error": "无法获取屏幕截图"}
                 
-                obs["screenshot"] = screenshot
+                obs["screenshot"] = frame
                 
                 # 这里应该调用AI模型来生成下一步动作
                 # 暂时使用简单的模拟逻辑
@@ -492,8 +535,8 @@ class ComputerUseAdapter:
         """
         try:
             # 获取屏幕截图
-            screenshot = await self.take_screenshot()
-            if not screenshot:
+            frame = await self.capture_frame()
+            if frame is None:
                 logger.error("无法获取屏幕截图")
                 return False
             
@@ -502,7 +545,7 @@ class ComputerUseAdapter:
             analyzer = VisualAnalyzer()
             location = await analyzer.locate_element_with_ai(
                 target_description, 
-                screenshot, 
+                frame, 
                 self.screen_width, 
                 self.screen_height
             )
@@ -525,7 +568,8 @@ class ComputerUseAdapter:
             "scaled_size": f"{self.scaled_width}x{self.scaled_height}",
             "scale_factors": f"x={self.scale_x:.2f}, y={self.scale_y:.2f}",
             "normalization_range": "0-1000",
-            "platform": platform.system()
+            "platform": platform.system(),
+            "capture": self.capture_service.stats() if self.capture_service else None
         }
     
     def _parse_instruction(self, instruction: str) -> Optional[Dict[str, Any]]:
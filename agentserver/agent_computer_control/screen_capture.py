@@ -0,0 +1,321 @@
+"""
+屏幕采集服务 - 电脑控制的截图管线
+采集与编码在工作线程中完成，帧以numpy数组（RGB, uint8, 只读）形式提供；
+相邻两帧按图块哈希比较得到变化区域，供视觉分析只在变化处重新识别；
+PNG/JPEG编码延迟到真正需要（例如发给视觉模型）时才进行，并按格式缓存
+"""
+
+import asyncio
+import hashlib
+import io
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import sys
+if 'nagaagent_core.vendors.pil' in sys.modules:
+    del sys.modules['nagaagent_core.vendors.pil']
+from PIL import Image
+import numpy as np
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 变化区域 (x, y, width, height)
+Region = Tuple[int, int, int, int]
+
+_MIME_TYPES = {"PNG": "image/png", "JPEG": "image/jpeg"}
+
+
+class Frame:
+    """一帧屏幕图像
+
+    - array: RGB图像数组（只读），crop() 返回的是视图而不是拷贝
+    - dirty_regions: 相对上一帧的变化区域；None 表示没有可比较的上一帧（首帧或尺寸变化），需整帧处理
+    - previous_hash: 上一帧的 frame_hash，用于判断增量结果是否可以接续
+    """
+
+    def __init__(self, array: np.ndarray, index: int = 0, tile_size: int = 64):
+        if array.ndim != 3 or array.shape[2] != 3 or array.dtype != np.uint8:
+            raise ValueError(f"帧数据必须是 HxWx3 的uint8数组，实际为 {array.shape} {array.dtype}")
+        array.setflags(write=False)
+        self.array = array
+        self.index = index
+        self.tile_size = tile_size
+        self.captured_at = time.time()
+        self.previous_hash: Optional[str] = None
+        self.dirty_regions: Optional[List[Region]] = None
+        self.dirty_ratio = 1.0
+        self._tile_hashes: Optional[np.ndarray] = None
+        self._frame_hash: Optional[str] = None
+        # 编码缓存可在内容相同的相邻帧之间共享
+        self._encoded: Dict[Tuple[str, int], bytes] = {}
+        self._encode_lock = threading.Lock()
+
+    @property
+    def width(self) -> int:
+        return self.array.shape[1]
+
+    @property
+    def height(self) -> int:
+        return self.array.shape[0]
+
+    @property
+    def size(self) -> Tuple[int, int]:
+        return self.width, self.height
+
+    @property
+    def changed(self) -> bool:
+        """相对上一帧是否有变化（无可比较的上一帧时视为有变化）"""
+        return self.dirty_regions is None or bool(self.dirty_regions)
+
+    @property
+    def tile_hashes(self) -> np.ndarray:
+        """各图块的64位哈希，形状为 (行数, 列数)"""
+        if self._tile_hashes is None:
+            t = self.tile_size
+            rows = (self.height + t - 1) // t
+            cols = (self.width + t - 1) // t
+            hashes = np.empty((rows, cols), dtype=np.uint64)
+            for r in range(rows):
+                band = self.array[r * t:(r + 1) * t]
+                for c in range(cols):
+                    digest = hashlib.blake2b(band[:, c * t:(c + 1) * t].tobytes(), digest_size=8).digest()
+                    hashes[r, c] = int.from_bytes(digest, "little")
+            self._tile_hashes = hashes
+        return self._tile_hashes
+
+    @property
+    def frame_hash(self) -> str:
+        """整帧内容哈希（由图块哈希与尺寸得出）"""
+        if self._frame_hash is None:
+            h = hashlib.blake2b(digest_size=16)
+            h.update(f"{self.width}x{self.height}/{self.tile_size}".encode())
+            h.update(self.tile_hashes.tobytes())
+            self._frame_hash = h.hexdigest()
+        return self._frame_hash
+
+    def crop(self, region: Region) -> np.ndarray:
+        """截取区域（零拷贝视图）"""
+        x, y, w, h = region
+        return self.array[y:y + h, x:x + w]
+
+    def to_image(self) -> Image.Image:
+        return Image.fromarray(self.array, "RGB")
+
+    def mime_type(self, fmt: str = "PNG") -> str:
+        return _MIME_TYPES.get(fmt.upper(), "application/octet-stream")
+
+    def encode(self, fmt: str = "PNG", quality: int = 85) -> bytes:
+        """编码为PNG/JPEG字节（按格式缓存）"""
+        fmt = fmt.upper()
+        key = (fmt, quality if fmt == "JPEG" else 0)
+        with self._encode_lock:
+            data = self._encoded.get(key)
+            if data is None:
+                buf = io.BytesIO()
+                if fmt == "JPEG":
+                    self.to_image().save(buf, format="JPEG", quality=quality)
+                else:
+                    self.to_image().save(buf, format=fmt)
+                data = buf.getvalue()
+                self._encoded[key] = data
+            return data
+
+    async def encode_async(self, fmt: str = "PNG", quality: int = 85) -> bytes:
+        """在工作线程中编码，已缓存时直接返回"""
+        cached = self._encoded.get((fmt.upper(), quality if fmt.upper() == "JPEG" else 0))
+        if cached is not None:
+            return cached
+        return await asyncio.to_thread(self.encode, fmt, quality)
+
+    def _share_encoded(self, other: "Frame"):
+        """内容与上一帧相同，共用其编码缓存"""
+        self._encoded = other._encoded
+        self._encode_lock = other._encode_lock
+
+
+def diff_regions(previous: np.ndarray, current: np.ndarray, tile_size: int,
+                 width: int, height: int) -> List[Region]:
+    """比较两组图块哈希，把变化的图块合并为矩形区域
+
+    先把每行中连续的变化图块合并为横向区段，再把相邻行中列范围相同的区段纵向合并
+    """
+    dirty = previous != current
+    regions: List[Region] = []
+    open_runs: Dict[Tuple[int, int], List[int]] = {}  # (起始列, 结束列) -> [起始行, 结束行]
+    for r in range(dirty.shape[0]):
+        runs = []
+        cols = np.flatnonzero(dirty[r])
+        if cols.size:
+            start = prev = int(cols[0])
+            for c in cols[1:]:
+                c = int(c)
+                if c != prev + 1:
+                    runs.append((start, prev))
+                    start = c
+                prev = c
+            runs.append((start, prev))
+        next_runs: Dict[Tuple[int, int], List[int]] = {}
+        for run in runs:
+            rows = open_runs.pop(run, None)
+            if rows is not None and rows[1] == r - 1:
+                rows[1] = r
+                next_runs[run] = rows
+            else:
+                next_runs[run] = [r, r]
+        for run, rows in open_runs.items():
+            regions.append(_to_region(run, rows, tile_size, width, height))
+        open_runs = next_runs
+    for run, rows in open_runs.items():
+        regions.append(_to_region(run, rows, tile_size, width, height))
+    return regions
+
+
+def _to_region(run: Tuple[int, int], rows: List[int], tile_size: int, width: int, height: int) -> Region:
+    x = run[0] * tile_size
+    y = rows[0] * tile_size
+    return (x, y, min(width, (run[1] + 1) * tile_size) - x, min(height, (rows[1] + 1) * tile_size) - y)
+
+
+class ScreenFrameSource:
+    """通过pyautogui截取真实屏幕，并缩放到逻辑尺寸"""
+
+    def __init__(self, backend, target_size: Optional[Tuple[int, int]] = None):
+        self.backend = backend
+        self.target_size = target_size
+
+    def grab(self) -> np.ndarray:
+        image = self.backend.screenshot()
+        if self.target_size and image.size != tuple(self.target_size):
+            image = image.resize(self.target_size, Image.LANCZOS)
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        return np.asarray(image)
+
+
+class SyntheticFrameSource:
+    """合成帧源，用于无显示环境下测试截图管线与视觉分析
+
+    维护一块画布，可用 fill_rect()/paste() 修改，grab() 返回当前画布的快照
+    """
+
+    def __init__(self, width: int = 1920, height: int = 1080, background: Tuple[int, int, int] = (240, 240, 240)):
+        self._canvas = np.empty((height, width, 3), dtype=np.uint8)
+        self._canvas[:] = background
+        self._lock = threading.Lock()
+
+    def fill_rect(self, x: int, y: int, width: int, height: int, color: Tuple[int, int, int]):
+        with self._lock:
+            self._canvas[y:y + height, x:x + width] = color
+
+    def paste(self, x: int, y: int, pixels: np.ndarray):
+        with self._lock:
+            h = min(pixels.shape[0], self._canvas.shape[0] - y)
+            w = min(pixels.shape[1], self._canvas.shape[1] - x)
+            self._canvas[y:y + h, x:x + w] = pixels[:h, :w, :3]
+
+    def grab(self) -> np.ndarray:
+        with self._lock:
+            return self._canvas.copy()
+
+
+class ScreenCaptureService:
+    """屏幕采集服务
+
+    capture() 在专用工作线程中截屏并计算图块哈希，与上一帧比较得到 dirty_regions；
+    内容未变化的帧沿用上一帧的编码缓存
+    """
+
+    def __init__(self, source, tile_size: int = 64):
+        self.source = source
+        self.tile_size = max(8, tile_size)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="screen-capture")
+        self._lock = threading.Lock()
+        self._last: Optional[Frame] = None
+        self._index = 0
+        self._stats = {"captures": 0, "unchanged": 0, "failed": 0, "capture_time": 0.0, "dirty_ratio": 0.0}
+
+    @property
+    def last_frame(self) -> Optional[Frame]:
+        return self._last
+
+    async def capture(self) -> Optional[Frame]:
+        """采集一帧；失败时返回None"""
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self._executor, self.capture_sync)
+        except Exception as e:
+            self._stats["failed"] += 1
+            logger.error(f"屏幕采集失败: {e}")
+            return None
+
+    def capture_sync(self) -> Frame:
+        """同步采集一帧（在调用线程中执行）"""
+        started = time.perf_counter()
+        array = self.source.grab()
+        with self._lock:
+            self._index += 1
+            frame = Frame(array, index=self._index, tile_size=self.tile_size)
+            frame.tile_hashes  # 在工作线程中提前算好
+            previous = self._last
+            if previous is not None and previous.size == frame.size and previous.tile_size == frame.tile_size:
+                frame.previous_hash = previous.frame_hash
+                frame.dirty_regions = diff_regions(previous.tile_hashes, frame.tile_hashes,
+                                                   self.tile_size, frame.width, frame.height)
+                frame.dirty_ratio = sum(w * h for _, _, w, h in frame.dirty_regions) / (frame.width * frame.height)
+                if not frame.dirty_regions:
+                    frame._share_encoded(previous)
+                    self._stats["unchanged"] += 1
+            self._last = frame
+            self._stats["captures"] += 1
+            self._stats["capture_time"] += time.perf_counter() - started
+            self._stats["dirty_ratio"] += frame.dirty_ratio
+        return frame
+
+    async def wait_until_stable(self, timeout: float = 3.0, interval: float = 0.1, stable_frames: int = 2,
+                                on_candidate: Optional[Callable[[Frame], Any]] = None,
+                                require_change: bool = False) -> Optional[Frame]:
+        """等待画面稳定：连续 stable_frames 次采集与上一帧完全相同即返回该帧，超时返回最后一帧
+
+        首次出现未变化的帧时调用 on_candidate(frame)，调用方可以在确认稳定的同时提前处理这一帧；
+        require_change=True 时须先在等待期间观察到画面变化，之后的稳定才算数（画面始终不变则等到超时）
+        """
+        deadline = time.monotonic() + timeout
+        frame = await self.capture()
+        unchanged = 0
+        # 第一帧是与等待开始前的帧比较，不能说明等待期间画面有变化
+        changed_seen = not require_change
+        first = True
+        while frame is not None:
+            if frame.changed:
+                unchanged = 0
+                changed_seen = changed_seen or not first
+            elif changed_seen:
+                unchanged += 1
+                if unchanged == 1 and on_candidate is not None:
+                    on_candidate(frame)
+                if unchanged >= stable_frames:
+                    break
+            if time.monotonic() + interval > deadline:
+                logger.debug(f"等待画面稳定超时（{timeout}秒）")
+                break
+            first = False
+            await asyncio.sleep(interval)
+            frame = await self.capture()
+        return frame
+
+    def stats(self) -> Dict[str, Any]:
+        captures = self._stats["captures"]
+        return {
+            "captures": captures,
+            "unchanged": self._stats["unchanged"],
+            "failed": self._stats["failed"],
+            "avg_capture_ms": round(self._stats["capture_time"] / captures * 1000, 2) if captures else 0.0,
+            "avg_dirty_ratio": round(self._stats["dirty_ratio"] / captures, 4) if captures else 0.0,
+            "tile_size": self.tile_size,
+        }
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,275 @@
+"""
+模板匹配 - 预加载模板与金字塔多尺度匹配
+模板只读盘和预处理一次（灰度图、边缘图、各尺度缩放结果按需缓存）；
+匹配先在降采样的金字塔层上粗定位，再在原分辨率的小窗口内精确定位，支持多个缩放比例（DPI缩放）、ROI与top-k
+"""
+
+import logging
+import os
+import threading
+from dataclasses import dataclass, asdict
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+MATCH_MODES = ("gray", "edges")
+TEMPLATE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp')
+
+# 粗定位层上模板的最小边长（像素），更小的模板不再继续降采样
+_MIN_COARSE_SIZE = 16
+# 粗定位层的匹配分数会偏低，候选阈值相应放宽
+_COARSE_SLACK = 0.2
+
+
+@dataclass
+class TemplateMatch:
+    """一次模板匹配结果（整帧坐标）"""
+    x: int
+    y: int
+    width: int
+    height: int
+    score: float
+    scale: float
+
+    @property
+    def center(self) -> Tuple[int, int]:
+        return self.x + self.width // 2, self.y + self.height // 2
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = asdict(self)
+        data["score"] = round(self.score, 4)
+        data["center"] = self.center
+        return data
+
+
+def _iou(a: TemplateMatch, b: TemplateMatch) -> float:
+    x1, y1 = max(a.x, b.x), max(a.y, b.y)
+    x2, y2 = min(a.x + a.width, b.x + b.width), min(a.y + a.height, b.y + b.height)
+    inter = max(0, x2 - x1) * max(0, y2 - y1)
+    union = a.width * a.height + b.width * b.height - inter
+    return inter / union if union else 0.0
+
+
+class ScreenPyramid:
+    """屏幕灰度金字塔（每帧构建一次，边缘图按层按需计算）"""
+
+    def __init__(self, cv2, rgb: np.ndarray, levels: int):
+        self.cv2 = cv2
+        gray = cv2.cvtColor(np.ascontiguousarray(rgb), cv2.COLOR_RGB2GRAY)
+        self._gray = [gray]
+        for _ in range(levels):
+            if min(self._gray[-1].shape[:2]) < 2 * _MIN_COARSE_SIZE:
+                break
+            self._gray.append(cv2.pyrDown(self._gray[-1]))
+        self._edges: Dict[int, np.ndarray] = {}
+
+    @property
+    def levels(self) -> int:
+        return len(self._gray) - 1
+
+    def level(self, index: int, mode: str = "gray") -> np.ndarray:
+        if mode == "edges":
+            edges = self._edges.get(index)
+            if edges is None:
+                edges = self.cv2.Canny(self._gray[index], 50, 150)
+                self._edges[index] = edges
+            return edges
+        return self._gray[index]
+
+
+class _Template:
+    """已加载的模板及其各尺度/金字塔层的预处理结果"""
+
+    def __init__(self, cv2, path: str, mtime: float, gray: np.ndarray):
+        self.cv2 = cv2
+        self.path = path
+        self.mtime = mtime
+        self.gray = gray
+        self.edges = cv2.Canny(gray, 50, 150)
+        self._variants: Dict[Tuple[float, int, str], np.ndarray] = {}
+        self._lock = threading.Lock()
+
+    def variant(self, scale: float, level: int, mode: str) -> np.ndarray:
+        """按缩放比例缩放、再按与屏幕金字塔相同的方式逐层降采样后的模板（边缘图在该层灰度图上计算）"""
+        key = (scale, level, mode)
+        with self._lock:
+            cached = self._variants.get(key)
+        if cached is not None:
+            return cached
+        if mode == "edges":
+            gray = self.variant(scale, level, "gray")
+            result = self.edges if (scale == 1.0 and level == 0) else self.cv2.Canny(gray, 50, 150)
+        elif level > 0:
+            result = self.cv2.pyrDown(self.variant(scale, level - 1, "gray"))
+        elif scale == 1.0:
+            result = self.gray
+        else:
+            h, w = self.gray.shape[:2]
+            size = (max(1, int(round(w * scale))), max(1, int(round(h * scale))))
+            interpolation = self.cv2.INTER_AREA if scale < 1.0 else self.cv2.INTER_LINEAR
+            result = self.cv2.resize(self.gray, size, interpolation=interpolation)
+        with self._lock:
+            self._variants[key] = result
+        return result
+
+
+class TemplateRegistry:
+    """模板注册表
+
+    - load()/preload() 读取模板并缓存，文件修改时间变化后自动重新加载
+    - match() 在给定的屏幕金字塔上按各缩放比例做粗到细匹配，非极大值抑制后返回前 top_k 个结果
+    """
+
+    def __init__(self, cv2, scales: Sequence[float] = (1.0,), pyramid_levels: int = 2,
+                 threshold: float = 0.8, mode: str = "gray"):
+        self.cv2 = cv2
+        self.scales = tuple(scales) or (1.0,)
+        self.pyramid_levels = max(0, pyramid_levels)
+        self.threshold = threshold
+        self.mode = mode if mode in MATCH_MODES else "gray"
+        self._templates: Dict[str, _Template] = {}
+        self._lock = threading.Lock()
+
+    def load(self, path: str) -> Optional[_Template]:
+        """加载模板（已加载且文件未修改时直接返回缓存）"""
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return None
+        with self._lock:
+            cached = self._templates.get(path)
+            if cached is not None and cached.mtime == mtime:
+                return cached
+        image = self.cv2.imread(path, self.cv2.IMREAD_GRAYSCALE)
+        if image is None:
+            return None
+        template = _Template(self.cv2, path, mtime, image)
+        with self._lock:
+            self._templates[path] = template
+        return template
+
+    def preload(self, paths: Iterable[str]) -> int:
+        """预加载模板文件或目录下的所有模板，返回成功加载的数量"""
+        loaded = 0
+        for path in paths:
+            if os.path.isdir(path):
+                files = [os.path.join(root, name) for root, _, names in os.walk(path)
+                         for name in names if name.lower().endswith(TEMPLATE_EXTENSIONS)]
+            else:
+                files = [path]
+            for file in files:
+                if self.load(file) is not None:
+                    loaded += 1
+                else:
+                    logger.warning(f"无法加载模板图像: {file}")
+        if loaded:
+            logger.info(f"已预加载 {loaded} 个模板")
+        return loaded
+
+    def build_pyramid(self, rgb: np.ndarray) -> ScreenPyramid:
+        return ScreenPyramid(self.cv2, rgb, self.pyramid_levels)
+
+    def match(self, pyramid: ScreenPyramid, path: str, roi: Optional[Tuple[int, int, int, int]] = None,
+              top_k: int = 1, threshold: Optional[float] = None,
+              scales: Optional[Sequence[float]] = None) -> Optional[List[TemplateMatch]]:
+        """匹配模板；模板无法加载时返回None"""
+        template = self.load(path)
+        if template is None:
+            return None
+        threshold = self.threshold if threshold is None else threshold
+        screen = pyramid.level(0)
+        sh, sw = screen.shape[:2]
+        rx, ry, rw, rh = roi or (0, 0, sw, sh)
+        rx, ry = max(0, int(rx)), max(0, int(ry))
+        rw, rh = min(sw - rx, int(rw)), min(sh - ry, int(rh))
+        if rw <= 0 or rh <= 0:
+            return []
+
+        matches: List[TemplateMatch] = []
+        for scale in scales or self.scales:
+            full = template.variant(scale, 0, self.mode)
+            th, tw = full.shape[:2]
+            if tw > rw or th > rh or min(tw, th) < 4:
+                continue
+            level = 0
+            while (level < pyramid.levels and min(tw, th) / (2 ** (level + 1)) >= _MIN_COARSE_SIZE):
+                level += 1
+            coarse_screen = pyramid.level(level, self.mode)[ry >> level:(ry + rh) >> level,
+                                                            rx >> level:(rx + rw) >> level]
+            coarse_tpl = template.variant(scale, level, self.mode)
+            if (coarse_tpl.shape[0] > coarse_screen.shape[0] or coarse_tpl.shape[1] > coarse_screen.shape[1]):
+                continue
+            result = self.cv2.matchTemplate(coarse_screen, coarse_tpl, self.cv2.TM_CCOEFF_NORMED)
+            min_score = threshold - _COARSE_SLACK if level else threshold
+            for cx, cy, score in self._peaks(result, coarse_tpl.shape, top_k * 2 + 2, min_score):
+                if level == 0:
+                    matches.append(TemplateMatch(rx + cx, ry + cy, tw, th, score, scale))
+                    continue
+                # 在原分辨率的小窗口内精确定位
+                fx, fy = rx + (cx << level), ry + (cy << level)
+                margin = 2 << level
+                x0, y0 = max(rx, fx - margin), max(ry, fy - margin)
+                x1, y1 = min(rx + rw, fx + tw + margin), min(ry + rh, fy + th + margin)
+                window = pyramid.level(0, self.mode)[y0:y1, x0:x1]
+                if window.shape[0] < th or window.shape[1] < tw:
+                    continue
+                refined = self.cv2.matchTemplate(window, full, self.cv2.TM_CCOEFF_NORMED)
+                _, best, _, loc = self.cv2.minMaxLoc(refined)
+                if best >= threshold:
+                    matches.append(TemplateMatch(x0 + loc[0], y0 + loc[1], tw, th, float(best), scale))
+
+        matches.sort(key=lambda m: m.score, reverse=True)
+        kept: List[TemplateMatch] = []
+        for match in matches:
+            if all(_iou(match, other) < 0.3 for other in kept):
+                kept.append(match)
+                if len(kept) >= top_k:
+                    break
+        return kept
+
+    def _peaks(self, result: np.ndarray, template_shape, count: int, min_score: float) -> List[Tuple[int, int, float]]:
+        """取匹配图上的若干个峰值，每取一个就抑制其邻域"""
+        result = np.nan_to_num(result, nan=-1.0, posinf=-1.0, neginf=-1.0)
+        half_h, half_w = max(1, template_shape[0] // 2), max(1, template_shape[1] // 2)
+        peaks = []
+        for _ in range(count):
+            _, score, _, (x, y) = self.cv2.minMaxLoc(result)
+            if score < min_score:
+                break
+            peaks.append((x, y, float(score)))
+            result[max(0, y - half_h):y + half_h + 1, max(0, x - half_w):x + half_w + 1] = -1.0
+        return peaks
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "templates": len(self._templates),
+            "scales": list(self.scales),
+            "pyramid_levels": self.pyramid_levels,
+            "mode": self.mode,
+        }
+
+
+# 全局模板注册表（进程内共享，模板只加载一次）
+_template_registry: Optional[TemplateRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_template_registry(cv2) -> TemplateRegistry:
+    """获取全局模板注册表，首次创建时预加载配置中的模板目录"""
+    global _template_registry
+    with _registry_lock:
+        if _template_registry is None:
+            try:
+                from system.config import config
+                cc = config.computer_control
+                registry = TemplateRegistry(cv2, scales=cc.template_scales, pyramid_levels=cc.template_pyramid_levels,
+                                            threshold=cc.template_match_threshold, mode=cc.template_match_mode)
+                template_dirs = list(cc.template_dirs)
+            except Exception:
+                registry, template_dirs = TemplateRegistry(cv2), []
+            registry.preload(template_dirs)
+            _template_registry = registry
+        return _template_registry
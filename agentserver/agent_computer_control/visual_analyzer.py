@@ -4,8 +4,9 @@
 AI坐标定位算法升级
 """
 
+import asyncio
 import logging
-from typing import Dict, Any, Optional, Tuple, List
+from typing import Dict, Any, Optional, Tuple, List, Union
 import sys
 if 'nagaagent_core.vendors.pil' in sys.modules:
     del sys.modules['nagaagent_core.vendors.pil']
@@ -14,10 +15,48 @@ import io
 import base64
 import re
 import json
+import numpy as np
+
+from .analysis_cache import AnalysisCache, FrameAnalysis, content_hash
+from .screen_capture import Frame, Region, diff_regions
 
 # 配置日志
 logger = logging.getLogger(__name__)
 
+# 截图可以是编码后的字节、采集服务返回的帧或RGB数组
+Screenshot = Union[bytes, Frame, np.ndarray]
+
+# 增量分析时变化区域向外扩展的像素，避免文字/控件被区域边界截断
+_REGION_PADDING = 16
+
+
+def _intersects(bbox: Dict[str, int], region: Region) -> bool:
+    x, y, w, h = region
+    return (bbox["x"] < x + w and bbox["x"] + bbox["width"] > x
+            and bbox["y"] < y + h and bbox["y"] + bbox["height"] > y)
+
+
+def _merge_regions(regions: List[Region]) -> List[Region]:
+    """合并相互重叠的区域，避免同一块内容被重复识别"""
+    merged = list(regions)
+    changed = True
+    while changed:
+        changed = False
+        result: List[Region] = []
+        for region in merged:
+            for i, other in enumerate(result):
+                if _intersects({"x": region[0], "y": region[1], "width": region[2], "height": region[3]}, other):
+                    x1, y1 = min(region[0], other[0]), min(region[1], other[1])
+                    x2 = max(region[0] + region[2], other[0] + other[2])
+                    y2 = max(region[1] + region[3], other[1] + other[3])
+                    result[i] = (x1, y1, x2 - x1, y2 - y1)
+                    changed = True
+                    break
+            else:
+                result.append(region)
+        merged = result
+    return merged
+
 class VisualAnalyzer:
     """视觉分析器"""
     
@@ -46,6 +85,12 @@ class VisualAnalyzer:
         except ImportError:
             logger.warning("opencv-python未安装，图像匹配功能不可用")
         
+        # 模板注册表（进程内共享，模板只加载一次）
+        self.templates = None
+        if self.image_matching_available:
+            from .template_matching import get_template_registry
+            self.templates = get_template_registry(self.cv2)
+        
         # 尝试导入AI坐标定位库
         try:
             from langchain_openai import ChatOpenAI
@@ -53,32 +98,114 @@ class VisualAnalyzer:
             logger.info("AI坐标定位功能已启用")
         except ImportError:
             logger.warning("langchain-openai未安装，AI坐标定位功能不可用")
+        
+        # 按帧哈希缓存分析结果；新帧的上一帧已分析过时只需重新分析变化区域
+        try:
+            from system.config import config
+            cache_size = config.computer_control.analysis_cache_size
+            self.text_match_threshold = config.computer_control.text_match_threshold
+        except Exception:
+            cache_size, self.text_match_threshold = 16, 0.8
+        self._cache = AnalysisCache(cache_size)
+    
+    def _frame_key(self, screenshot: Screenshot) -> str:
+        """截图的缓存键：帧使用 frame_hash，其余按内容哈希"""
+        if isinstance(screenshot, Frame):
+            return screenshot.frame_hash
+        if isinstance(screenshot, np.ndarray):
+            return content_hash(f"{screenshot.shape}".encode() + np.ascontiguousarray(screenshot).tobytes())
+        return content_hash(bytes(screenshot))
+    
+    def _to_array(self, screenshot: Screenshot) -> np.ndarray:
+        """转换为RGB数组；帧直接使用其数组，不经过编码/解码"""
+        if isinstance(screenshot, Frame):
+            return screenshot.array
+        if isinstance(screenshot, np.ndarray):
+            return screenshot
+        return np.asarray(Image.open(io.BytesIO(screenshot)).convert("RGB"))
+    
+    async def _encode_for_vision(self, screenshot: Screenshot) -> Tuple[str, str]:
+        """编码为发给视觉模型的base64数据，返回 (base64, MIME类型)"""
+        if isinstance(screenshot, np.ndarray):
+            screenshot = Frame(np.ascontiguousarray(screenshot))
+        if isinstance(screenshot, Frame):
+            from system.config import config
+            cc = getattr(config, 'computer_control', None)
+            fmt = (getattr(cc, 'vision_image_format', None) or "PNG").upper()
+            data = await screenshot.encode_async(fmt, getattr(cc, 'vision_jpeg_quality', 85))
+            return base64.b64encode(data).decode('utf-8'), screenshot.mime_type(fmt)
+        return base64.b64encode(screenshot).decode('utf-8'), "image/png"
     
-    async def analyze_screenshot(self, screenshot: bytes) -> Dict[str, Any]:
-        """分析屏幕截图"""
+    async def _analyzed(self, screenshot: Screenshot) -> FrameAnalysis:
+        """获取截图的分析缓存条目，未分析过时先做分析
+        
+        传入采集服务的帧且其上一帧已在缓存中时，只在变化区域重新做OCR与元素检测
+        """
+        key = self._frame_key(screenshot)
+        entry = self._cache.entry(key)
+        if entry.analysis is not None:
+            self._cache.count("analysis", True)
+            return entry
+        # 同一帧的并发请求共用一次分析
+        if entry.pending is not None and not entry.pending.done():
+            self._cache.count("analysis", True)
+            await asyncio.shield(entry.pending)
+            return entry
+        self._cache.count("analysis", False)
+        entry.pending = asyncio.get_running_loop().create_task(self._run_analysis(screenshot, entry))
         try:
-            # 加载图像
-            image = Image.open(io.BytesIO(screenshot))
-            
+            await asyncio.shield(entry.pending)
+        finally:
+            if entry.pending is not None and entry.pending.done():
+                entry.pending = None
+        return entry
+    
+    async def _run_analysis(self, screenshot: Screenshot, entry: FrameAnalysis):
+        frame = screenshot if isinstance(screenshot, Frame) else None
+        base, dirty_regions = None, None
+        if frame is not None:
+            entry.tile_key = (frame.size, frame.tile_size)
+            entry.tile_hashes = frame.tile_hashes
+            previous = self._cache.peek(frame.previous_hash) if frame.dirty_regions is not None else None
+            if previous is not None and previous.analysis is not None:
+                base, dirty_regions = previous, frame.dirty_regions
+            else:
+                # 上一帧没有分析过（例如界面动画的中间帧）：与最近分析过的同尺寸帧比较图块哈希
+                base = self._cache.latest_analyzed(entry.tile_key, exclude=entry.frame_hash)
+                if base is not None:
+                    dirty_regions = diff_regions(base.tile_hashes, frame.tile_hashes,
+                                                 frame.tile_size, frame.width, frame.height)
+        if base is not None:
+            analysis_result = await self._analyze_incremental(frame, base.analysis, dirty_regions)
+        else:
+            array = self._to_array(screenshot)
             analysis_result = {
-                "image_size": image.size,
-                "mode": image.mode,
+                "image_size": (array.shape[1], array.shape[0]),
+                "mode": "RGB",
                 "ocr_text": [],
                 "elements": [],
-                "analysis_time": None
+                "analysis_time": None,
+                "incremental": False
             }
             
             # OCR文本识别
             if self.ocr_available:
-                ocr_result = await self._extract_text_from_image(image)
+                ocr_result = await self._extract_text_from_image(array)
                 analysis_result["ocr_text"] = ocr_result
             
             # 元素检测
-            elements = await self._detect_elements(image)
+            elements = await self._detect_elements(array)
             analysis_result["elements"] = elements
-            
-            logger.info(f"屏幕分析完成: 识别到 {len(analysis_result['ocr_text'])} 个文本, {len(elements)} 个元素")
-            return analysis_result
+        
+        analysis_result["frame_hash"] = entry.frame_hash
+        entry.set_analysis(analysis_result)
+        logger.info(f"屏幕分析完成: 识别到 {len(analysis_result['ocr_text'])} 个文本, {len(analysis_result['elements'])} 个元素")
+    
+    async def analyze_screenshot(self, screenshot: Screenshot) -> Dict[str, Any]:
+        """分析屏幕截图（同一画面的结果直接取自缓存）"""
+        try:
+            entry = await self._analyzed(screenshot)
+            return entry.analysis
             
         except Exception as e:
             logger.error(f"屏幕分析失败: {e}")
@@ -89,11 +216,55 @@ class VisualAnalyzer:
                 "elements": []
             }
     
-    async def _extract_text_from_image(self, image: Image.Image) -> List[Dict[str, Any]]:
-        """从图像中提取文本"""
+    async def _analyze_incremental(self, frame: Frame, previous: Dict[str, Any],
+                                   dirty_regions: List[Region]) -> Dict[str, Any]:
+        """基于之前某一帧的分析结果，只重新识别与该帧相比的变化区域"""
+        regions = []
+        for x, y, w, h in dirty_regions:
+            x1, y1 = max(0, x - _REGION_PADDING), max(0, y - _REGION_PADDING)
+            x2 = min(frame.width, x + w + _REGION_PADDING)
+            y2 = min(frame.height, y + h + _REGION_PADDING)
+            regions.append((x1, y1, x2 - x1, y2 - y1))
+        regions = _merge_regions(regions)
+        
+        # 与变化区域相交的旧结果作废；把这些旧结果的范围并入区域，保证被部分覆盖的控件完整重识别
+        stale = [item["bbox"] for item in previous["ocr_text"] + previous["elements"]
+                 if any(_intersects(item["bbox"], r) for r in regions)]
+        regions = _merge_regions(regions + [(b["x"], b["y"], b["width"], b["height"]) for b in stale])
+        
+        ocr_text = [t for t in previous["ocr_text"] if not any(_intersects(t["bbox"], r) for r in regions)]
+        elements = [e for e in previous["elements"] if not any(_intersects(e["bbox"], r) for r in regions)]
+        for region in regions:
+            crop = frame.crop(region)
+            if self.ocr_available:
+                ocr_text.extend(self._offset(item, region) for item in await self._extract_text_from_image(crop))
+            elements.extend(self._offset(item, region) for item in await self._detect_elements(crop))
+        
+        return {
+            "image_size": frame.size,
+            "mode": "RGB",
+            "ocr_text": ocr_text,
+            "elements": elements,
+            "analysis_time": None,
+            "incremental": True,
+            "reanalyzed_regions": regions
+        }
+    
+    @staticmethod
+    def _offset(item: Dict[str, Any], region: Region) -> Dict[str, Any]:
+        """把区域内识别结果的坐标换算为整帧坐标"""
+        bbox = dict(item["bbox"])
+        bbox["x"] += region[0]
+        bbox["y"] += region[1]
+        return {**item, "bbox": bbox}
+    
+    async def _extract_text_from_image(self, image: Union[Image.Image, np.ndarray]) -> List[Dict[str, Any]]:
+        """从图像中提取文本（在工作线程中执行）"""
         if not self.ocr_available:
             return []
-        
+        return await asyncio.to_thread(self._extract_text_sync, image)
+    
+    def _extract_text_sync(self, image: Union[Image.Image, np.ndarray]) -> List[Dict[str, Any]]:
         try:
             import nagaagent_core.vendors.pytesseract as pytesseract
             
@@ -121,17 +292,17 @@ class VisualAnalyzer:
             logger.error(f"OCR文本提取失败: {e}")
             return []
     
-    async def _detect_elements(self, image: Image.Image) -> List[Dict[str, Any]]:
-        """检测图像中的元素"""
+    async def _detect_elements(self, image: Union[Image.Image, np.ndarray]) -> List[Dict[str, Any]]:
+        """检测图像中的元素（在工作线程中执行）"""
         if not self.image_matching_available:
             return []
-        
+        return await asyncio.to_thread(self._detect_elements_sync, image)
+    
+    def _detect_elements_sync(self, image: Union[Image.Image, np.ndarray]) -> List[Dict[str, Any]]:
         try:
-            # 转换为OpenCV格式
-            cv_image = self.cv2.cvtColor(self.np.array(image), self.cv2.COLOR_RGB2BGR)
-            
             # 检测边缘
-            gray = self.cv2.cvtColor(cv_image, self.cv2.COLOR_BGR2GRAY)
+            rgb = np.ascontiguousarray(image) if isinstance(image, np.ndarray) else self.np.asarray(image.convert("RGB"))
+            gray = self.cv2.cvtColor(rgb, self.cv2.COLOR_RGB2GRAY)
             edges = self.cv2.Canny(gray, 50, 150)
             
             # 查找轮廓
@@ -156,61 +327,78 @@ class VisualAnalyzer:
             logger.error(f"元素检测失败: {e}")
             return []
     
-    async def find_text_element(self, screenshot: bytes, target_text: str) -> Optional[Tuple[int, int]]:
+    async def find_text_element(self, screenshot: Screenshot, target_text: str) -> Optional[Tuple[int, int]]:
         """查找包含指定文本的元素位置"""
         try:
-            analysis = await self.analyze_screenshot(screenshot)
-            
-            for text_element in analysis.get("ocr_text", []):
-                if target_text.lower() in text_element["text"].lower():
-                    bbox = text_element["bbox"]
-                    # 返回中心坐标
-                    center_x = bbox["x"] + bbox["width"] // 2
-                    center_y = bbox["y"] + bbox["height"] // 2
-                    return (center_x, center_y)
-            
-            return None
+            entry = await self._analyzed(screenshot)
+            # 在文本索引中查找（精确 > 包含 > 模糊），返回中心坐标
+            return entry.text_index.find_center(target_text, self.text_match_threshold)
             
         except Exception as e:
             logger.error(f"查找文本元素失败: {e}")
             return None
     
-    async def find_image_element(self, screenshot: bytes, template_path: str) -> Optional[Tuple[int, int]]:
-        """查找图像模板匹配的元素位置"""
-        if not self.image_matching_available:
-            return None
+    async def match_template(self, screenshot: Screenshot, template_path: str, roi=None,
+                             top_k: int = 1, threshold: Optional[float] = None) -> List[Dict[str, Any]]:
+        """多尺度模板匹配，返回按分数排序的前 top_k 个结果
+        
+        roi 为 {"x", "y", "width", "height"} 或 [x, y, width, height]，只在该区域内搜索
+        """
+        if not self.image_matching_available or self.templates is None:
+            return []
         
         try:
-            # 加载模板图像
-            template = self.cv2.imread(template_path)
-            if template is None:
+            roi = self._normalize_roi(roi)
+            entry = self._cache.entry(self._frame_key(screenshot))
+            match_key = (template_path, roi, top_k, threshold)
+            if match_key in entry.template_matches:
+                self._cache.count("template", True)
+                return entry.template_matches[match_key]
+            self._cache.count("template", False)
+            
+            # 屏幕金字塔每帧只构建一次
+            if entry.pyramid is None:
+                entry.pyramid = await asyncio.to_thread(self.templates.build_pyramid, self._to_array(screenshot))
+            matches = await asyncio.to_thread(self.templates.match, entry.pyramid, template_path, roi, top_k, threshold)
+            if matches is None:
                 logger.error(f"无法加载模板图像: {template_path}")
-                return None
-            
-            # 加载屏幕截图
-            screen_image = Image.open(io.BytesIO(screenshot))
-            screen_cv = self.cv2.cvtColor(self.np.array(screen_image), self.cv2.COLOR_RGB2BGR)
+                return []
             
-            # 模板匹配
-            result = self.cv2.matchTemplate(screen_cv, template, self.cv2.TM_CCOEFF_NORMED)
-            min_val, max_val, min_loc, max_loc = self.cv2.minMaxLoc(result)
-            
-            # 如果匹配度足够高
-            if max_val > 0.8:
-                # 返回模板中心位置
-                center_x = max_loc[0] + template.shape[1] // 2
-                center_y = max_loc[1] + template.shape[0] // 2
-                return (center_x, center_y)
-            
-            return None
+            result = [m.to_dict() for m in matches]
+            entry.template_matches[match_key] = result
+            return result
             
         except Exception as e:
             logger.error(f"图像匹配失败: {e}")
+            return []
+    
+    @staticmethod
+    def _normalize_roi(roi) -> Optional[Tuple[int, int, int, int]]:
+        if not roi:
             return None
+        if isinstance(roi, dict):
+            return (int(roi["x"]), int(roi["y"]), int(roi["width"]), int(roi["height"]))
+        x, y, w, h = roi
+        return (int(x), int(y), int(w), int(h))
     
-    async def get_screen_info(self, screenshot: bytes) -> Dict[str, Any]:
+    async def find_image_element(self, screenshot: Screenshot, template_path: str,
+                                 roi=None) -> Optional[Tuple[int, int]]:
+        """查找图像模板匹配的元素位置"""
+        matches = await self.match_template(screenshot, template_path, roi=roi, top_k=1)
+        return matches[0]["center"] if matches else None
+    
+    async def get_screen_info(self, screenshot: Screenshot) -> Dict[str, Any]:
         """获取屏幕信息"""
         try:
+            if not isinstance(screenshot, (bytes, bytearray)):
+                array = self._to_array(screenshot)
+                return {
+                    "width": array.shape[1],
+                    "height": array.shape[0],
+                    "mode": "RGB",
+                    "format": None,
+                    "size_bytes": array.nbytes
+                }
             image = Image.open(io.BytesIO(screenshot))
             
             return {
@@ -229,7 +417,7 @@ class VisualAnalyzer:
                 "height": 0
             }
     
-    async def locate_element_with_ai(self, target_description: str, screenshot: bytes, 
+    async def locate_element_with_ai(self, target_description: str, screenshot: Screenshot, 
                                    screen_width: int = 1920, screen_height: int = 1080) -> Optional[Tuple[int, int]]:
         """
         使用AI定位屏幕元素
@@ -240,6 +428,14 @@ class VisualAnalyzer:
             return None
         
         try:
+            # 同一画面、同一目标的定位结果直接复用
+            entry = self._cache.entry(self._frame_key(screenshot))
+            location_key = (target_description, screen_width, screen_height)
+            if location_key in entry.ai_locations:
+                self._cache.count("ai", True)
+                return entry.ai_locations[location_key]
+            self._cache.count("ai", False)
+            
             from langchain_openai import ChatOpenAI
             # 统一从系统配置读取视觉LLM参数
             from system.config import config
@@ -256,8 +452,8 @@ class VisualAnalyzer:
                 temperature=0
             )
             
-            # 将截图转换为base64
-            screenshot_b64 = base64.b64encode(screenshot).decode('utf-8')
+            # 将截图转换为base64（帧在此时才编码）
+            screenshot_b64, mime_type = await self._encode_for_vision(screenshot)
             
             # 构建AI定位提示词
             prompt = f"""
@@ -272,12 +468,12 @@ class VisualAnalyzer:
             """
             
             # 调用AI模型进行坐标定位
-            response = llm.invoke([
+            response = await llm.ainvoke([
                 {
                     "role": "user", 
                     "content": [
                         {"type": "text", "text": prompt},
-                        {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{screenshot_b64}"}}
+                        {"type": "image_url", "image_url": {"url": f"data:{mime_type};base64,{screenshot_b64}"}}
                     ]
                 }
             ])
@@ -287,6 +483,7 @@ class VisualAnalyzer:
             
             if coordinates:
                 logger.info(f"AI定位成功: {target_description} -> {coordinates}")
+                entry.ai_locations[location_key] = coordinates
                 return coordinates
             else:
                 logger.warning(f"AI定位失败: {target_description}")
@@ -356,12 +553,19 @@ class VisualAnalyzer:
             logger.error(f"坐标解析失败: {e}")
             return None
     
-    async def locate_element(self, target: str, screenshot: bytes) -> Optional[Tuple[int, int]]:
+    async def locate_element(self, target: str, screenshot: Screenshot) -> Optional[Tuple[int, int]]:
         """
         智能元素定位，优先使用AI定位，回退到传统方法
         多层次定位策略
         """
         try:
+            # target是图像路径时直接做模板匹配
+            is_template = target.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp'))
+            if self.image_matching_available and is_template:
+                image_result = await self.find_image_element(screenshot, target)
+                if image_result:
+                    return image_result
+            
             # 首先尝试AI定位
             if self.ai_coordinate_available:
                 ai_result = await self.locate_element_with_ai(target, screenshot)
@@ -374,12 +578,6 @@ class VisualAnalyzer:
                 if text_result:
                     return text_result
             
-            # 回退到图像匹配（如果target是图像路径）
-            if self.image_matching_available and target.endswith(('.png', '.jpg', '.jpeg')):
-                image_result = await self.find_image_element(screenshot, target)
-                if image_result:
-                    return image_result
-            
             logger.warning(f"无法定位元素: {target}")
             return None
             
@@ -393,5 +591,7 @@ class VisualAnalyzer:
             "ocr_available": self.ocr_available,
             "image_matching_available": self.image_matching_available,
             "ai_coordinate_available": self.ai_coordinate_available,
+            "analysis_cache": self._cache.stats(),
+            "templates": self.templates.stats() if self.templates else None,
             "ready": self.ocr_available or self.image_matching_available or self.ai_coordinate_available
         }
\ No newline at end of file
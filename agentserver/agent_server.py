@@ -17,6 +17,7 @@ from contextlib import asynccontextmanager
 
 from system.config import config
 from system.background_analyzer import get_background_analyzer
+from system.callback_dispatcher import get_callback_dispatcher
 from agentserver.agent_computer_control import ComputerControlAgent
 from agentserver.task_scheduler import get_task_scheduler, TaskStep
 from agentserver.toolkit_manager import toolkit_manager
@@ -51,6 +52,9 @@ async def lifespan(app: FastAPI):
             }
             Modules.task_scheduler.set_llm_config(llm_config)
         
+        # 启动回调投递器（重放上次未投递的任务结果回调）
+        get_callback_dispatcher("agent_server").start()
+        
         logger.info("NagaAgent电脑控制服务初始化完成")
     except Exception as e:
         logger.error(f"服务初始化失败: {e}")
@@ -61,6 +65,7 @@ async def lifespan(app: FastAPI):
 
     # shutdown
     try:
+        await get_callback_dispatcher("agent_server").close()
         logger.info("NagaAgent电脑控制服务已关闭")
     except Exception as e:
         logger.error(f"服务关闭失败: {e}")
@@ -106,64 +111,58 @@ async def _process_computer_control_task(instruction: str, session_id: Optional[
             "instruction": instruction
         }
 
+# 电脑控制任务默认独占鼠标/键盘；agent_call 可以用 "resources" 显式声明（如不操作输入设备的任务传空列表）
+_DEFAULT_AGENT_RESOURCES = ["input"]
+
 async def _execute_agent_tasks_async(agent_calls: List[Dict[str, Any]], session_id: str, 
                                    analysis_session_id: str, request_id: str, callback_url: Optional[str] = None):
-    """异步执行Agent任务 - 应用与MCP服务器相同的会话管理逻辑"""
+    """异步执行Agent任务 - 应用与MCP服务器相同的会话管理逻辑
+
+    各任务交给任务调度器并行执行：占用同一资源（鼠标/键盘）的任务串行，其余任务在并发上限内同时执行；
+    每个任务完成即回调一次（partial=True），全部完成后再发送汇总回调
+    """
     try:
         logger.info(f"[异步执行] 开始执行 {len(agent_calls)} 个Agent任务")
         
-        # 处理每个Agent任务
-        results = []
+        tasks = []
         for i, agent_call in enumerate(agent_calls):
-            try:
-                instruction = agent_call.get("instruction", "")
-                tool_name = agent_call.get("tool_name", "未知工具")
-                service_name = agent_call.get("service_name", "未知服务")
-                
-                logger.info(f"[异步执行] 执行任务 {i+1}/{len(agent_calls)}: {tool_name} - {instruction}")
-                
-                # 添加任务步骤到调度器
-                await Modules.task_scheduler.add_task_step(request_id, TaskStep(
-                    step_id=f"step_{i+1}",
-                    task_id=request_id,
-                    purpose=f"执行Agent任务: {tool_name}",
-                    content=instruction,
-                    output="",
-                    analysis=None,
-                    success=True
-                ))
-                
-                # 执行电脑控制任务
-                result = await _process_computer_control_task(instruction, session_id)
-                results.append({
-                    "agent_call": agent_call,
-                    "result": result,
-                    "step_index": i
-                })
-                
-                # 更新任务步骤结果
-                await Modules.task_scheduler.add_task_step(request_id, TaskStep(
-                    step_id=f"step_{i+1}_result",
-                    task_id=request_id,
-                    purpose=f"任务结果: {tool_name}",
-                    content=f"执行结果: {result.get('success', False)}",
-                    output=str(result.get('result', '')),
-                    analysis={"analysis": f"任务类型: {result.get('task_type', 'unknown')}, 工具: {tool_name}, 服务: {service_name}"},
-                    success=result.get('success', False),
-                    error=result.get('error')
-                ))
-                
-                logger.info(f"[异步执行] 任务 {i+1} 完成: {result.get('success', False)}")
-                
-            except Exception as e:
-                logger.error(f"[异步执行] 任务 {i+1} 执行失败: {e}")
-                results.append({
-                    "agent_call": agent_call,
-                    "result": {"success": False, "error": str(e)},
-                    "step_index": i
-                })
-        
-        # 发送回调通知（如果提供了回调URL）
+            tool_name = agent_call.get("tool_name", "未知工具")
+            service_name = agent_call.get("service_name", "未知服务")
+            resources = agent_call.get("resources")
+            tasks.append({
+                "step_id": f"step_{i+1}",
+                "type": "computer_control",
+                "purpose": f"执行Agent任务: {tool_name}",
+                "content": agent_call.get("instruction", ""),
+                "params": agent_call,
+                "analysis": f"工具: {tool_name}, 服务: {service_name}",
+                "resources": _DEFAULT_AGENT_RESOURCES if resources is None else resources,
+            })
+        
+        results: List[Optional[Dict[str, Any]]] = [None] * len(tasks)
+        
+        async def _run(task: Dict[str, Any]) -> Dict[str, Any]:
+            logger.info(f"[异步执行] 执行任务 {task['step_id']}: {task['purpose']} - {task['content']}")
+            return await _process_computer_control_task(task["content"], session_id)
+        
+        async def _on_result(index: int, task: Dict[str, Any], result: Dict[str, Any]):
+            entry = {
+                "agent_call": task["params"],
+                "result": result,
+                "step_index": index
+            }
+            results[index] = entry
+            logger.info(f"[异步执行] 任务 {index+1} 完成: {result.get('success', False)}")
+            if callback_url:
+                completed = sum(1 for r in results if r is not None)
+                await _send_step_callback(callback_url, request_id, session_id, analysis_session_id,
+                                          entry, completed, len(tasks))
+        
+        await Modules.task_scheduler.schedule_parallel_execution(
+            tasks, executor=_run, on_result=_on_result, task_id=request_id
+        )
+        
+        # 发送汇总回调通知（如果提供了回调URL）
         if callback_url:
             await _send_callback_notification(callback_url, request_id, session_id, analysis_session_id, results)
         
@@ -175,28 +174,47 @@ async def _execute_agent_tasks_async(agent_calls: List[Dict[str, Any]], session_
         if callback_url:
             await _send_callback_notification(callback_url, request_id, session_id, analysis_session_id, [], str(e))
 
+async def _send_step_callback(callback_url: str, request_id: str, session_id: str, analysis_session_id: str,
+                              entry: Dict[str, Any], completed: int, total: int):
+    """单个任务完成后的回调（partial=True）"""
+    try:
+        result = entry["result"]
+        callback_payload = {
+            "request_id": request_id,
+            "session_id": session_id,
+            "analysis_session_id": analysis_session_id,
+            "partial": True,
+            "success": result.get("success", False),
+            "error": result.get("error"),
+            "step_index": entry["step_index"],
+            "result": entry,
+            "completed_steps": completed,
+            "total_steps": total,
+            "completed_at": _now_iso()
+        }
+        
+        await get_callback_dispatcher("agent_server").send(callback_url, callback_payload)
+        
+    except Exception as e:
+        logger.error(f"[回调通知] 发送Agent任务步骤回调失败: {e}")
+
 async def _send_callback_notification(callback_url: str, request_id: str, session_id: str, 
                                     analysis_session_id: str, results: List[Dict[str, Any]], error: Optional[str] = None):
-    """发送回调通知 - 应用与MCP服务器相同的回调机制"""
+    """发送汇总回调通知 - 与MCP服务器共用回调投递器（发件箱 + 退避重试）"""
     try:
-        import httpx
-        
         callback_payload = {
             "request_id": request_id,
             "session_id": session_id,
             "analysis_session_id": analysis_session_id,
+            "partial": False,
             "success": error is None,
             "error": error,
             "results": results,
             "completed_at": _now_iso()
         }
         
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            response = await client.post(callback_url, json=callback_payload)
-            if response.status_code == 200:
-                logger.info(f"[回调通知] Agent任务结果回调成功: {request_id}")
-            else:
-                logger.error(f"[回调通知] Agent任务结果回调失败: {response.status_code}")
+        await get_callback_dispatcher("agent_server").send(callback_url, callback_payload)
+        logger.info(f"[回调通知] Agent任务结果回调已加入投递队列: {request_id}")
                 
     except Exception as e:
         logger.error(f"[回调通知] 发送Agent任务回调失败: {e}")
@@ -43,6 +43,9 @@ class TaskSchedulerConfig:
     enable_auto_compression: bool = True    # 是否启用自动压缩
     compression_timeout: int = 30           # 压缩超时时间（秒）
     max_compression_retries: int = 3        # 最大压缩重试次数
+    
+    # 并行执行
+    max_parallel_tasks: int = 4             # 并行调度时同时执行的最大任务数
 
 # 默认任务调度器配置实例
 DEFAULT_TASK_SCHEDULER_CONFIG = TaskSchedulerConfig()
@@ -3,11 +3,13 @@
 """通用任务调度器 - 融合智能记忆管理的任务调度系统"""
 
 import asyncio  # 异步支持 #
+import inspect  # 回调类型判断 #
 import uuid  # 任务ID #
 import json  # JSON处理 #
 import logging  # 日志 #
 import time  # 时间处理 #
-from typing import Any, Dict, List, Optional, Union  # 类型标注 #
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Union  # 类型标注 #
+from contextlib import AsyncExitStack  # 资源锁组合 #
 from dataclasses import dataclass, field  # 数据类 #
 from datetime import datetime, timedelta  # 时间处理 #
 
@@ -52,6 +54,8 @@ class _TaskScheduler:
         # 基础任务管理
         self.task_registry: Dict[str, Dict[str, Any]] = {}  # 任务注册表
         self._lock = asyncio.Lock()  # 并发锁
+        self._compress_locks: Dict[str, asyncio.Lock] = {}  # 按任务的记忆压缩锁
+        self._resource_locks: Dict[str, asyncio.Lock] = {}  # 独占资源锁（如鼠标/键盘）
         
         # 智能记忆管理
         self.max_steps = config.max_steps  # 最大保存步骤数
@@ -118,39 +122,48 @@ class _TaskScheduler:
             return task_id
 
     async def add_task_step(self, task_id: str, step: TaskStep) -> None:
-        """添加任务步骤到历史记录，并更新会话级别的记忆管理"""
-        async with self._lock:
-            if task_id not in self.task_steps:
-                self.task_steps[task_id] = []
-            
-            self.task_steps[task_id].append(step)
-            
-            # 提取关键事实
-            self._extract_key_facts(step)
-            
-            # 记录失败尝试
+        """添加任务步骤到历史记录，并更新会话级别的记忆管理
+
+        记录本身不含await，在事件循环内不会被打断，因此不占用全局锁；
+        只有记忆压缩需要等待LLM，按任务加锁，同一任务同时只压缩一次
+        """
+        self._record_step(task_id, step)
+
+        # 检查是否需要压缩记忆（压缩进行中时跳过，后续步骤会再次触发）
+        if len(self.task_steps[task_id]) >= self.compression_threshold:
+            lock = self._compress_locks.setdefault(task_id, asyncio.Lock())
+            if lock.locked():
+                return
+            async with lock:
+                if len(self.task_steps.get(task_id, [])) >= self.compression_threshold:
+                    await self._compress_memory(task_id)
+
+    def _record_step(self, task_id: str, step: TaskStep) -> None:
+        """追加步骤并更新关键事实、失败尝试与会话记忆"""
+        self.task_steps.setdefault(task_id, []).append(step)
+
+        # 提取关键事实
+        self._extract_key_facts(step)
+
+        # 记录失败尝试
+        if not step.success:
+            self.failed_attempts[step.content] = self.failed_attempts.get(step.content, 0) + 1
+
+        # 会话级别的记忆管理
+        session_id = self.session_task_mapping.get(task_id)
+        if session_id and session_id in self.session_memories:
+            # 更新会话记忆中的关键事实
+            fact_key = f"task:{task_id}:step:{step.step_id}"
+            if fact_key in self.key_facts:
+                self.session_memories[session_id]["key_facts"][fact_key] = self.key_facts[fact_key]
+
+            # 更新会话记忆中的失败尝试
             if not step.success:
-                self.failed_attempts[step.content] = self.failed_attempts.get(step.content, 0) + 1
-            
-            # 会话级别的记忆管理
-            session_id = self.session_task_mapping.get(task_id)
-            if session_id and session_id in self.session_memories:
-                # 更新会话记忆中的关键事实
-                fact_key = f"task:{task_id}:step:{step.step_id}"
-                if fact_key in self.key_facts:
-                    self.session_memories[session_id]["key_facts"][fact_key] = self.key_facts[fact_key]
-                
-                # 更新会话记忆中的失败尝试
-                if not step.success:
-                    session_failed = self.session_memories[session_id]["failed_attempts"]
-                    session_failed[step.content] = session_failed.get(step.content, 0) + 1
-                
-                # 更新会话活动时间
-                self.session_memories[session_id]["last_activity"] = time.time()
-            
-            # 检查是否需要压缩记忆
-            if len(self.task_steps[task_id]) >= self.compression_threshold:
-                await self._compress_memory(task_id)
+                session_failed = self.session_memories[session_id]["failed_attempts"]
+                session_failed[step.content] = session_failed.get(step.content, 0) + 1
+
+            # 更新会话活动时间
+            self.session_memories[session_id]["last_activity"] = time.time()
 
     def _extract_key_facts(self, step: TaskStep) -> None:
         """从步骤中提取关键事实"""
@@ -174,6 +187,9 @@ class _TaskScheduler:
         
         logger.info(f"开始压缩任务 {task_id} 的记忆...")
         
+        # 压缩期间可能有新步骤追加，只清理参与本次压缩的部分
+        compressed_count = len(self.task_steps[task_id])
+        
         # 构建压缩提示
         prompt = self._build_compression_prompt(task_id)
         
@@ -218,9 +234,11 @@ class _TaskScheduler:
             )
             self.compressed_memories.append(error_memory)
         
-        # 清空历史记录，保留最后几步
-        keep_last = min(self.keep_last_steps, len(self.task_steps[task_id]))
-        self.task_steps[task_id] = self.task_steps[task_id][-keep_last:]
+        # 清空历史记录，保留最后几步（任务记忆可能已在压缩期间被清除）
+        steps = self.task_steps.get(task_id)
+        if steps is not None:
+            keep_last = min(self.keep_last_steps, compressed_count)
+            self.task_steps[task_id] = steps[compressed_count - keep_last:]
 
     def _build_compression_prompt(self, task_id: str) -> str:
         """构建压缩提示"""
@@ -289,67 +307,96 @@ class _TaskScheduler:
                 "next_steps": ["检查LLM配置"]
             }
 
-    async def schedule_parallel_execution(self, tasks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-        """并行调度执行给定任务列表，返回结果列表"""
+    async def schedule_parallel_execution(self, tasks: List[Dict[str, Any]],
+                                          executor: Optional[Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]]] = None,
+                                          max_concurrency: Optional[int] = None,
+                                          on_result: Optional[Callable[[int, Dict[str, Any], Dict[str, Any]], Any]] = None,
+                                          task_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """并行调度执行给定任务列表，按输入顺序返回结果列表
+
+        - executor(task) 执行单个任务并返回 {"success", "result", "error", ...}；未提供时只登记任务
+        - 同时执行的任务数不超过 max_concurrency（默认取配置 max_parallel_tasks）
+        - task["resources"] 声明任务独占的资源（如 "input" 表示鼠标/键盘），声明同一资源的任务按提交顺序串行，
+          资源锁由调度器全局持有，不同请求之间同样互斥
+        - 每个任务完成后立即调用 on_result(index, task, result)（可以是协程函数），调用方可以逐个回传结果
+        - task_id 不为空时各任务作为该任务的子任务，步骤记录在该任务下
+        """
         if not tasks:
             return []
 
-        async def _run_task(task: Dict[str, Any]) -> Dict[str, Any]:
-            task_id = task.get("id") or str(uuid.uuid4())
-            async with self._lock:
-                self.task_registry[task_id] = {
-                    "id": task_id,
-                    "type": task.get("type") or "processor",
-                    "status": "running",
-                    "params": task.get("params") or {},
-                    "context": task.get("context"),
-                    "created_at": time.time()
-                }
+        limit = max(1, max_concurrency or self.config.max_parallel_tasks)
+        semaphore = asyncio.Semaphore(limit)
+        parent = self.task_registry.get(task_id) if task_id else None
+        if parent is not None:
+            parent["status"] = "running"
+
+        async def _run_task(index: int, task: Dict[str, Any]) -> Dict[str, Any]:
+            step_id = task.get("step_id") or f"step_{index + 1}"
+            sub_id = task.get("id") or (f"{task_id}:{step_id}" if task_id else str(uuid.uuid4()))
+            owner_id = task_id or sub_id
+            task_type = task.get("type") or "processor"
+            # 登记与状态更新都是同步操作，无需加锁
+            self.task_registry[sub_id] = {
+                "id": sub_id,
+                "parent_id": task_id,
+                "type": task_type,
+                "status": "queued",
+                "params": task.get("params") or {},
+                "context": task.get("context"),
+                "resources": sorted(task.get("resources") or []),
+                "created_at": time.time()
+            }
+            step = TaskStep(
+                step_id=step_id,
+                task_id=owner_id,
+                purpose=task.get("purpose", "执行任务"),
+                content=str(task.get("content") or task.get("params", {}))
+            )
 
             try:
-                # 创建任务步骤记录
-                step = TaskStep(
-                    step_id=str(uuid.uuid4()),
-                    task_id=task_id,
-                    purpose=task.get("purpose", "执行任务"),
-                    content=str(task.get("params", {})),
-                    success=True
-                )
-                
-                # 占位执行：此处可接入真实执行器
-                await asyncio.sleep(0)
-                result = {
-                    "success": True,
-                    "result": None,
-                    "task_type": self.task_registry[task_id]["type"],
-                }
-                
-                step.output = str(result)
-                await self.add_task_step(task_id, step)
-                
-                return result
+                async with AsyncExitStack() as stack:
+                    # 先按固定顺序取资源锁再占并发名额，等待资源的任务不占用名额，也不会互相死锁
+                    for resource in sorted(set(task.get("resources") or [])):
+                        await stack.enter_async_context(self._resource_locks.setdefault(resource, asyncio.Lock()))
+                    await stack.enter_async_context(semaphore)
+                    self.task_registry[sub_id]["status"] = "running"
+                    self.task_registry[sub_id]["started_at"] = time.time()
+                    if executor is None:
+                        result = {"success": True, "result": None, "task_type": task_type}
+                    else:
+                        result = await executor(task)
             except Exception as e:
-                # 记录失败的步骤
-                step = TaskStep(
-                    step_id=str(uuid.uuid4()),
-                    task_id=task_id,
-                    purpose=task.get("purpose", "执行任务"),
-                    content=str(task.get("params", {})),
-                    success=False,
-                    error=str(e)
-                )
-                await self.add_task_step(task_id, step)
-                
-                return {"success": False, "error": str(e)}
-            finally:
-                async with self._lock:
-                    entry = self.task_registry.get(task_id)
-                    if entry is not None:
-                        entry["status"] = "completed"
-                        entry["completed_at"] = time.time()
-
-        coros = [_run_task(t) for t in tasks]
-        return await asyncio.gather(*coros, return_exceptions=False)
+                logger.error(f"[并行调度] 任务 {sub_id} 执行失败: {e}")
+                result = {"success": False, "error": str(e), "task_type": task_type}
+
+            step.output = str(result.get("result", ""))
+            step.success = bool(result.get("success", False))
+            step.error = result.get("error")
+            if task.get("analysis"):
+                step.analysis = {"analysis": task["analysis"]}
+            await self.add_task_step(owner_id, step)
+
+            entry = self.task_registry.get(sub_id)
+            if entry is not None:
+                entry["status"] = "completed" if step.success else "failed"
+                entry["completed_at"] = time.time()
+            if parent is not None:
+                parent["steps_count"] = parent.get("steps_count", 0) + 1
+
+            if on_result is not None:
+                try:
+                    ret = on_result(index, task, result)
+                    if inspect.isawaitable(ret):
+                        await ret
+                except Exception as e:
+                    logger.error(f"[并行调度] 任务 {sub_id} 结果回调失败: {e}")
+            return result
+
+        results = await asyncio.gather(*(_run_task(i, t) for i, t in enumerate(tasks)))
+        if parent is not None:
+            parent["status"] = "completed"
+            parent["completed_at"] = time.time()
+        return list(results)
 
     async def get_task_status(self, task_id: str) -> Optional[Dict[str, Any]]:
         """查询指定任务状态"""
@@ -470,6 +517,7 @@ class _TaskScheduler:
     async def clear_task_memory(self, task_id: str) -> bool:
         """清除指定任务的记忆"""
         async with self._lock:
+            self._compress_locks.pop(task_id, None)
             if task_id in self.task_steps:
                 del self.task_steps[task_id]
                 logger.info(f"已清除任务 {task_id} 的记忆")
@@ -480,6 +528,7 @@ class _TaskScheduler:
         """清除所有记忆"""
         async with self._lock:
             self.task_steps.clear()
+            self._compress_locks.clear()
             self.compressed_memories.clear()
             self.key_facts.clear()
             self.failed_attempts.clear()
@@ -13,6 +13,7 @@ import logging
 import uuid
 import time
 import threading
+from collections import OrderedDict
 from contextlib import asynccontextmanager
 from typing import Dict, List, Optional, AsyncGenerator, Any
 
@@ -41,6 +42,7 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from .message_manager import message_manager  # 导入统一的消息管理器
 
 from .llm_service import get_llm_service  # 导入LLM服务
+from .stream_protocol import StreamFramer, negotiate_stream_format  # 流式帧协议
 
 # 导入配置系统
 try:
@@ -83,6 +85,11 @@ async def lifespan(app: FastAPI):
         sys.exit(1)
     finally:
         print("[INFO] 正在清理资源...")
+        # 关闭LLM共享连接池
+        try:
+            await get_llm_service().aclose()
+        except Exception as e:
+            print(f"[WARNING] 关闭LLM连接池失败: {e}")
         # MCP服务现在由mcpserver独立管理，无需清理
 
 # 创建FastAPI应用
@@ -115,6 +122,7 @@ class ChatRequest(BaseModel):
     disable_tts: bool = False  # V17: 支持禁用服务器端TTS
     return_audio: bool = False  # V19: 支持返回音频URL供客户端播放
     skip_intent_analysis: bool = False  # 新增：跳过意图分析
+    stream_format: Optional[str] = None  # 流式帧格式: base64(默认,兼容旧客户端)/sse/ndjson
 
 class ChatResponse(BaseModel):
     response: str
@@ -226,7 +234,7 @@ async def chat(request: ChatRequest):
         
         # 使用整合后的LLM服务
         llm_service = get_llm_service()
-        response_text = await llm_service.chat_with_context(messages, config.api.temperature)
+        response_text = await llm_service.chat_with_context(messages, config.api.temperature, cache_site="chat")
         
         # 处理完成
         # 统一保存对话历史与日志
@@ -247,20 +255,24 @@ async def chat(request: ChatRequest):
         raise HTTPException(status_code=500, detail=f"处理失败: {str(e)}")
 
 @app.post("/chat/stream")
-async def chat_stream(request: ChatRequest):
+async def chat_stream(request: ChatRequest, http_request: Request):
     """流式对话接口 - 流式文本处理交给streaming_tool_extractor用于TTS"""
     
     if not request.message.strip():
         raise HTTPException(status_code=400, detail="消息内容不能为空")
     
+    # 协商流式帧格式：文本只在服务端解码一次，再按客户端需要的格式输出
+    framer = StreamFramer(negotiate_stream_format(request.stream_format, http_request.headers.get("accept")))
+    
     async def generate_response() -> AsyncGenerator[str, None]:
         complete_text = ""  # V19: 用于累积完整文本以生成音频
+        tool_extractor = None
         try:
             # 获取或创建会话ID
             session_id = message_manager.create_session(request.session_id)
             
             # 发送会话ID信息
-            yield f"data: session_id: {session_id}\n\n"
+            yield framer.session_id(session_id)
             
             # 注意：这里不触发后台分析，将在对话保存后触发
             
@@ -304,7 +316,6 @@ async def chat_stream(request: ChatRequest):
 
             # 初始化流式文本切割器（仅用于TTS处理）
             # 始终创建tool_extractor以累积文本内容，确保日志保存
-            tool_extractor = None
             try:
                 from .streaming_tool_extractor import StreamingToolCallExtractor
                 tool_extractor = StreamingToolCallExtractor()
@@ -319,31 +330,23 @@ async def chat_stream(request: ChatRequest):
             
             # 使用整合后的流式处理
             llm_service = get_llm_service()
-            async for chunk in llm_service.stream_chat_with_context(messages, config.api.temperature):
-                # V19: 如果需要返回音频，累积文本
-                if request.return_audio and chunk.startswith("data: "):
-                    try:
-                        import base64
-                        data_str = chunk[6:].strip()
-                        if data_str != '[DONE]':
-                            decoded = base64.b64decode(data_str).decode('utf-8')
-                            complete_text += decoded
-                    except Exception:
-                        pass
-                
-                # 立即发送到流式文本切割器进行TTS处理（不阻塞文本流）
-                if tool_extractor and chunk.startswith("data: "):
-                    try:
-                        import base64
-                        data_str = chunk[6:].strip()
-                        if data_str != '[DONE]':
-                            decoded = base64.b64decode(data_str).decode('utf-8')
-                            # 异步调用TTS处理，不阻塞文本流
-                            asyncio.create_task(tool_extractor.process_text_chunk(decoded))
-                    except Exception as e:
-                        logger.error(f"[API Server] 流式文本切割器处理错误: {e}")
-                
-                yield chunk
+            try:
+                async for content in llm_service.stream_deltas(messages, config.api.temperature):
+                    # V19: 如果需要返回音频，累积文本
+                    if request.return_audio:
+                        complete_text += content
+                    
+                    # 按到达顺序送入流式文本切割器；句子经有界队列投递TTS，队列满时才会等待
+                    if tool_extractor:
+                        try:
+                            await tool_extractor.process_text_chunk(content)
+                        except Exception as e:
+                            logger.error(f"[API Server] 流式文本切割器处理错误: {e}")
+                    
+                    yield framer.text(content)
+            except Exception as e:
+                logger.error(f"[API Server] 流式聊天调用失败: {e}")
+                yield framer.error(f"流式调用出错: {str(e)}")
             
             # 处理完成
 
@@ -375,7 +378,7 @@ async def chat_stream(request: ChatRequest):
                     except Exception as e:
                         logger.error(f"[API Server V19] 音频播放失败: {e}")
                         # 如果播放失败，仍然返回给客户端作为备选
-                        yield f"data: audio_url: {audio_file}\n\n"
+                        yield framer.audio_url(audio_file)
 
                 except Exception as e:
                     logger.error(f"[API Server V19] 音频生成失败: {e}")
@@ -384,24 +387,12 @@ async def chat_stream(request: ChatRequest):
                     traceback.print_exc()
 
             # 完成流式文本切割器处理（非return_audio模式，不阻塞）
+            # 剩余文本与voice_integration.finish_processing按序排在已投递句子之后执行
             if tool_extractor and not request.return_audio:
                 try:
-                    # 1.将剩余文本发送到voice_integration中的缓冲区
                     await tool_extractor.finish_processing()
-                    pass
                 except Exception as e:
                     print(f"流式文本切割器完成处理错误: {e}")
-            
-            # 完成语音处理
-            if voice_integration and not request.return_audio:  # V19: return_audio模式不需要这里的处理
-                try:
-                    threading.Thread(
-                        # 2.处理缓冲区中的剩余文本
-                        target=voice_integration.finish_processing,
-                        daemon=True
-                    ).start()
-                except Exception as e:
-                    print(f"语音集成完成处理错误: {e}")
 
             # 流式处理完成后，获取完整文本用于保存
             complete_response = ""
@@ -422,21 +413,25 @@ async def chat_stream(request: ChatRequest):
             if not request.skip_intent_analysis:
                 _trigger_background_analysis(session_id)
 
-            yield "data: [DONE]\n\n"
+            yield framer.done()
             
         except Exception as e:
             print(f"流式对话处理错误: {e}")
             # 使用顶部导入的traceback
             traceback.print_exc()
-            yield f"data: 错误: {str(e)}\n\n"
+            yield framer.error(str(e))
+        finally:
+            # 客户端中途断开时生成器在yield处退出，finish_processing不会执行，需在此结束本流的TTS投递任务
+            if tool_extractor:
+                tool_extractor.close()
     
     return StreamingResponse(
         generate_response(),
-        media_type="text/event-stream",
+        media_type=framer.media_type,
         headers={
             "Cache-Control": "no-cache",
             "Connection": "keep-alive",
-            "Content-Type": "text/event-stream",
+            "Content-Type": framer.media_type,
             "Access-Control-Allow-Origin": "*",
             "Access-Control-Allow-Headers": "*",
             "X-Accel-Buffering": "no"  # 禁用nginx缓冲
@@ -614,23 +609,77 @@ async def tool_notification(payload: Dict[str, Any]):
         logger.error(f"工具调用通知处理失败: {e}")
         raise HTTPException(500, f"处理失败: {str(e)}")
 
+# 已受理的回调ID：投递方超时重试、重启后从发件箱重放时，同一回调不再重复生成回复
+_accepted_callbacks: "OrderedDict[str, float]" = OrderedDict()
+_ACCEPTED_CALLBACKS_LIMIT = 2048
+# 后台处理回调的任务（保留引用，避免被垃圾回收）
+_callback_tasks: set = set()
+
+
+def _accept_callbacks(items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """过滤已受理过的回调（按 callback_id，缺失时按 task_id），返回需要处理的部分"""
+    fresh = []
+    for item in items:
+        key = item.get("callback_id") or item.get("task_id")
+        if key:
+            if key in _accepted_callbacks:
+                continue
+            _accepted_callbacks[key] = time.time()
+            while len(_accepted_callbacks) > _ACCEPTED_CALLBACKS_LIMIT:
+                _accepted_callbacks.popitem(last=False)
+        fresh.append(item)
+    return fresh
+
+
+def _spawn_callback_task(coro):
+    task = asyncio.create_task(coro)
+    _callback_tasks.add(task)
+    task.add_done_callback(_callback_tasks.discard)
+
+
 @app.post("/tool_result_callback")
 async def tool_result_callback(payload: Dict[str, Any]):
-    """接收MCP工具执行结果回调，让主AI基于原始对话和工具结果重新生成回复"""
-    try:
-        session_id = payload.get("session_id")
-        task_id = payload.get("task_id")
-        result = payload.get("result", {})
-        success = payload.get("success", False)
+    """接收MCP工具执行结果回调，让主AI基于原始对话和工具结果重新生成回复
+
+    同一会话的多条结果可合并为 {"session_id": ..., "batch": [回调, ...]}，只生成一次回复；
+    受理后立即返回，回复在后台生成，重复投递的回调直接确认
+    """
+    session_id = payload.get("session_id")
+    items = payload.get("batch") or [payload]
+    task_id = items[0].get("task_id") if len(items) == 1 else [item.get("task_id") for item in items]
+
+    if not session_id:
+        raise HTTPException(400, "缺少session_id")
+
+    fresh = _accept_callbacks(items)
+    if not fresh:
+        logger.info(f"[工具回调] 重复投递的回调已忽略，会话: {session_id}, 任务ID: {task_id}")
+        return {"success": True, "duplicate": True, "task_id": task_id, "session_id": session_id}
+
+    _spawn_callback_task(_process_tool_results(session_id, fresh))
+    return {
+        "success": True,
+        "message": "工具结果已受理，正在后台生成回复",
+        "task_id": task_id,
+        "session_id": session_id
+    }
 
-        if not session_id:
-            raise HTTPException(400, "缺少session_id")
 
+async def _process_tool_results(session_id: str, items: List[Dict[str, Any]]):
+    """基于原始对话和工具结果生成回复，保存并推送到UI"""
+    try:
+        task_id = items[0].get("task_id") if len(items) == 1 else [item.get("task_id") for item in items]
         logger.info(f"[工具回调] 开始处理工具回调，会话: {session_id}, 任务ID: {task_id}")
-        logger.info(f"[工具回调] 回调内容: {result}")
 
         # 获取工具执行结果
-        tool_result = result.get('result', '执行成功') if success else result.get('error', '未知错误')
+        tool_results = []
+        for item in items:
+            result = item.get("result") or {}
+            logger.info(f"[工具回调] 回调内容: {result}")
+            tool_results.append(result.get('result', '执行成功') if item.get("success", False) else result.get('error', '未知错误'))
+        tool_result = tool_results[0] if len(tool_results) == 1 else "\n".join(
+            f"{i}. {r}" for i, r in enumerate(tool_results, 1)
+        )
         logger.info(f"[工具回调] 工具执行结果: {tool_result}")
 
         # 获取原始对话的最后一条用户消息（触发工具调用的消息）
@@ -658,7 +707,7 @@ async def tool_result_callback(payload: Dict[str, Any]):
         # 使用LLM服务基于原始对话和工具结果重新生成回复
         try:
             llm_service = get_llm_service()
-            response_text = await llm_service.chat_with_context(messages, temperature=0.7)
+            response_text = await llm_service.chat_with_context(messages, temperature=0.7, cache_site="tool_callback")
             logger.info(f"[工具回调] 工具后回复生成成功，内容: {response_text[:200]}...")
         except Exception as e:
             logger.error(f"[工具回调] 调用LLM服务失败: {e}")
@@ -669,7 +718,7 @@ async def tool_result_callback(payload: Dict[str, Any]):
         logger.info(f"[工具回调] AI回复已保存到历史")
 
         # 保存对话日志到文件
-        message_manager.save_conversation_log(original_user_message, response_text, dev_mode=False)
+        message_manager.save_conversation_log(original_user_message, response_text, dev_mode=False, session_id=session_id)
         logger.info(f"[工具回调] 对话日志已保存")
 
         # 通过UI通知接口将AI回复发送给UI
@@ -678,17 +727,49 @@ async def tool_result_callback(payload: Dict[str, Any]):
 
         logger.info(f"[工具回调] 工具结果处理完成，回复已发送到UI")
 
-        return {
-            "success": True,
-            "message": "工具结果已通过主AI处理并返回给UI",
-            "response": response_text,
-            "task_id": task_id,
-            "session_id": session_id
-        }
-
     except Exception as e:
         logger.error(f"[工具回调] 工具结果回调处理失败: {e}")
-        raise HTTPException(500, f"处理失败: {str(e)}")
+
+@app.post("/agent_result_callback")
+async def agent_result_callback(payload: Dict[str, Any]):
+    """接收agentserver的Agent任务结果回调
+
+    - partial=True：单个任务完成（step_index、completed_steps/total_steps），把进度推送到UI，不生成回复
+    - partial=False：全部任务完成的汇总，与工具结果回调一样由主AI基于原始对话和各任务结果生成回复
+    受理后立即返回，重复投递的回调直接确认
+    """
+    session_id = payload.get("session_id")
+    request_id = payload.get("request_id")
+    if not session_id:
+        raise HTTPException(400, "缺少session_id")
+
+    if not _accept_callbacks([payload]):
+        logger.info(f"[Agent回调] 重复投递的回调已忽略，会话: {session_id}, 请求ID: {request_id}")
+        return {"success": True, "duplicate": True, "request_id": request_id, "session_id": session_id}
+
+    if payload.get("partial"):
+        completed, total = payload.get("completed_steps"), payload.get("total_steps")
+        logger.info(f"[Agent回调] 会话 {session_id} 任务 {payload.get('step_index')} 完成 ({completed}/{total}): "
+                    f"{payload.get('success', False)}")
+        if total and total > 1:
+            status = "完成" if payload.get("success") else f"失败: {payload.get('error') or '未知错误'}"
+            _spawn_callback_task(_notify_ui_refresh(session_id, f"[Agent任务 {completed}/{total}] {status}"))
+        return {"success": True, "partial": True, "request_id": request_id, "session_id": session_id}
+
+    if payload.get("error"):
+        items = [{"success": False, "result": {"error": payload["error"]}, "task_id": request_id}]
+    else:
+        items = [{"success": (entry.get("result") or {}).get("success", False), "result": entry.get("result") or {},
+                  "task_id": f"{request_id}:{entry.get('step_index')}"}
+                 for entry in payload.get("results") or [] if entry]
+    if items:
+        _spawn_callback_task(_process_tool_results(session_id, items))
+    return {
+        "success": True,
+        "message": "Agent任务结果已受理，正在后台生成回复",
+        "request_id": request_id,
+        "session_id": session_id
+    }
 
 @app.post("/tool_result")
 async def tool_result(payload: Dict[str, Any]):
@@ -818,7 +899,8 @@ async def _trigger_chat_stream_no_intent(session_id: str, response_text: str):
             "use_self_game": False,
             "disable_tts": False,
             "return_audio": False,
-            "skip_intent_analysis": True  # 关键：跳过意图分析
+            "skip_intent_analysis": True,  # 关键：跳过意图分析
+            "stream_format": "sse"  # 内容不解析，使用无编码开销的格式
         }
 
         # 调用现有的流式对话接口
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+按token预算组装对话上下文
+历史消息从新到旧填充到预算内，系统提示词与摘要可固定保留；消息token数带缓存，只计算一次
+"""
+
+import logging
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 每条消息的格式开销（role、分隔符等），与OpenAI的估算方式一致
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def _char_estimate(text: str) -> int:
+    """无分词器时的字符估算：CJK字符约1 token/字，其余约4字符/token"""
+    cjk = 0
+    for ch in text:
+        if ch >= "⺀":
+            cjk += 1
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def _load_default_tokenizer() -> Callable[[str], int]:
+    """优先使用tiktoken，不可用时回退到字符估算"""
+    try:
+        import tiktoken
+        encoding = tiktoken.get_encoding("cl100k_base")
+        return lambda text: len(encoding.encode(text, disallowed_special=()))
+    except Exception:
+        logger.debug("tiktoken不可用，使用字符估算token数")
+        return _char_estimate
+
+
+class TokenCounter:
+    """带LRU缓存的token计数器，同一条消息内容只分词一次"""
+
+    def __init__(self, tokenizer: Optional[Callable[[str], int]] = None, cache_size: int = 4096):
+        self._tokenizer = tokenizer
+        self._cache: "OrderedDict[str, int]" = OrderedDict()
+        self._cache_size = cache_size
+        self._lock = threading.Lock()
+
+    def set_tokenizer(self, tokenizer: Callable[[str], int]):
+        """替换分词器并清空缓存"""
+        with self._lock:
+            self._tokenizer = tokenizer
+            self._cache.clear()
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        with self._lock:
+            cached = self._cache.get(text)
+            if cached is not None:
+                self._cache.move_to_end(text)
+                return cached
+            if self._tokenizer is None:
+                self._tokenizer = _load_default_tokenizer()
+            tokenizer = self._tokenizer
+        try:
+            tokens = tokenizer(text)
+        except Exception:
+            tokens = _char_estimate(text)
+        with self._lock:
+            self._cache[text] = tokens
+            if len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        return tokens
+
+    def count_message(self, message: Dict) -> int:
+        return self.count(message.get("content") or "") + MESSAGE_OVERHEAD_TOKENS
+
+
+# 全局计数器
+token_counter = TokenCounter()
+
+
+def set_tokenizer(tokenizer: Callable[[str], int]):
+    """便捷函数：设置全局分词器"""
+    token_counter.set_tokenizer(tokenizer)
+
+
+def fit_history_to_budget(history: List[Dict], budget: int, reserved: int = 0,
+                          pin_summaries: bool = True,
+                          counter: TokenCounter = token_counter) -> Tuple[List[Dict], Dict]:
+    """
+    从新到旧选取历史消息，使其与已预留部分的总和不超过预算
+
+    Args:
+        history: 按时间正序的历史消息
+        budget: 总token预算（<=0 表示不限制）
+        reserved: 已被系统提示词、当前消息等占用的token
+        pin_summaries: 是否无条件保留历史中的system消息（摘要）
+
+    Returns:
+        (选中的历史消息(保持原顺序), 预算报告)
+    """
+    pinned_idx = [i for i, m in enumerate(history) if pin_summaries and m.get("role") == "system"]
+    used = reserved + sum(counter.count_message(history[i]) for i in pinned_idx)
+    pinned = set(pinned_idx)
+
+    selected = set(pinned_idx)
+    dropped = 0
+    exhausted = False
+    for i in range(len(history) - 1, -1, -1):
+        if i in pinned:
+            continue
+        if exhausted:
+            dropped += 1
+            continue
+        cost = counter.count_message(history[i])
+        if budget > 0 and used + cost > budget:
+            # 预算已满：更早的消息全部丢弃，保证保留的是连续的最近对话
+            exhausted = True
+            dropped += 1
+            continue
+        used += cost
+        selected.add(i)
+
+    # 避免以孤立的助手回复开头（其对应的用户消息已被截掉）
+    if exhausted:
+        first = next((i for i in sorted(selected) if i not in pinned), None)
+        if first is not None and history[first].get("role") == "assistant":
+            selected.discard(first)
+            used -= counter.count_message(history[first])
+            dropped += 1
+
+    result = [history[i] for i in sorted(selected)]
+    report = {
+        "budget": budget,
+        "used": used,
+        "history_included": len(result),
+        "history_dropped": dropped,
+    }
+    return result, report
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+持久化对话存储
+基于SQLite(WAL)保存对话消息，按时间建立索引，替代每次新建会话时重新解析整份日志文件
+"""
+
+import logging
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id TEXT,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_messages_created ON messages(created_at);
+CREATE INDEX IF NOT EXISTS idx_messages_session ON messages(session_id, created_at);
+CREATE TABLE IF NOT EXISTS imported_logs (
+    path TEXT PRIMARY KEY,
+    message_count INTEGER NOT NULL,
+    imported_at REAL NOT NULL
+);
+"""
+
+
+def _day_start(days: int) -> float:
+    """最近 days 个自然日（含今天）的起始时间戳，与按日期挑选日志文件的语义一致"""
+    start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=max(days, 1) - 1)
+    return start.timestamp()
+
+
+class ConversationStore:
+    """对话消息存储
+
+    - 按 created_at 建索引，“最近D天最后N条”为一次索引范围扫描，与历史总量无关
+    - 写入为单条INSERT，由 MessageManager.save_conversation_log 同步写入
+    - import_log_files 将旧版 logs/*.log 文本日志一次性导入，已导入的文件不会重复处理
+    """
+
+    def __init__(self, db_path: Union[str, Path]):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def append(self, role: str, content: str, session_id: Optional[str] = None,
+               created_at: Optional[float] = None):
+        """追加单条消息"""
+        self.append_many([(role, content)], session_id=session_id, created_at=created_at)
+
+    def append_many(self, messages: List[tuple], session_id: Optional[str] = None,
+                    created_at: Optional[float] = None):
+        """按顺序追加多条 (role, content) 消息"""
+        ts = created_at if created_at is not None else time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT INTO messages (session_id, role, content, created_at) VALUES (?, ?, ?, ?)",
+                [(session_id, role, content, ts) for role, content in messages]
+            )
+            self._conn.commit()
+
+    def recent_messages(self, days: int = 3, limit: Optional[int] = None) -> List[Dict]:
+        """最近 days 天内的最后 limit 条消息，按时间正序返回"""
+        sql = ("SELECT role, content FROM messages WHERE created_at >= ? "
+               "ORDER BY created_at DESC, id DESC")
+        params: list = [_day_start(days)]
+        if limit:
+            sql += " LIMIT ?"
+            params.append(int(limit))
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        rows.reverse()
+        return [{"role": role, "content": content} for role, content in rows]
+
+    def statistics(self, days: int = 7) -> Dict:
+        """最近 days 天的消息统计"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT role, COUNT(*) FROM messages WHERE created_at >= ? GROUP BY role",
+                (_day_start(days),)
+            ).fetchall()
+            active_days = self._conn.execute(
+                "SELECT COUNT(DISTINCT date(created_at, 'unixepoch', 'localtime')) "
+                "FROM messages WHERE created_at >= ?",
+                (_day_start(days),)
+            ).fetchone()[0]
+        counts = dict(rows)
+        user_messages = counts.get("user", 0)
+        total_messages = sum(counts.values())
+        return {
+            "total_files": active_days,
+            "total_messages": total_messages,
+            "user_messages": user_messages,
+            "assistant_messages": total_messages - user_messages,
+            "days_covered": days
+        }
+
+    def import_log_files(self, log_files: List[Path], parser: Callable[[str], List[Dict]]) -> int:
+        """一次性导入旧版文本日志（文件名为 YYYY-MM-DD.log），返回导入的消息数"""
+        imported = 0
+        for log_file in sorted(log_files):
+            path = str(Path(log_file).resolve())
+            try:
+                day = datetime.strptime(Path(log_file).stem, "%Y-%m-%d")
+            except ValueError:
+                continue
+
+            with self._lock:
+                if self._conn.execute("SELECT 1 FROM imported_logs WHERE path = ?", (path,)).fetchone():
+                    continue
+
+            messages = parser(str(log_file))
+            base_ts = day.timestamp()
+            with self._lock:
+                # BEGIN IMMEDIATE 串行化多个进程的导入，避免同一文件被重复导入
+                self._conn.execute("BEGIN IMMEDIATE")
+                try:
+                    if self._conn.execute("SELECT 1 FROM imported_logs WHERE path = ?", (path,)).fetchone():
+                        self._conn.rollback()
+                        continue
+                    # 旧日志只有时分秒，按文件内顺序递增时间戳以保持消息先后
+                    self._conn.executemany(
+                        "INSERT INTO messages (session_id, role, content, created_at) VALUES (NULL, ?, ?, ?)",
+                        [(m["role"], m["content"], base_ts + i * 1e-3) for i, m in enumerate(messages)]
+                    )
+                    self._conn.execute(
+                        "INSERT INTO imported_logs (path, message_count, imported_at) VALUES (?, ?, ?)",
+                        (path, len(messages), time.time())
+                    )
+                    self._conn.commit()
+                except Exception:
+                    self._conn.rollback()
+                    raise
+            imported += len(messages)
+            logger.info(f"已导入历史日志 {log_file}: {len(messages)} 条消息")
+        return imported
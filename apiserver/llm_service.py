@@ -4,6 +4,9 @@ LLM服务模块
 提供统一的LLM调用接口，替代conversation_core.py中的get_response方法
 """
 
+import asyncio
+import base64
+import json
 import logging
 import sys
 import os
@@ -12,154 +15,297 @@ from typing import Optional, Dict, Any, List
 # 添加项目根目录到Python路径
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from nagaagent_core.core import AsyncOpenAI
+from nagaagent_core.core import aiohttp
 from nagaagent_core.api import FastAPI, HTTPException
 from system.config import config
+from system.response_cache import get_response_cache, make_cache_key
+from apiserver.sse_decoder import SSEDecoder, DONE_MARKER
+from apiserver.single_flight import SingleFlight
 
 # 配置日志
 logger = logging.getLogger("LLMService")
 
+# 上游请求超时：总时长/建连/读间隔
+_REQUEST_TIMEOUT = dict(total=180, connect=60, sock_read=120)
+
+# 复用连接失效时可安全重试一次的异常（服务端已关闭空闲keep-alive连接）
+_STALE_CONNECTION_ERRORS = (aiohttp.ServerDisconnectedError, aiohttp.ClientOSError)
+
+
 class LLMService:
-    """LLM服务类 - 提供统一的LLM调用接口"""
+    """LLM服务类 - 提供统一的LLM调用接口
+
+    进程内共享一个带连接池的 aiohttp 会话（keep-alive + DNS缓存），
+    get_response / chat_with_context / stream_chat_with_context 三条路径共用，
+    避免每轮对话重新进行 TCP/TLS 握手。
+    完全相同的并发请求经 single-flight 合并为一次上游调用。
+    后台调用（background=True）在有前台对话进行时让行，保证流式对话优先。
+    """
     
     def __init__(self):
-        self.async_client: Optional[AsyncOpenAI] = None
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._session_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._session_lock: Optional[asyncio.Lock] = None
+        self.base_url = ""
+        self.headers: Dict[str, str] = {}
+        self._single_flight = SingleFlight()
+        # 前台调用计数与空闲事件（后台调用据此让行）
+        self._foreground_active = 0
+        self._foreground_idle: Optional[asyncio.Event] = None
+        self._foreground_idle_loop: Optional[asyncio.AbstractEventLoop] = None
         self._initialize_client()
     
     def _initialize_client(self):
-        """初始化OpenAI客户端"""
+        """初始化客户端配置（连接池在首次请求时按事件循环惰性创建）"""
+        self.base_url = config.api.base_url.rstrip('/')
+        self.headers = {
+            "Authorization": f"Bearer {config.api.api_key}",
+            "Content-Type": "application/json",
+        }
+        logger.info("LLM服务客户端初始化成功")
+    
+    def _create_session(self) -> aiohttp.ClientSession:
+        """创建带连接池的HTTP会话"""
+        connector = aiohttp.TCPConnector(
+            limit=config.api.http_pool_size,
+            limit_per_host=config.api.http_pool_per_host,
+            ttl_dns_cache=config.api.http_dns_cache_ttl or None,
+            use_dns_cache=config.api.http_dns_cache_ttl > 0,
+            keepalive_timeout=config.api.http_keepalive_timeout,
+            enable_cleanup_closed=True,
+        )
+        return aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(**_REQUEST_TIMEOUT),
+            headers=self.headers,
+        )
+    
+    async def get_session(self) -> aiohttp.ClientSession:
+        """获取当前事件循环上的共享会话，必要时创建"""
+        loop = asyncio.get_running_loop()
+        if self._session is not None and not self._session.closed and self._session_loop is loop:
+            return self._session
+        
+        if self._session_lock is None or self._session_loop is not loop:
+            self._session_lock = asyncio.Lock()
+        async with self._session_lock:
+            if self._session is None or self._session.closed or self._session_loop is not loop:
+                if self._session is not None and not self._session.closed:
+                    # 旧会话属于其他事件循环，无法在此关闭，只能丢弃引用
+                    logger.debug("事件循环已变化，为当前循环重建LLM连接池")
+                self._session = self._create_session()
+                self._session_loop = loop
+                logger.info(
+                    f"LLM连接池已创建 (limit={config.api.http_pool_size}, "
+                    f"per_host={config.api.http_pool_per_host}, dns_ttl={config.api.http_dns_cache_ttl}s)"
+                )
+        return self._session
+    
+    async def aclose(self):
+        """关闭共享连接池（在应用生命周期结束时调用）"""
+        session, self._session = self._session, None
+        self._session_loop = None
+        if session is not None and not session.closed:
+            await session.close()
+            logger.info("LLM连接池已关闭")
+    
+    def _get_foreground_idle(self) -> asyncio.Event:
+        """当前事件循环上的前台空闲事件"""
+        loop = asyncio.get_running_loop()
+        if self._foreground_idle is None or self._foreground_idle_loop is not loop:
+            self._foreground_idle = asyncio.Event()
+            self._foreground_idle_loop = loop
+        if self._foreground_active == 0:
+            self._foreground_idle.set()
+        return self._foreground_idle
+    
+    def _enter_foreground(self):
+        self._foreground_active += 1
+        self._get_foreground_idle().clear()
+    
+    def _leave_foreground(self):
+        self._foreground_active = max(0, self._foreground_active - 1)
+        if self._foreground_active == 0:
+            self._get_foreground_idle().set()
+    
+    async def _yield_to_foreground(self):
+        """后台调用等待前台对话结束，最多等待 background_max_defer 秒以免饿死"""
+        if self._foreground_active == 0:
+            return
         try:
-            self.async_client = AsyncOpenAI(
-                api_key=config.api.api_key, 
-                base_url=config.api.base_url.rstrip('/') + '/'
-            )
-            logger.info("LLM服务客户端初始化成功")
-        except Exception as e:
-            logger.error(f"LLM服务客户端初始化失败: {e}")
-            self.async_client = None
+            await asyncio.wait_for(self._get_foreground_idle().wait(), timeout=config.api.background_max_defer)
+        except asyncio.TimeoutError:
+            logger.debug("前台对话持续进行，后台LLM调用不再等待")
     
-    async def get_response(self, prompt: str, temperature: float = 0.7) -> str:
-        """为其他模块提供API调用接口"""
-        if not self.async_client:
-            self._initialize_client()
-            if not self.async_client:
-                return f"LLM服务不可用: 客户端初始化失败"
+    def _build_payload(self, messages: List[Dict], temperature: float, stream: bool = False) -> Dict[str, Any]:
+        """构建chat/completions请求体"""
+        payload = {
+            "model": config.api.model,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": config.api.max_tokens,
+        }
+        if stream:
+            payload["stream"] = True
+        return payload
+    
+    async def _post_completion(self, messages: List[Dict], temperature: float,
+                               cache_site: Optional[str] = None) -> str:
+        """非流式调用chat/completions，复用连接失效时重试一次
+
+        cache_site 为调用点名称，对应 config.response_cache.sites 中开启的调用点会先查响应缓存
+        """
+        payload = self._build_payload(messages, temperature)
+        request_key = make_cache_key(payload["model"], messages, temperature, payload["max_tokens"])
+        cache = get_response_cache(cache_site) if cache_site else None
+        if cache is not None:
+            cached = cache.get(request_key)
+            if cached is not None:
+                logger.debug(f"响应缓存命中 ({cache_site})")
+                return cached
         
+        if config.api.llm_single_flight:
+            content = await self._single_flight.do(request_key, lambda: self._request_completion(payload))
+        else:
+            content = await self._request_completion(payload)
+        if cache is not None:
+            cache.set(request_key, content)
+        return content
+    
+    async def _request_completion(self, payload: Dict[str, Any]) -> str:
+        """发送非流式请求并返回回复文本"""
+        for attempt in range(2):
+            session = await self.get_session()
+            try:
+                async with session.post(f"{self.base_url}/chat/completions", json=payload) as resp:
+                    if resp.status != 200:
+                        detail = (await resp.text())[:200]
+                        raise RuntimeError(f"HTTP {resp.status}: {detail}")
+                    data = await resp.json(content_type=None)
+                    return data["choices"][0]["message"]["content"]
+            except _STALE_CONNECTION_ERRORS as e:
+                if attempt:
+                    raise
+                logger.debug(f"复用连接已失效，重试请求: {e}")
+    
+    async def complete(self, messages: List[Dict], temperature: float = 0.7,
+                       cache_site: Optional[str] = None, background: bool = False) -> str:
+        """非流式调用，失败时抛出异常（供需要区分错误与回复内容的调用方使用）
+
+        background=True 的调用在前台对话进行时让行，取消调用方即取消上游请求
+        """
+        if background:
+            await self._yield_to_foreground()
+            return await self._post_completion(messages, temperature, cache_site)
+        self._enter_foreground()
+        try:
+            return await self._post_completion(messages, temperature, cache_site)
+        finally:
+            self._leave_foreground()
+    
+    async def get_response(self, prompt: str, temperature: float = 0.7,
+                           cache_site: Optional[str] = "get_response") -> str:
+        """为其他模块提供API调用接口"""
         try:
-            response = await self.async_client.chat.completions.create(
-                model=config.api.model,
-                messages=[{"role": "user", "content": prompt}],
-                temperature=temperature,
-                max_tokens=config.api.max_tokens
-            )
-            return response.choices[0].message.content
-        except RuntimeError as e:
-            if "handler is closed" in str(e):
-                logger.debug(f"忽略连接关闭异常，重新创建客户端: {e}")
-                # 重新创建客户端并重试
-                self._initialize_client()
-                if self.async_client:
-                    response = await self.async_client.chat.completions.create(
-                        model=config.api.model,
-                        messages=[{"role": "user", "content": prompt}],
-                        temperature=temperature,
-                        max_tokens=config.api.max_tokens
-                    )
-                    return response.choices[0].message.content
-                else:
-                    return f"LLM服务不可用: 重连失败"
-            else:
-                logger.error(f"API调用失败: {e}")
-                return f"API调用出错: {str(e)}"
+            return await self.complete([{"role": "user", "content": prompt}], temperature, cache_site)
         except Exception as e:
             logger.error(f"API调用失败: {e}")
             return f"API调用出错: {str(e)}"
     
     def is_available(self) -> bool:
         """检查LLM服务是否可用"""
-        return self.async_client is not None
-    
-    async def chat_with_context(self, messages: List[Dict], temperature: float = 0.7) -> str:
-        """带上下文的聊天调用"""
-        if not self.async_client:
-            self._initialize_client()
-            if not self.async_client:
-                return f"LLM服务不可用: 客户端初始化失败"
-        
+        return bool(self.base_url)
+    
+    async def chat_with_context(self, messages: List[Dict], temperature: float = 0.7,
+                                cache_site: Optional[str] = None) -> str:
+        """带上下文的聊天调用（cache_site 见 _post_completion）"""
         try:
-            response = await self.async_client.chat.completions.create(
-                model=config.api.model,
-                messages=messages,
-                temperature=temperature,
-                max_tokens=config.api.max_tokens
-            )
-            return response.choices[0].message.content
+            return await self.complete(messages, temperature, cache_site)
         except Exception as e:
             logger.error(f"上下文聊天调用失败: {e}")
             return f"聊天调用出错: {str(e)}"
     
+    async def stream_deltas(self, messages: List[Dict], temperature: float = 0.7):
+        """流式调用上游并逐个产出已解码的文本增量（纯文本，不做任何编码）
+
+        相同请求并发进行时共享同一个上游流，每个调用方都收到完整的增量序列
+        """
+        payload = self._build_payload(messages, temperature, stream=True)
+        if config.api.llm_single_flight:
+            request_key = "stream:" + make_cache_key(payload["model"], messages, temperature, payload["max_tokens"])
+            source = self._single_flight.stream(request_key, lambda: self._stream_upstream(payload))
+        else:
+            source = self._stream_upstream(payload)
+        
+        self._enter_foreground()
+        try:
+            async for content in source:
+                yield content
+        finally:
+            self._leave_foreground()
+    
+    async def _stream_upstream(self, payload: Dict[str, Any]):
+        """发送流式请求，逐个产出文本增量"""
+        session = await self.get_session()
+        async with session.post(
+            f"{self.base_url}/chat/completions",
+            headers={"Accept": "text/event-stream"},
+            json=payload
+        ) as resp:
+            if resp.status != 200:
+                raise RuntimeError(f"LLM API调用失败 (状态码: {resp.status})")
+            
+            decoder = SSEDecoder()
+            async for chunk in resp.content.iter_any():
+                for event in decoder.feed(chunk):
+                    for content in _extract_delta_contents(event):
+                        yield content
+                if decoder.done:
+                    return
+            for event in decoder.flush():
+                for content in _extract_delta_contents(event):
+                    yield content
+    
     async def stream_chat_with_context(self, messages: List[Dict], temperature: float = 0.7):
         """带上下文的流式聊天调用"""
-        if not self.async_client:
-            self._initialize_client()
-            if not self.async_client:
-                yield f"LLM服务不可用: 客户端初始化失败"
-                return
-        
         try:
-            import aiohttp
-            timeout = aiohttp.ClientTimeout(total=180, connect=60, sock_read=120)
-            async with aiohttp.ClientSession(timeout=timeout) as session:
-                async with session.post(
-                    f"{config.api.base_url}/chat/completions",
-                    headers={
-                        "Authorization": f"Bearer {config.api.api_key}",
-                        "Content-Type": "application/json",
-                        "Accept": "text/event-stream",
-                        "Connection": "keep-alive"
-                    },
-                    json={
-                        "model": config.api.model,
-                        "messages": messages,
-                        "temperature": temperature,
-                        "max_tokens": config.api.max_tokens,
-                        "stream": True
-                    }
-                ) as resp:
-                    if resp.status != 200:
-                        yield f"LLM API调用失败 (状态码: {resp.status})"
-                        return
-                    
-                    async for chunk in resp.content.iter_chunked(1024):
-                        if not chunk:
-                            break
-                        try:
-                            data = chunk.decode('utf-8')
-                            lines = data.split('\n')
-                            for line in lines:
-                                line = line.strip()
-                                if line.startswith('data: '):
-                                    data_str = line[6:]
-                                    if data_str == '[DONE]':
-                                        return
-                                    try:
-                                        import json
-                                        data = json.loads(data_str)
-                                        if 'choices' in data and len(data['choices']) > 0:
-                                            delta = data['choices'][0].get('delta', {})
-                                            if 'content' in delta:
-                                                import base64
-                                                content = delta['content']
-                                                b64 = base64.b64encode(content.encode('utf-8')).decode('ascii')
-                                                yield f"data: {b64}\n\n"
-                                    except json.JSONDecodeError:
-                                        continue
-                        except UnicodeDecodeError:
-                            continue
+            async for content in self.stream_deltas(messages, temperature):
+                b64 = base64.b64encode(content.encode('utf-8')).decode('ascii')
+                yield f"data: {b64}\n\n"
         except Exception as e:
             logger.error(f"流式聊天调用失败: {e}")
             yield f"data: 流式调用出错: {str(e)}\n\n"
 
+
+def _extract_delta_contents(event_data: str) -> List[str]:
+    """从一个SSE事件的data中提取delta.content
+
+    兼容不规范的上游：事件内若包含多个以换行分隔的JSON对象，则逐行解析。
+    """
+    try:
+        payloads = [json.loads(event_data)]
+    except json.JSONDecodeError:
+        payloads = []
+        for line in event_data.split('\n'):
+            line = line.strip()
+            if line.startswith('data:'):
+                line = line[5:].strip()
+            if not line or line == DONE_MARKER:
+                continue
+            try:
+                payloads.append(json.loads(line))
+            except json.JSONDecodeError:
+                logger.debug(f"忽略无法解析的SSE数据: {line[:100]}")
+    
+    contents = []
+    for data in payloads:
+        choices = data.get('choices') if isinstance(data, dict) else None
+        if choices:
+            content = (choices[0].get('delta') or {}).get('content')
+            if content:
+                contents.append(content)
+    return contents
+
 # 全局LLM服务实例
 _llm_service: Optional[LLMService] = None
 
@@ -200,3 +346,14 @@ async def llm_chat(request: Dict[str, Any]):
         logger.error(f"LLM聊天接口异常: {e}")
         raise HTTPException(status_code=500, detail=f"LLM服务异常: {str(e)}")
 
+
+@llm_app.get("/llm/cache/stats")
+async def llm_cache_stats():
+    """响应缓存命中统计"""
+    cache = get_response_cache()
+    return {
+        "status": "success",
+        "enabled": cache is not None,
+        "stats": cache.stats() if cache is not None else None,
+        "single_flight": get_llm_service()._single_flight.stats()
+    }
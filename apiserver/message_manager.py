@@ -15,6 +15,9 @@ from typing import Dict, List, Optional, Any
 from datetime import datetime, timedelta
 from pathlib import Path
 
+from apiserver.context_builder import fit_history_to_budget, token_counter
+from apiserver.session_store import SessionStore
+
 logger = logging.getLogger(__name__)
 
 # 工具函数
@@ -48,9 +51,6 @@ class MessageManager:
     """统一的消息管理器"""
     
     def __init__(self):
-        self.sessions: Dict[str, Dict] = {}
-        # 分析状态跟踪，防止重复执行
-        self.analysis_in_progress: Dict[str, bool] = {}
         # 从配置文件读取最大历史轮数，默认为10轮
         try:
             from system.config import config
@@ -60,6 +60,14 @@ class MessageManager:
             self.context_load_days = config.api.context_load_days
             self.log_dir = config.system.log_dir
             self.ai_name = config.system.ai_name
+            self.context_parse_logs = config.api.context_parse_logs
+            self.context_token_budget = config.api.context_token_budget
+            self.context_pin_summaries = config.api.context_pin_summaries
+            session_max_count = config.api.session_max_count
+            session_max_bytes = config.api.session_max_memory_mb * 1024 * 1024
+            session_ttl_seconds = config.api.session_ttl_hours * 3600
+            session_spill_to_disk = config.api.session_spill_to_disk
+            session_spill_ttl_seconds = config.api.session_spill_ttl_hours * 3600
         except ImportError:
             self.max_history_rounds = 10
             self.max_messages_per_session = 20  # 默认20条消息
@@ -67,7 +75,33 @@ class MessageManager:
             self.context_load_days = 3
             self.log_dir = Path("logs")
             self.ai_name = "娜迦"
+            self.context_parse_logs = True
+            self.context_token_budget = 32000
+            self.context_pin_summaries = True
+            session_max_count = 1000
+            session_max_bytes = 64 * 1024 * 1024
+            session_ttl_seconds = 24 * 3600
+            session_spill_to_disk = True
+            session_spill_ttl_seconds = 7 * 24 * 3600
             logger.warning("无法导入配置，使用默认历史轮数设置")
+        
+        # 有界会话存储：LRU + 空闲TTL + 内存上限，淘汰的会话落盘后按需加载
+        self.sessions = SessionStore(
+            max_sessions=session_max_count,
+            max_bytes=session_max_bytes,
+            ttl_seconds=session_ttl_seconds,
+            spill_dir=Path(self.log_dir) / "sessions" if session_spill_to_disk else None,
+            spill_ttl_seconds=session_spill_ttl_seconds,
+        )
+        
+        # 日志行匹配模式只编译一次
+        speaker_pattern = r'^\[(\d{2}:\d{2}:\d{2})\] (用户|' + re.escape(self.ai_name) + r'):'
+        self._message_start_pattern = re.compile(speaker_pattern)
+        self._message_line_pattern = re.compile(speaker_pattern + r' (.+)$')
+        
+        # 持久化对话存储（首次使用时打开，失败则回退到解析日志文件）
+        self._conversation_store = None
+        self._store_unavailable = False
     
     def generate_session_id(self) -> str:
         """生成唯一的会话ID"""
@@ -111,6 +145,7 @@ class MessageManager:
             
             if recent_messages:
                 self.sessions[session_id]["messages"] = recent_messages
+                self.sessions.touch(session_id)
                 logger.info(f"会话 {session_id} 加载了 {len(recent_messages)} 条历史对话")
             else:
                 logger.debug(f"会话 {session_id} 未找到历史对话记录")
@@ -131,10 +166,13 @@ class MessageManager:
         session = self.sessions[session_id]
         session["messages"].append({"role": role, "content": content})
         session["last_activity"] = asyncio.get_event_loop().time()
+        # 入队时计算token数，组装上下文时直接命中缓存
+        token_counter.count(content)
         
         # 限制消息数量
         if len(session["messages"]) > self.max_messages_per_session:
             session["messages"] = session["messages"][-self.max_messages_per_session:]
+        self.sessions.touch(session_id)
         
         logger.debug(f"会话 {session_id} 添加消息: {role} - {content[:50]}...")
         return True
@@ -165,16 +203,33 @@ class MessageManager:
         # 添加系统提示词
         messages.append({"role": "system", "content": enhanced_system_prompt})
         
-        # 添加历史对话
+        # 添加历史对话（先按轮数截断，再按token预算从新到旧选取）
         if include_history:
-            recent_messages = self.get_recent_messages(session_id)
+            recent_messages, report = self._fit_history(
+                self.get_recent_messages(session_id), enhanced_system_prompt, current_message
+            )
             messages.extend(recent_messages)
+            session = self.sessions.get(session_id)
+            if session is not None:
+                session["context_budget"] = report
         
         # 添加当前用户消息
         messages.append({"role": "user", "content": current_message})
         
         return messages
     
+    def _fit_history(self, history: List[Dict], system_prompt: str, current_message: str):
+        """按token预算裁剪历史消息，系统提示词与当前消息的占用先行预留"""
+        reserved = (token_counter.count_message({"content": system_prompt})
+                    + token_counter.count_message({"content": current_message}))
+        selected, report = fit_history_to_budget(
+            history, self.context_token_budget, reserved=reserved,
+            pin_summaries=self.context_pin_summaries
+        )
+        if report["history_dropped"]:
+            logger.debug(f"上下文超出token预算，丢弃 {report['history_dropped']} 条历史消息: {report}")
+        return selected, report
+    
     def build_conversation_messages_from_memory(self, memory_messages: List[Dict], system_prompt: str, 
                                               current_message: str, max_history_rounds: int = None) -> List[Dict]:
         """
@@ -208,7 +263,9 @@ class MessageManager:
         
         # 添加历史对话（限制数量）
         if memory_messages:
-            recent_messages = memory_messages[-max_messages:]
+            recent_messages, _ = self._fit_history(
+                memory_messages[-max_messages:], enhanced_system_prompt, current_message
+            )
             messages.extend(recent_messages)
         
         # 添加当前用户消息
@@ -230,6 +287,7 @@ class MessageManager:
             "conversation_rounds": len(session["messages"]) // 2,
             "agent_type": session["agent_type"],
             "max_history_rounds": self.max_history_rounds,  # 添加最大历史轮数信息
+            "context_budget": session.get("context_budget"),  # 最近一次组装上下文的token用量
             "last_message": session["messages"][-1]["content"][:100] + "..." if session["messages"] else "无对话历史"
         }
     
@@ -242,11 +300,12 @@ class MessageManager:
     
     def delete_session(self, session_id: str) -> bool:
         """删除指定会话"""
-        if session_id in self.sessions:
+        try:
             del self.sessions[session_id]
-            logger.info(f"删除会话: {session_id}")
-            return True
-        return False
+        except KeyError:
+            return False
+        logger.info(f"删除会话: {session_id}")
+        return True
     
     def clear_all_sessions(self) -> int:
         """清空所有会话"""
@@ -255,22 +314,10 @@ class MessageManager:
         logger.info(f"清空所有会话，共 {count} 个")
         return count
     
-    def cleanup_old_sessions(self, max_age_hours: int = 24) -> int:
-        """清理过期会话"""
-        current_time = asyncio.get_event_loop().time()
-        expired_sessions = []
-        
-        for session_id, session in self.sessions.items():
-            if current_time - session["last_activity"] > max_age_hours * 3600:
-                expired_sessions.append(session_id)
-        
-        for session_id in expired_sessions:
-            del self.sessions[session_id]
-        
-        if expired_sessions:
-            logger.info(f"清理了 {len(expired_sessions)} 个过期会话")
-        
-        return len(expired_sessions)
+    def cleanup_old_sessions(self, max_age_hours: Optional[float] = None) -> int:
+        """清理过期会话（默认使用配置的空闲TTL，淘汰的会话按配置落盘）"""
+        ttl_seconds = max_age_hours * 3600 if max_age_hours is not None else None
+        return self.sessions.sweep(ttl_seconds)
     
     def set_agent_type(self, session_id: str, agent_type: str) -> bool:
         """设置会话的agent类型"""
@@ -284,6 +331,26 @@ class MessageManager:
         session = self.sessions.get(session_id)
         return session["agent_type"] if session else None
     
+    # ========== 持久化对话存储 ==========
+    
+    def get_conversation_store(self):
+        """获取对话存储，首次打开时一次性导入旧版文本日志"""
+        if self._conversation_store is not None or self._store_unavailable:
+            return self._conversation_store
+        try:
+            from .conversation_store import ConversationStore
+            store = ConversationStore(Path(self.log_dir) / "conversation_store.db")
+            if self.context_parse_logs:
+                log_files = sorted(Path(self.log_dir).glob("????-??-??.log"))
+                imported = store.import_log_files(log_files, self.parse_log_file)
+                if imported:
+                    logger.info(f"已将 {imported} 条历史日志消息导入对话存储")
+            self._conversation_store = store
+        except Exception as e:
+            logger.warning(f"对话存储不可用，回退到日志文件解析: {e}")
+            self._store_unavailable = True
+        return self._conversation_store
+    
     # ========== 日志解析功能 ==========
     
     def _parse_log_line(self, line: str) -> Optional[tuple]:
@@ -301,8 +368,7 @@ class MessageManager:
             return None
         
         # 匹配格式：[时间] 用户: 内容 或 [时间] AI名称: 内容
-        pattern = r'^\[(\d{2}:\d{2}:\d{2})\] (用户|' + re.escape(self.ai_name) + r'): (.+)$'
-        match = re.match(pattern, line)
+        match = self._message_line_pattern.match(line)
         
         if match:
             time_str, speaker, content = match.groups()
@@ -329,8 +395,7 @@ class MessageManager:
             return False
         
         # 匹配格式：[时间] 用户: 或 [时间] AI名称:
-        pattern = r'^\[(\d{2}:\d{2}:\d{2})\] (用户|' + re.escape(self.ai_name) + r'):'
-        return bool(re.match(pattern, line))
+        return bool(self._message_start_pattern.match(line))
     
     def parse_log_file(self, log_file_path: str) -> List[Dict]:
         """
@@ -459,6 +524,12 @@ class MessageManager:
         Returns:
             List[Dict]: 对话消息列表
         """
+        store = self.get_conversation_store()
+        if store is not None:
+            all_messages = store.recent_messages(days=days, limit=max_messages)
+            logger.info(f"从对话存储加载了最近 {days} 天的 {len(all_messages)} 条历史对话")
+            return all_messages
+        
         all_messages = []
         log_files = self.get_log_files_by_date(days)
         
@@ -487,6 +558,10 @@ class MessageManager:
         Returns:
             Dict: 统计信息
         """
+        store = self.get_conversation_store()
+        if store is not None:
+            return store.statistics(days)
+        
         log_files = self.get_log_files_by_date(days)
         total_messages = 0
         user_messages = 0
@@ -510,18 +585,27 @@ class MessageManager:
             "days_covered": days
         }
     
-    def save_conversation_log(self, user_message: str, assistant_message: str, dev_mode: bool = False):
+    def save_conversation_log(self, user_message: str, assistant_message: str, dev_mode: bool = False,
+                              session_id: Optional[str] = None):
         """
-        保存对话日志到文件
+        保存对话日志到文件，并同步写入对话存储
         
         Args:
             user_message: 用户消息
             assistant_message: 助手回复
             dev_mode: 是否为开发者模式（开发者模式不保存日志）
+            session_id: 所属会话ID（可选，写入对话存储）
         """
         if dev_mode:
             return  # 开发者模式不写日志
         
+        try:
+            store = self.get_conversation_store()
+            if store is not None:
+                store.append_many([("user", user_message), ("assistant", assistant_message)], session_id=session_id)
+        except Exception as e:
+            logger.error(f"写入对话存储失败: {e}")
+        
         try:
             from datetime import datetime
             import os
@@ -560,7 +644,8 @@ class MessageManager:
             self.save_conversation_log(
                 user_message, 
                 assistant_response, 
-                dev_mode=False  # 开发者模式已禁用
+                dev_mode=False,  # 开发者模式已禁用
+                session_id=session_id
             )
             
             # 触发五元组自动提取（如果记忆系统已启用）
@@ -577,41 +662,14 @@ class MessageManager:
             logger.error(f"保存对话与日志失败: {e}")
     
     def trigger_background_analysis(self, session_id: str):
-        """统一触发后台意图分析 - 整合重复逻辑"""
+        """统一触发后台意图分析 - 由分析器按会话防抖并增量分析"""
         try:
-            # 检查是否已经有分析在进行中
-            if self.analysis_in_progress.get(session_id):
-                logger.info(f"[博弈论] 会话 {session_id} 已有意图分析在进行中，跳过重复触发")
-                return
-
-            # 标记分析开始
-            self.analysis_in_progress[session_id] = True
-
-            import asyncio
             from system.background_analyzer import get_background_analyzer
-            from system.config import config
-            background_analyzer = get_background_analyzer()
-
-            # 根据配置获取意图分析轮数，默认3轮
-            intent_rounds = getattr(config.api, 'intent_analysis_rounds', 3)
-            max_messages = intent_rounds * 2  # 每轮包含用户和助手各一条消息
-
-            recent_messages = self.get_recent_messages(session_id, count=max_messages)
-            logger.info(f"[博弈论] 分析最近 {intent_rounds} 轮对话，共 {len(recent_messages)} 条消息")
-
-            # 异步执行分析任务
-            async def _execute_analysis():
-                try:
-                    await background_analyzer.analyze_intent_async(recent_messages, session_id)
-                finally:
-                    # 无论成功与否，都清除分析状态
-                    self.analysis_in_progress[session_id] = False
-                    logger.info(f"[博弈论] 会话 {session_id} 意图分析完成，状态已清除")
-
-            asyncio.create_task(_execute_analysis())
+            # 分析时才读取会话的最新消息，防抖期间到达的对话会一并纳入
+            get_background_analyzer().request_analysis(
+                session_id, lambda: self.get_recent_messages(session_id)
+            )
         except Exception as e:
-            # 发生异常时也要清除分析状态
-            self.analysis_in_progress[session_id] = False
             logger.error(f"后台意图分析触发失败: {e}")
     
     def get_all_sessions_api(self):
@@ -626,7 +684,8 @@ class MessageManager:
             return {
                 "status": "success",
                 "sessions": sessions_info,
-                "total_sessions": len(sessions_info)
+                "total_sessions": len(sessions_info),
+                "store_stats": self.sessions.stats()
             }
         except Exception as e:
             logger.error(f"获取会话信息错误: {e}")
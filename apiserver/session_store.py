@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+有界会话存储
+按LRU与空闲TTL淘汰会话，并限制会话总内存；被淘汰的会话可落盘，再次访问时按需加载
+"""
+
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Iterator, Optional, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+# 单条消息与单个会话的固定开销估算（dict/list对象本身）
+_MESSAGE_OVERHEAD_BYTES = 64
+_SESSION_OVERHEAD_BYTES = 256
+
+
+def estimate_session_bytes(session: Dict) -> int:
+    """估算会话占用的内存（以消息内容的UTF-8长度为主）"""
+    size = _SESSION_OVERHEAD_BYTES
+    for message in session.get("messages", ()):
+        content = message.get("content") or ""
+        size += len(content.encode("utf-8", errors="ignore")) + _MESSAGE_OVERHEAD_BYTES
+    return size
+
+
+class SessionStore:
+    """会话存储，接口与dict兼容（get / in / [] / del / items / clear / len）
+
+    - 访问即刷新LRU顺序与空闲时间；超过 max_sessions 或 max_bytes 时从最久未用的会话开始淘汰
+    - 空闲超过 ttl_seconds 的会话在 sweep() 时淘汰，sweep 由写入路径按 sweep_interval 自动触发
+    - spill_dir 不为空时，被淘汰的会话写入磁盘，下次 get() 命中时重新加载；落盘文件超过 spill_ttl_seconds 后删除
+    - 显式删除（del / clear）不会落盘
+    """
+
+    def __init__(self,
+                 max_sessions: int = 1000,
+                 max_bytes: int = 64 * 1024 * 1024,
+                 ttl_seconds: float = 24 * 3600,
+                 spill_dir: Optional[Union[str, Path]] = None,
+                 spill_ttl_seconds: float = 7 * 24 * 3600,
+                 sweep_interval: float = 60.0):
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.spill_dir = Path(spill_dir) if spill_dir else None
+        self.spill_ttl_seconds = spill_ttl_seconds
+        self.sweep_interval = sweep_interval
+
+        self._lock = threading.RLock()
+        # session_id -> (session, 最近访问时间, 估算字节数)
+        self._entries: "OrderedDict[str, Tuple[Dict, float, int]]" = OrderedDict()
+        self._total_bytes = 0
+        self._last_sweep = time.monotonic()
+        self._stats = {
+            "evicted_lru": 0,
+            "evicted_bytes": 0,
+            "evicted_ttl": 0,
+            "spilled": 0,
+            "reloaded": 0,
+            "spill_errors": 0,
+        }
+
+        if self.spill_dir:
+            try:
+                self.spill_dir.mkdir(parents=True, exist_ok=True)
+            except Exception as e:
+                logger.warning(f"会话落盘目录不可用，已禁用落盘: {e}")
+                self.spill_dir = None
+
+    # ========== dict兼容接口 ==========
+
+    def get(self, session_id: str, default=None) -> Optional[Dict]:
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is not None:
+                session, _, size = entry
+                self._entries[session_id] = (session, time.monotonic(), size)
+                self._entries.move_to_end(session_id)
+                return session
+            session = self._load_spilled(session_id)
+            if session is None:
+                return default
+            self._put(session_id, session)
+            self._stats["reloaded"] += 1
+            self._enforce_limits(keep=session_id)
+            return session
+
+    def __contains__(self, session_id: str) -> bool:
+        return self.get(session_id) is not None
+
+    def __getitem__(self, session_id: str) -> Dict:
+        session = self.get(session_id)
+        if session is None:
+            raise KeyError(session_id)
+        return session
+
+    def __setitem__(self, session_id: str, session: Dict):
+        with self._lock:
+            self._put(session_id, session)
+            self._maybe_sweep()
+            self._enforce_limits(keep=session_id)
+
+    def __delitem__(self, session_id: str):
+        with self._lock:
+            entry = self._entries.pop(session_id, None)
+            spilled = self._remove_spilled(session_id)
+            if entry is None and not spilled:
+                raise KeyError(session_id)
+            if entry is not None:
+                self._total_bytes -= entry[2]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(list(self._entries))
+
+    def items(self):
+        """内存中的会话（不包含已落盘的会话）"""
+        with self._lock:
+            return [(sid, entry[0]) for sid, entry in self._entries.items()]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
+            if self.spill_dir:
+                for path in self.spill_dir.glob("*.json"):
+                    path.unlink(missing_ok=True)
+
+    # ========== 容量管理 ==========
+
+    def touch(self, session_id: str):
+        """会话内容变更后调用：刷新访问时间、重新估算大小并执行容量限制"""
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None:
+                return
+            self._put(session_id, entry[0])
+            self._maybe_sweep()
+            self._enforce_limits(keep=session_id)
+
+    def sweep(self, ttl_seconds: Optional[float] = None) -> int:
+        """淘汰空闲超时的会话并清理过期落盘文件，返回淘汰数量"""
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        with self._lock:
+            self._last_sweep = now = time.monotonic()
+            expired = [sid for sid, (_, accessed, _) in self._entries.items()
+                       if now - accessed > ttl]
+            for session_id in expired:
+                self._evict(session_id, "evicted_ttl")
+        self._prune_spilled()
+        if expired:
+            logger.info(f"淘汰了 {len(expired)} 个空闲会话")
+        return len(expired)
+
+    def stats(self) -> Dict:
+        """存储与淘汰统计"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({
+                "sessions_in_memory": len(self._entries),
+                "estimated_bytes": self._total_bytes,
+                "max_sessions": self.max_sessions,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl_seconds,
+                "spill_enabled": self.spill_dir is not None,
+            })
+        return stats
+
+    def _put(self, session_id: str, session: Dict):
+        old = self._entries.get(session_id)
+        if old is not None:
+            self._total_bytes -= old[2]
+        size = estimate_session_bytes(session)
+        self._entries[session_id] = (session, time.monotonic(), size)
+        self._entries.move_to_end(session_id)
+        self._total_bytes += size
+
+    def _maybe_sweep(self):
+        if time.monotonic() - self._last_sweep >= self.sweep_interval:
+            self.sweep()
+
+    def _enforce_limits(self, keep: Optional[str] = None):
+        """从最久未用的会话开始淘汰，直到满足数量与内存上限（keep 指定的会话不淘汰）"""
+        while len(self._entries) > self.max_sessions:
+            victim = next(iter(self._entries))
+            if victim == keep:
+                break
+            self._evict(victim, "evicted_lru")
+        while self.max_bytes > 0 and self._total_bytes > self.max_bytes and len(self._entries) > 1:
+            victim = next(iter(self._entries))
+            if victim == keep:
+                break
+            self._evict(victim, "evicted_bytes")
+
+    def _evict(self, session_id: str, reason: str):
+        session, _, size = self._entries.pop(session_id)
+        self._total_bytes -= size
+        self._stats[reason] += 1
+        self._spill(session_id, session)
+        logger.debug(f"会话 {session_id} 已被淘汰({reason})")
+
+    # ========== 落盘 ==========
+
+    def _spill_path(self, session_id: str) -> Path:
+        digest = hashlib.sha1(session_id.encode("utf-8")).hexdigest()
+        return self.spill_dir / f"{digest}.json"
+
+    def _spill(self, session_id: str, session: Dict):
+        if not self.spill_dir:
+            return
+        path = self._spill_path(session_id)
+        tmp_path = path.with_suffix(".tmp")
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"session_id": session_id, "session": session}, f, ensure_ascii=False, default=str)
+            tmp_path.replace(path)
+            self._stats["spilled"] += 1
+        except Exception as e:
+            self._stats["spill_errors"] += 1
+            logger.warning(f"会话 {session_id} 落盘失败: {e}")
+
+    def _load_spilled(self, session_id: str) -> Optional[Dict]:
+        if not self.spill_dir:
+            return None
+        path = self._spill_path(session_id)
+        if not path.exists():
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            path.unlink(missing_ok=True)
+        except Exception as e:
+            self._stats["spill_errors"] += 1
+            logger.warning(f"加载落盘会话 {session_id} 失败: {e}")
+            return None
+        if data.get("session_id") != session_id:
+            return None
+        return data.get("session")
+
+    def _remove_spilled(self, session_id: str) -> bool:
+        if not self.spill_dir:
+            return False
+        path = self._spill_path(session_id)
+        if path.exists():
+            path.unlink(missing_ok=True)
+            return True
+        return False
+
+    def _prune_spilled(self):
+        if not self.spill_dir or self.spill_ttl_seconds <= 0:
+            return
+        cutoff = time.time() - self.spill_ttl_seconds
+        for path in self.spill_dir.glob("*.json"):
+            try:
+                if path.stat().st_mtime < cutoff:
+                    path.unlink(missing_ok=True)
+            except OSError:
+                continue
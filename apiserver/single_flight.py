@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+请求合并（single-flight）
+相同键的并发请求共享一次上游调用：非流式共享同一结果，流式由一个上游流向所有订阅者扇出
+"""
+
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class _StreamFlight:
+    """一次进行中的流式上游调用：缓存已收到的增量，供后加入的订阅者从头回放"""
+
+    def __init__(self):
+        self.chunks: List[Any] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+        self.changed = asyncio.Event()
+
+    def notify(self):
+        """唤醒所有等待中的订阅者，并为下一次变化换一个新的事件"""
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+
+class SingleFlight:
+    """按键合并并发请求（仅在同一事件循环内合并）
+
+    - do(): 第一个调用方发起上游调用，其余调用方等待同一结果；上游调用运行在独立任务中，
+      单个调用方取消不会影响其他等待者，全部等待者取消时才取消上游调用
+    - stream(): 第一个订阅者启动上游流，其余订阅者按顺序收到完全相同的增量；
+      全部订阅者退出时取消上游流
+    - 调用完成后立即移除，之后的相同请求会重新发起
+    """
+
+    def __init__(self):
+        self._calls: Dict[Tuple[int, str], asyncio.Task] = {}
+        self._waiters: Dict[asyncio.Task, int] = {}
+        self._streams: Dict[Tuple[int, str], _StreamFlight] = {}
+        self._stats = {"calls": 0, "coalesced": 0, "streams": 0, "stream_coalesced": 0}
+
+    def stats(self) -> Dict:
+        stats = dict(self._stats)
+        stats["in_flight"] = len(self._calls) + len(self._streams)
+        return stats
+
+    async def do(self, key: str, factory: Callable[[], Awaitable[Any]]) -> Any:
+        flight_key = (id(asyncio.get_running_loop()), key)
+        task = self._calls.get(flight_key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._calls[flight_key] = task
+            self._stats["calls"] += 1
+            task.add_done_callback(lambda t: self._finish_call(flight_key, t))
+        else:
+            self._stats["coalesced"] += 1
+            logger.debug("合并相同的进行中LLM请求")
+
+        self._waiters[task] = self._waiters.get(task, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if self._waiters.get(task) == 1 and not task.done():
+                # 最后一个等待者也已取消（如超时），不再保留上游调用
+                task.cancel()
+            raise
+        finally:
+            remaining = self._waiters.get(task, 1) - 1
+            if remaining > 0:
+                self._waiters[task] = remaining
+            else:
+                self._waiters.pop(task, None)
+
+    def _finish_call(self, flight_key: Tuple[int, str], task: asyncio.Task):
+        if self._calls.get(flight_key) is task:
+            del self._calls[flight_key]
+        if not task.cancelled():
+            # 标记异常已被读取，避免所有等待者都已取消时产生未处理异常告警
+            task.exception()
+
+    async def stream(self, key: str, factory: Callable[[], AsyncIterator[Any]]) -> AsyncIterator[Any]:
+        flight_key = (id(asyncio.get_running_loop()), key)
+        flight = self._streams.get(flight_key)
+        if flight is None:
+            flight = _StreamFlight()
+            self._streams[flight_key] = flight
+            flight.task = asyncio.ensure_future(self._pump(flight_key, flight, factory))
+            self._stats["streams"] += 1
+        else:
+            self._stats["stream_coalesced"] += 1
+            logger.debug("合并相同的进行中LLM流式请求")
+
+        flight.subscribers += 1
+        index = 0
+        try:
+            while True:
+                while index < len(flight.chunks):
+                    yield flight.chunks[index]
+                    index += 1
+                if flight.done:
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+                await flight.changed.wait()
+        finally:
+            flight.subscribers -= 1
+            if flight.subscribers == 0 and not flight.done:
+                # 所有订阅者都已离开（如客户端断开），取消上游流
+                if self._streams.get(flight_key) is flight:
+                    del self._streams[flight_key]
+                flight.task.cancel()
+
+    async def _pump(self, flight_key: Tuple[int, str], flight: _StreamFlight,
+                    factory: Callable[[], AsyncIterator[Any]]):
+        try:
+            async for item in factory():
+                flight.chunks.append(item)
+                flight.notify()
+        except Exception as e:
+            flight.error = e
+        finally:
+            flight.done = True
+            if self._streams.get(flight_key) is flight:
+                del self._streams[flight_key]
+            flight.notify()
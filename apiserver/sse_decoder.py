@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+增量SSE解码器
+将上游LLM的 text/event-stream 字节流还原为完整事件，支持跨块的行重组与多行 data 事件
+"""
+
+from typing import List, Optional
+
+DONE_MARKER = "[DONE]"
+
+
+class SSEDecoder:
+    """增量SSE解码器
+
+    - 字节缓冲区 + 扫描偏移，已检查过的字节不会被重复扫描
+    - 行在完整后才解码为UTF-8，多字节字符跨块不会被截断
+    - 同一事件中的多行 data 按规范以换行拼接
+    - 空行分发事件；流结束时调用 flush() 处理未以空行结尾的事件
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._scan_pos = 0  # 缓冲区中尚未扫描换行符的起始位置
+        self._data_lines: List[str] = []
+        self.event_type: Optional[str] = None  # 最近一个事件的event字段
+        self.done = False  # 是否已收到 [DONE]
+
+    def feed(self, chunk: bytes) -> List[str]:
+        """输入一段字节，返回本次可分发的完整事件data列表"""
+        if self.done or not chunk:
+            return []
+        self._buffer.extend(chunk)
+
+        events: List[str] = []
+        line_start = 0
+        while True:
+            newline = self._buffer.find(b"\n", self._scan_pos)
+            if newline < 0:
+                break
+            line_end = newline
+            if line_end > line_start and self._buffer[line_end - 1] == 0x0D:  # 去掉 \r\n 中的 \r
+                line_end -= 1
+            self._process_line(bytes(self._buffer[line_start:line_end]), events)
+            line_start = newline + 1
+            self._scan_pos = line_start
+            if self.done:
+                break
+
+        if line_start:
+            # 丢弃已消费的行，只保留未完成的行尾
+            del self._buffer[:line_start]
+        # 未找到换行的部分已全部扫描过，下次从末尾继续
+        self._scan_pos = len(self._buffer)
+        return events
+
+    def flush(self) -> List[str]:
+        """流结束时调用：处理缓冲区中残留的最后一行及未分发的事件"""
+        events: List[str] = []
+        if self._buffer and not self.done:
+            line = bytes(self._buffer).rstrip(b"\r")
+            self._process_line(line, events)
+        self._buffer.clear()
+        self._scan_pos = 0
+        if not self.done:
+            self._dispatch(events)
+        return events
+
+    def _process_line(self, raw: bytes, events: List[str]):
+        """处理单行SSE字段"""
+        if not raw:
+            self._dispatch(events)
+            return
+        if raw[:1] == b":":  # 注释/心跳行
+            return
+
+        line = raw.decode("utf-8", errors="replace")
+        field, sep, value = line.partition(":")
+        if sep and value.startswith(" "):
+            value = value[1:]
+
+        if field == "data":
+            if not self._data_lines and value.strip() == DONE_MARKER:
+                self.done = True
+                return
+            self._data_lines.append(value)
+        elif field == "event":
+            self.event_type = value
+
+    def _dispatch(self, events: List[str]):
+        """分发当前累积的事件"""
+        if self._data_lines:
+            events.append("\n".join(self._data_lines))
+            self._data_lines = []
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+/chat/stream 流式协议
+支持三种帧格式，由请求的 stream_format 字段或 Accept 头协商：
+- base64: 旧版格式，每个文本增量为 `data: <base64>`，保留给旧客户端
+- sse:    UTF-8 SSE，文本增量为 `data: <JSON字符串>`，控制消息与旧版一致
+- ndjson: 每行一个JSON对象 {"type": ..., "content": ...}
+"""
+
+import base64
+import json
+from typing import Optional
+
+STREAM_FORMAT_BASE64 = "base64"
+STREAM_FORMAT_SSE = "sse"
+STREAM_FORMAT_NDJSON = "ndjson"
+STREAM_FORMATS = (STREAM_FORMAT_BASE64, STREAM_FORMAT_SSE, STREAM_FORMAT_NDJSON)
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+SSE_MEDIA_TYPE = "text/event-stream"
+
+
+def negotiate_stream_format(requested: Optional[str], accept: Optional[str] = None) -> str:
+    """确定流式帧格式：显式字段优先，其次Accept头，默认base64以兼容旧客户端"""
+    if requested:
+        requested = requested.strip().lower()
+        if requested in STREAM_FORMATS:
+            return requested
+    if accept and NDJSON_MEDIA_TYPE in accept:
+        return STREAM_FORMAT_NDJSON
+    return STREAM_FORMAT_BASE64
+
+
+class StreamFramer:
+    """按协商格式将文本增量与控制消息编码为输出帧"""
+
+    def __init__(self, stream_format: str = STREAM_FORMAT_BASE64):
+        self.stream_format = stream_format if stream_format in STREAM_FORMATS else STREAM_FORMAT_BASE64
+
+    @property
+    def media_type(self) -> str:
+        return NDJSON_MEDIA_TYPE if self.stream_format == STREAM_FORMAT_NDJSON else SSE_MEDIA_TYPE
+
+    def text(self, content: str) -> str:
+        """文本增量帧"""
+        if self.stream_format == STREAM_FORMAT_SSE:
+            return f"data: {json.dumps(content, ensure_ascii=False)}\n\n"
+        if self.stream_format == STREAM_FORMAT_NDJSON:
+            return self._ndjson("text", content)
+        b64 = base64.b64encode(content.encode('utf-8')).decode('ascii')
+        return f"data: {b64}\n\n"
+
+    def control(self, kind: str, value: str) -> str:
+        """控制消息帧（session_id / audio_url / 错误）"""
+        if self.stream_format == STREAM_FORMAT_NDJSON:
+            return self._ndjson(kind, value)
+        return f"data: {kind}: {value}\n\n"
+
+    def session_id(self, session_id: str) -> str:
+        return self.control("session_id", session_id)
+
+    def audio_url(self, url: str) -> str:
+        return self.control("audio_url", url)
+
+    def error(self, message: str) -> str:
+        if self.stream_format == STREAM_FORMAT_NDJSON:
+            return self._ndjson("error", message)
+        return f"data: 错误: {message}\n\n"
+
+    def done(self) -> str:
+        if self.stream_format == STREAM_FORMAT_NDJSON:
+            return json.dumps({"type": "done"}) + "\n"
+        return "data: [DONE]\n\n"
+
+    @staticmethod
+    def _ndjson(kind: str, content: str) -> str:
+        return json.dumps({"type": kind, "content": content}, ensure_ascii=False) + "\n"
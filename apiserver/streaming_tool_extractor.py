@@ -5,13 +5,13 @@
 负责将LLM流式输出按句切割并发送给语音集成（TTS）。不再检测或处理工具调用。
 """
 
-import re
 import json
 import logging
 import asyncio
 import sys
 import os
-from typing import Callable, Optional, Dict, Any, Union, List
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional, Dict, Any, Union, List, Set
 
 # 添加项目根目录到Python路径
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -22,11 +22,27 @@ except ImportError:
     # 如果直接导入失败，尝试从父目录导入
     sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
     from system.config import config, AI_NAME
+from voice.output.sentence_segmenter import SentenceSegmenter
 
 # 工具调用解析/执行已不再需要
 
 logger = logging.getLogger("StreamingToolCallExtractor")
 
+# 所有流共享的TTS投递线程池（替代每句一个线程）
+_tts_dispatch_pool: Optional[ThreadPoolExecutor] = None
+# 持有投递任务的强引用，避免事件循环只保留弱引用导致任务被回收
+_dispatch_tasks: Set[asyncio.Task] = set()
+
+def get_tts_dispatch_pool() -> ThreadPoolExecutor:
+    """获取共享的TTS投递线程池"""
+    global _tts_dispatch_pool
+    if _tts_dispatch_pool is None:
+        _tts_dispatch_pool = ThreadPoolExecutor(
+            max_workers=config.tts.dispatch_workers,
+            thread_name_prefix="tts-dispatch"
+        )
+    return _tts_dispatch_pool
+
 class CallbackManager:
     """回调函数管理器 - 统一处理同步/异步回调"""
     
@@ -65,9 +81,8 @@ class StreamingToolCallExtractor:
     
     def __init__(self, mcp_manager=None):
         self.mcp_manager = mcp_manager
-        self.text_buffer = ""  # 普通文本缓冲区
-        self.complete_text = ""  # 完整文本内容
-        self.sentence_endings = r"[。？！；\.\?\!\;]"  # 断句标点
+        self.segmenter = SentenceSegmenter()  # 流式断句器（每个字符只扫描一次）
+        self._complete_parts: List[str] = []  # 完整文本分片，取用时再拼接
         
         # 使用回调管理器
         self.callback_manager = CallbackManager()
@@ -78,6 +93,10 @@ class StreamingToolCallExtractor:
         # 工具调用功能已移除
         self.tool_calls_queue = None
         
+        # 有序投递管道：每个流一个有界队列 + 一个消费任务，保证句子严格按序送达TTS
+        self._dispatch_queue: Optional[asyncio.Queue] = None
+        self._dispatch_task: Optional[asyncio.Task] = None
+        
     def set_callbacks(self, 
                      on_text_chunk: Optional[Callable] = None,
                      voice_integration=None):
@@ -91,10 +110,9 @@ class StreamingToolCallExtractor:
         处理文本块，实时按句切割并发送给语音集成
         
         处理流程：
-        1. 累积完整文本（用于最终保存）
-        2. 逐字符检查句子结束符
-        3. 遇到结束符时立即切割并发送完整句子到TTS
-        4. 保留未完成的句子部分继续累积
+        1. 累积完整文本分片（用于最终保存）
+        2. 断句器只扫描新到达的字符，产出已完整的句子
+        3. 完整句子按序投递到TTS，未完成部分留在断句器中继续累积
         """
         if not text_chunk:
             return None
@@ -107,46 +125,56 @@ class StreamingToolCallExtractor:
             results.append(result)
 
         # 累积完整文本（用于最终保存到数据库）
-        self.complete_text += text_chunk
+        self._complete_parts.append(text_chunk)
             
         # 实时按句切割并发送到TTS
-        for char in text_chunk:
-            self.text_buffer += char
-            # 检查是否遇到句子结束符（。？！；等）
-            if re.search(self.sentence_endings, char):
-                # 立即切割并发送完整句子到TTS
-                sentences = re.split(self.sentence_endings, self.text_buffer)
-                if len(sentences) > 1:
-                    complete_sentence = sentences[0] + char
-                    if complete_sentence.strip():
-                        # 立即发送到语音集成进行TTS合成（不阻塞文本流）
-                        self._send_to_voice_integration(complete_sentence)
-                    # 保留未完成的句子部分，继续累积
-                    remaining_sentences = [s for s in sentences[1:] if s.strip()]
-                    self.text_buffer = "".join(remaining_sentences)
+        for sentence in self.segmenter.feed(text_chunk):
+            if sentence.strip():
+                # 按序投递到语音集成进行TTS合成
+                await self._send_to_voice_integration(sentence)
         return results if results else None
     
+    @property
+    def text_buffer(self) -> str:
+        """尚未断句的剩余文本"""
+        return self.segmenter.pending
+    
     async def _flush_text_buffer(self):
         """刷新文本缓冲区 - 处理流式结束时的剩余文本"""
-        if self.text_buffer:
-            # 立即发送剩余的未完成句子到语音集成（不阻塞）
-            self._send_to_voice_integration(self.text_buffer)
-            
-            self.text_buffer = ""
-            return None
+        remaining = self.segmenter.flush()
+        if remaining and remaining.strip():
+            # 发送剩余的未完成句子到语音集成
+            await self._send_to_voice_integration(remaining)
         return None
     
-    def _send_to_voice_integration(self, text: str):
-        """发送文本到语音集成（不阻塞文本流）"""
+    async def _send_to_voice_integration(self, text: str):
+        """将句子放入有序投递队列；队列满时等待（背压），不再为每句创建线程
+
+        这里的文本已经由本切割器断好句，直接作为完整句子交给语音集成，避免再经其断句器延后一句
+        """
         if self.voice_integration:
+            await self._enqueue_dispatch(self.voice_integration.receive_sentence, text)
+    
+    async def _enqueue_dispatch(self, func: Callable, *args):
+        """放入投递队列，首次使用时启动本流的消费任务"""
+        if self._dispatch_queue is None:
+            self._dispatch_queue = asyncio.Queue(maxsize=config.tts.dispatch_queue_size)
+            self._dispatch_task = asyncio.create_task(self._dispatch_worker(self._dispatch_queue))
+            _dispatch_tasks.add(self._dispatch_task)
+            self._dispatch_task.add_done_callback(_dispatch_tasks.discard)
+        await self._dispatch_queue.put((func, args))
+    
+    async def _dispatch_worker(self, queue: asyncio.Queue):
+        """逐个取出并在共享线程池中执行，前一句完成后才投递下一句"""
+        loop = asyncio.get_running_loop()
+        pool = get_tts_dispatch_pool()
+        while True:
+            item = await queue.get()
+            if item is None:
+                break
+            func, args = item
             try:
-                # 在独立线程中处理TTS，不阻塞文本流
-                import threading
-                threading.Thread(
-                    target=self.voice_integration.receive_text_chunk,
-                    args=(text,),
-                    daemon=True
-                ).start()
+                await loop.run_in_executor(pool, func, *args)
             except Exception as e:
                 logger.error(f"发送到语音集成失败: {e}")
     
@@ -162,16 +190,36 @@ class StreamingToolCallExtractor:
             if result:
                 results.append(result)
         
+        # 排在所有句子之后处理语音集成缓冲区剩余文本，然后结束本流的投递任务
+        if self._dispatch_queue is not None:
+            await self._enqueue_dispatch(self.voice_integration.finish_processing)
+            await self._dispatch_queue.put(None)
+            self._dispatch_queue = None
+        
         return results if results else None
     
+    def close(self):
+        """流被中断（如客户端断开）时结束投递任务；正常结束时 finish_processing() 已让任务处理完剩余句子后退出"""
+        if self._dispatch_queue is not None:
+            self._dispatch_queue = None
+            if self._dispatch_task is not None and not self._dispatch_task.done():
+                self._dispatch_task.cancel()
+    
+    @property
+    def complete_text(self) -> str:
+        """完整文本内容"""
+        if len(self._complete_parts) > 1:
+            self._complete_parts = ["".join(self._complete_parts)]
+        return self._complete_parts[0] if self._complete_parts else ""
+    
     def get_complete_text(self) -> str:
         """获取完整文本内容"""
         return self.complete_text
     
     def reset(self):
         """重置提取器状态"""
-        self.text_buffer = ""
-        self.complete_text = ""
+        self.segmenter.reset()
+        self._complete_parts = []
     
     async def process_streaming_response(self, llm_service, messages: List[Dict], 
                                        temperature: float = 0.7, voice_integration=None):
@@ -179,24 +227,18 @@ class StreamingToolCallExtractor:
         if voice_integration:
             self.voice_integration = voice_integration
         
-        async for chunk in llm_service.stream_chat_with_context(messages, temperature):
-            if chunk.startswith("data: "):
-                # 解码base64内容
-                try:
-                    import base64
-                    data_str = chunk[6:].strip()
-                    if data_str == '[DONE]':
-                        break
-                    decoded = base64.b64decode(data_str).decode('utf-8')
-                    await self.process_text_chunk(decoded)
-                except Exception as e:
-                    logger.error(f"处理流式响应块失败: {e}")
-                    continue
-            else:
-                # 直接处理文本内容
-                await self.process_text_chunk(chunk)
-        
-        # 完成处理
-        await self.finish_processing()
+        # 直接消费已解码的文本增量，无需base64往返
+        try:
+            try:
+                async for content in llm_service.stream_deltas(messages, temperature):
+                    await self.process_text_chunk(content)
+            except Exception as e:
+                logger.error(f"处理流式响应失败: {e}")
+            
+            # 完成处理
+            await self.finish_processing()
+        finally:
+            # 被取消时同样结束投递任务（正常完成后为空操作）
+            self.close()
         return self.get_complete_text()
 
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+MCP工具执行池
+按清单声明的执行类别（async / thread / process）分派 handle_handoff，阻塞型工具不再占用事件循环；
+附带事件循环延迟看门狗，记录拖慢事件循环的工具调用
+"""
+
+import asyncio
+import importlib
+import inspect
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Dict, Optional, Tuple
+
+from system.config import config, logger
+
+EXECUTION_ASYNC = "async"
+EXECUTION_THREAD = "thread"
+EXECUTION_PROCESS = "process"
+EXECUTION_CLASSES = (EXECUTION_ASYNC, EXECUTION_THREAD, EXECUTION_PROCESS)
+
+# 工作线程各自持有一个事件循环，用于在线程中执行协程型 handle_handoff（循环内资源可跨调用复用）
+_thread_local = threading.local()
+
+# 子进程内按入口缓存的agent实例
+_process_agents: Dict[Tuple[str, str], Any] = {}
+
+
+def _run_handoff_in_thread(handler, handoff_data: Dict[str, Any]):
+    """在工作线程中执行handle_handoff，协程在线程专属的事件循环上运行"""
+    result = handler(handoff_data)
+    if inspect.isawaitable(result):
+        loop = getattr(_thread_local, "loop", None)
+        if loop is None or loop.is_closed():
+            loop = asyncio.new_event_loop()
+            _thread_local.loop = loop
+        result = loop.run_until_complete(result)
+    return result
+
+
+def _run_handoff_in_process(module_name: str, class_name: str, handoff_data: Dict[str, Any]):
+    """子进程入口：按清单entryPoint创建（并缓存）agent实例后执行handle_handoff"""
+    key = (module_name, class_name)
+    agent = _process_agents.get(key)
+    if agent is None:
+        agent_cls = getattr(importlib.import_module(module_name), class_name)
+        agent = agent_cls()
+        _process_agents[key] = agent
+    return _run_handoff_in_thread(agent.handle_handoff, handoff_data)
+
+
+def resolve_execution_class(manifest: Optional[Dict[str, Any]], handler) -> str:
+    """确定执行类别：清单 executionClass 优先，未声明时协程用async、同步函数用thread"""
+    declared = (manifest or {}).get("executionClass")
+    if declared:
+        declared = str(declared).lower()
+        if declared in EXECUTION_CLASSES:
+            return declared
+        logger.warning(f"未知的executionClass: {declared}，按默认规则执行")
+    return EXECUTION_ASYNC if inspect.iscoroutinefunction(handler) else EXECUTION_THREAD
+
+
+class ExecutionPools:
+    """有界的线程池与进程池（首次使用时创建）"""
+
+    def __init__(self, thread_workers: int = 8, process_workers: int = 2):
+        self.thread_workers = thread_workers
+        self.process_workers = process_workers
+        self._thread_pool: Optional[ThreadPoolExecutor] = None
+        self._process_pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def _get_thread_pool(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._thread_pool is None:
+                self._thread_pool = ThreadPoolExecutor(max_workers=self.thread_workers,
+                                                       thread_name_prefix="mcp-tool")
+            return self._thread_pool
+
+    def _get_process_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._process_pool is None:
+                self._process_pool = ProcessPoolExecutor(max_workers=self.process_workers)
+            return self._process_pool
+
+    async def run(self, execution_class: str, agent, handoff_data: Dict[str, Any],
+                  manifest: Optional[Dict[str, Any]] = None):
+        """按执行类别调用 agent.handle_handoff"""
+        loop = asyncio.get_running_loop()
+        if execution_class == EXECUTION_PROCESS:
+            entry = (manifest or {}).get("entryPoint", {})
+            if entry.get("module") and entry.get("class"):
+                return await loop.run_in_executor(
+                    self._get_process_pool(), _run_handoff_in_process,
+                    entry["module"], entry["class"], handoff_data
+                )
+            logger.warning("executionClass为process但清单缺少entryPoint，改用线程池执行")
+            execution_class = EXECUTION_THREAD
+
+        if execution_class == EXECUTION_THREAD:
+            return await loop.run_in_executor(
+                self._get_thread_pool(), _run_handoff_in_thread, agent.handle_handoff, handoff_data
+            )
+
+        result = agent.handle_handoff(handoff_data)
+        if inspect.isawaitable(result):
+            result = await result
+        return result
+
+    def shutdown(self):
+        with self._lock:
+            thread_pool, self._thread_pool = self._thread_pool, None
+            process_pool, self._process_pool = self._process_pool, None
+        if thread_pool is not None:
+            thread_pool.shutdown(wait=False, cancel_futures=True)
+        if process_pool is not None:
+            process_pool.shutdown(wait=False, cancel_futures=True)
+
+
+class LoopLagWatchdog:
+    """事件循环延迟看门狗
+
+    定期休眠 interval 秒并测量实际唤醒延迟，超过 threshold 时记录与阻塞时段重叠的事件循环内工具调用
+    （阻塞结束时调用通常已返回，因此保留最近结束的调用用于归因）
+    """
+
+    def __init__(self, interval: float = 0.5, threshold: float = 0.25):
+        self.interval = interval
+        self.threshold = threshold
+        self.max_lag = 0.0
+        self.lag_events = 0
+        self._inflight: Dict[int, Tuple[str, str, float]] = {}  # 调用序号 -> (服务, 工具, 开始时间)
+        self._recent: deque = deque(maxlen=64)  # 最近结束的调用 (服务, 工具, 开始时间, 结束时间)
+        self._offenders: Dict[str, int] = {}
+        self._next_id = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def ensure_started(self):
+        """在当前事件循环上启动看门狗（已启动则忽略）"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._watch())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def begin(self, service_name: str, tool_name: str) -> int:
+        """登记一次在事件循环上执行的调用"""
+        self._next_id += 1
+        self._inflight[self._next_id] = (service_name, tool_name, time.monotonic())
+        return self._next_id
+
+    def end(self, call_id: int):
+        call = self._inflight.pop(call_id, None)
+        if call is not None:
+            self._recent.append((*call, time.monotonic()))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_lag": round(self.max_lag, 3),
+            "lag_events": self.lag_events,
+            "offenders": dict(self._offenders),
+        }
+
+    async def _watch(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            lag = time.monotonic() - started - self.interval
+            if lag <= self.threshold:
+                continue
+            self.lag_events += 1
+            self.max_lag = max(self.max_lag, lag)
+            now = time.monotonic()
+            calls = [(service, tool, begin, now) for service, tool, begin in self._inflight.values()]
+            calls += [call for call in self._recent if call[3] >= started]
+            suspects = []
+            for service, tool, begin, finished in calls:
+                name = f"{service}.{tool}"
+                self._offenders[name] = self._offenders.get(name, 0) + 1
+                suspects.append(f"{name}({finished - begin:.2f}s)")
+            logger.warning(
+                f"[MCP看门狗] 事件循环阻塞 {lag * 1000:.0f}ms，期间的事件循环内调用: {', '.join(suspects) or '无'}"
+            )
+
+
+# 全局执行池与看门狗
+_execution_pools: Optional[ExecutionPools] = None
+_loop_watchdog: Optional[LoopLagWatchdog] = None
+
+
+def get_execution_pools() -> ExecutionPools:
+    """获取全局执行池"""
+    global _execution_pools
+    if _execution_pools is None:
+        _execution_pools = ExecutionPools(
+            thread_workers=config.mcp.thread_pool_workers,
+            process_workers=config.mcp.process_pool_workers,
+        )
+    return _execution_pools
+
+
+def get_loop_watchdog() -> LoopLagWatchdog:
+    """获取全局事件循环看门狗"""
+    global _loop_watchdog
+    if _loop_watchdog is None:
+        _loop_watchdog = LoopLagWatchdog(
+            interval=config.mcp.loop_lag_interval,
+            threshold=config.mcp.loop_lag_threshold,
+        )
+    return _loop_watchdog
@@ -2,7 +2,6 @@ import asyncio
 import logging
 import inspect
 from typing import Dict, Optional, List, Any, Callable, Awaitable, Generic, TypeVar, Union, cast
-from contextlib import AsyncExitStack
 import sys
 from pydantic import BaseModel, TypeAdapter
 from dataclasses import dataclass
@@ -11,8 +10,7 @@ from datetime import datetime
 import importlib,os,inspect # 自动注册相关
 from pathlib import Path
 
-from nagaagent_core.core import ClientSession, StdioServerParameters
-from mcp.client.stdio import stdio_client
+from nagaagent_core.core import ClientSession
 # 延迟导入MCP_REGISTRY，避免循环导入死锁
 # from mcpserver.mcp_registry import MCP_REGISTRY # MCP服务注册表
 
@@ -129,8 +127,6 @@ class MCPManager:
     def __init__(self):
         """初始化MCP管理器"""
         self.services = {}
-        self.tools_cache = {}
-        self.exit_stack = AsyncExitStack()
         self.handoffs = {} # 服务对应的handoff对象
         self.handoff_filters = {} # 服务对应的handoff过滤器
         self.handoff_callbacks = {} # 服务对应的handoff回调
@@ -217,9 +213,9 @@ class MCPManager:
                     # 继续执行，使用原始消息
                 
             # 创建代理实例
-            from mcpserver.mcp_registry import MCP_REGISTRY # 统一注册中心
+            from mcpserver.mcp_registry import get_agent # 统一注册中心（按需加载Agent）
             agent_name = service["agent_name"]
-            agent = MCP_REGISTRY.get(agent_name)
+            agent = await get_agent(agent_name)
             if not agent:
                 raise ValueError(f"找不到已注册的Agent实例: {agent_name}")
             sys.stderr.write(f"使用注册中心中的Agent实例: {agent_name}\n".encode('utf-8', errors='replace').decode('utf-8'))
@@ -246,7 +242,7 @@ class MCPManager:
             }, ensure_ascii=False)
             
     async def connect_service(self, service_name: str) -> Optional[ClientSession]:
-        """连接到指定的MCP服务
+        """连接到指定的stdio MCP服务（由会话池监督，首次使用时启动）
         
         Args:
             service_name: MCP服务名称
@@ -254,51 +250,14 @@ class MCPManager:
         Returns:
             Optional[ClientSession]: 成功返回会话对象，失败返回None
         """
-        # 直接返回None，或根据MCP_REGISTRY判断服务是否存在
-        from mcpserver.mcp_registry import MCP_REGISTRY # 延迟导入
-        if service_name not in MCP_REGISTRY:
-            logger.warning(f"MCP服务 {service_name} 不存在")
-            return None
-            
-        # 如果已连接，直接返回会话
-        if service_name in self.services:
-            return self.services[service_name]
-            
-        service_config = MCP_REGISTRY[service_name]
-        command = "python" if service_config["type"] == "python" else "node"
-        
-        try:
-            logger.info(f"正在连接MCP服务: {service_name}")
-            server_params = StdioServerParameters(
-                command=command,
-                args=[service_config["script_path"]],
-                env=None
-            )
-            
-            # 创建服务连接
-            stdio_transport = await self.exit_stack.enter_async_context(
-                stdio_client(server_params)
-            )
-            stdio, write = stdio_transport
-            
-            # 创建并初始化会话
-            session = await self.exit_stack.enter_async_context(
-                ClientSession(stdio, write)
-            )
-            await session.initialize()
-            
-            # 缓存会话
-            self.services[service_name] = session
-            logger.info(f"MCP服务 {service_name} 连接成功")
-            return session
-            
-        except Exception as e:
-            logger.error(f"连接MCP服务 {service_name} 失败: {str(e)}")
-            import traceback;traceback.print_exc(file=sys.stderr)
-            return None
-            
-    async def get_service_tools(self, service_name: str) -> list:
-        """获取指定MCP服务的可用工具列表
+        from mcpserver.stdio_pool import get_stdio_pool # 延迟导入
+        session = await get_stdio_pool().get_session(service_name)
+        if session is None:
+            logger.warning(f"stdio MCP服务 {service_name} 不可用")
+        return session
+            
+    async def list_stdio_tools(self, service_name: str) -> list:
+        """获取指定stdio MCP服务的可用工具列表（会话重启后缓存失效）
         
         Args:
             service_name: MCP服务名称
@@ -306,27 +265,16 @@ class MCPManager:
         Returns:
             list: 工具列表
         """
-        # 检查缓存
-        if service_name in self.tools_cache:
-            return self.tools_cache[service_name]
-            
-        session = await self.connect_service(service_name)
-        if not session:
-            return []
-            
+        from mcpserver.stdio_pool import get_stdio_pool # 延迟导入
         try:
-            response = await session.list_tools()
-            tools = response.tools
-            # 缓存工具列表
-            self.tools_cache[service_name] = tools
-            return tools
+            return await get_stdio_pool().list_tools(service_name)
         except Exception as e:
             logger.error(f"获取服务 {service_name} 的工具列表失败: {str(e)}")
             import traceback;traceback.print_exc(file=sys.stderr)
             return []
             
     async def call_service_tool(self, service_name: str, tool_name: str, args: dict):
-        """调用指定MCP服务的工具
+        """调用指定stdio MCP服务的工具
         
         Args:
             service_name: MCP服务名称
@@ -336,13 +284,10 @@ class MCPManager:
         Returns:
             工具调用结果
         """
-        session = await self.connect_service(service_name)
-        if not session:
-            return None
-            
+        from mcpserver.stdio_pool import get_stdio_pool # 延迟导入
         try:
             logger.debug(f"调用工具: {service_name}.{tool_name} 参数: {args}")
-            result = await session.call_tool(tool_name, args)
+            result = await get_stdio_pool().call_tool(service_name, tool_name, args)
             logger.debug(f"工具调用结果: {result}")
             return result
         except Exception as e:
@@ -363,10 +308,10 @@ class MCPManager:
         """
         try:
             # 只支持MCP服务调用（通过MCP_REGISTRY）
-            from mcpserver.mcp_registry import MCP_REGISTRY # 延迟导入
+            from mcpserver.mcp_registry import get_agent # 延迟导入
             
-            # 直接查找服务（现在注册名称和调用名称已经统一）
-            agent = MCP_REGISTRY.get(service_name)
+            # 直接查找服务（现在注册名称和调用名称已经统一），首次调用时才导入并实例化Agent
+            agent = await get_agent(service_name)
             
             if agent:
                 # 对于MCP类型的agent，统一使用handle_handoff方法
@@ -377,13 +322,23 @@ class MCPManager:
                         **args
                     }
 
-                    logger.info(f"MCP调用: {service_name}.{tool_name} with args: {args}")
+                    # 按清单声明的执行类别分派：async在事件循环上执行，thread/process进入有界执行池
+                    from mcpserver.mcp_registry import MANIFEST_CACHE # 延迟导入
+                    from mcpserver.execution_pools import (
+                        EXECUTION_ASYNC, get_execution_pools, get_loop_watchdog, resolve_execution_class
+                    )
+                    manifest = MANIFEST_CACHE.get(service_name)
+                    execution_class = resolve_execution_class(manifest, agent.handle_handoff)
+                    logger.info(f"MCP调用: {service_name}.{tool_name} [{execution_class}] with args: {args}")
 
-                    # 调用handle_handoff方法
-                    if asyncio.iscoroutinefunction(agent.handle_handoff):
-                        result = await agent.handle_handoff(handoff_data)
-                    else:
-                        result = agent.handle_handoff(handoff_data)
+                    watchdog = get_loop_watchdog()
+                    watchdog.ensure_started()
+                    call_id = watchdog.begin(service_name, tool_name) if execution_class == EXECUTION_ASYNC else None
+                    try:
+                        result = await get_execution_pools().run(execution_class, agent, handoff_data, manifest)
+                    finally:
+                        if call_id is not None:
+                            watchdog.end(call_id)
 
                     logger.info(f"MCP调用结果: {result}")
                     return result
@@ -549,8 +504,12 @@ class MCPManager:
         """清理所有MCP服务连接"""
         logger.info("正在清理MCP服务连接...")
         try:
-            await self.exit_stack.aclose()
-            self.services.clear();self.tools_cache.clear()
+            from mcpserver.execution_pools import get_execution_pools, get_loop_watchdog
+            get_loop_watchdog().stop()
+            get_execution_pools().shutdown()
+            from mcpserver.stdio_pool import get_stdio_pool
+            await get_stdio_pool().close()
+            self.services.clear()
             logger.info("MCP服务连接清理完成")
         except Exception as e:
             logger.error(f"清理MCP服务连接时出错: {str(e)}")
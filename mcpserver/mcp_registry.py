@@ -7,15 +7,162 @@ from pathlib import Path
 import sys
 from typing import Dict, Any, Optional, List
 
-# 从稳定模块导入MCP管理功能
+import asyncio
+import hashlib
+import logging
+import threading
+
+# 从稳定模块导入共享的注册表（其他模块直接引用这两个字典）
 from nagaagent_core.stable.mcp import (
-    load_manifest_file,
-    create_agent_instance,
-    scan_and_register_mcp_agents,
     MCP_REGISTRY,
     MANIFEST_CACHE
 )
 
+logger = logging.getLogger(__name__)
+
+MCP_ROOT = Path(__file__).resolve().parent
+MANIFEST_FILENAME = "agent-manifest.json"
+_INDEX_VERSION = 1
+
+
+class LazyAgent:
+    """延迟实例化的Agent占位对象
+
+    注册时只记录清单，首次调用时才导入 entryPoint 模块并创建实例，实例随后替换注册表中的占位对象。
+    异步路径（get_agent）在线程中导入模块，避免阻塞事件循环；直接访问属性时同步加载
+    """
+
+    def __init__(self, service_name: str, manifest: Dict[str, Any]):
+        self.service_name = service_name
+        self.manifest = manifest
+        self._instance = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self._instance is not None
+
+    def _entry(self):
+        entry = self.manifest.get("entryPoint", {})
+        return entry["module"], entry["class"]
+
+    def _instantiate(self, module):
+        with self._lock:
+            if self._instance is None:
+                _, class_name = self._entry()
+                self._instance = getattr(module, class_name)()
+                MCP_REGISTRY[self.service_name] = self._instance
+                logger.info(f"MCP服务 {self.service_name} 已加载")
+            return self._instance
+
+    def load(self):
+        if self._instance is None:
+            module_name, _ = self._entry()
+            self._instantiate(importlib.import_module(module_name))
+        return self._instance
+
+    async def load_async(self):
+        if self._instance is None:
+            module_name, _ = self._entry()
+            module = await asyncio.to_thread(importlib.import_module, module_name)
+            self._instantiate(module)
+        return self._instance
+
+    def __getattr__(self, name):
+        # 仅在访问Agent自身属性时触发加载（内部属性在__init__中已设置，不会走到这里）
+        return getattr(self.load(), name)
+
+    def __repr__(self):
+        return f"<LazyAgent {self.service_name} loaded={self.loaded}>"
+
+
+async def get_agent(service_name: str):
+    """获取服务的Agent实例，必要时在线程中导入模块后实例化；未注册返回None"""
+    agent = MCP_REGISTRY.get(service_name)
+    if isinstance(agent, LazyAgent):
+        return await agent.load_async()
+    return agent
+
+
+def _index_path() -> Optional[Path]:
+    try:
+        from system.config import config
+        if not config.mcp.manifest_index_cache:
+            return None
+        return Path(config.system.log_dir) / "mcp_manifest_index.json"
+    except Exception:
+        return None
+
+
+def _load_index(path: Optional[Path]) -> Dict[str, Any]:
+    if path is None or not path.exists():
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") == _INDEX_VERSION:
+            return data.get("entries", {})
+    except Exception as e:
+        logger.warning(f"读取MCP清单索引失败，将重新解析清单: {e}")
+    return {}
+
+
+def _save_index(path: Optional[Path], entries: Dict[str, Any]):
+    if path is None:
+        return
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": _INDEX_VERSION, "entries": entries}, f, ensure_ascii=False)
+        tmp_path.replace(path)
+    except Exception as e:
+        logger.warning(f"写入MCP清单索引失败: {e}")
+
+
+def scan_manifests() -> Dict[str, Dict[str, Any]]:
+    """扫描各服务目录下的清单文件，返回 {服务名: 清单}
+
+    清单按 (mtime, 大小) 命中磁盘索引时直接复用；变化时重新读取，内容哈希未变仍复用已解析结果
+    """
+    index_path = _index_path()
+    cached = _load_index(index_path)
+    entries: Dict[str, Any] = {}
+    manifests: Dict[str, Dict[str, Any]] = {}
+    parsed = 0
+
+    for manifest_path in sorted(MCP_ROOT.glob(f"*/{MANIFEST_FILENAME}")):
+        key = manifest_path.parent.name
+        try:
+            stat = manifest_path.stat()
+            entry = cached.get(key)
+            if not (entry and entry.get("mtime_ns") == stat.st_mtime_ns and entry.get("size") == stat.st_size):
+                raw = manifest_path.read_bytes()
+                digest = hashlib.sha1(raw).hexdigest()
+                if not (entry and entry.get("sha1") == digest):
+                    entry = {"sha1": digest, "manifest": json.loads(raw.decode("utf-8-sig"))}
+                    parsed += 1
+                entry = {**entry, "mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+        except Exception as e:
+            logger.warning(f"解析MCP清单失败 {manifest_path}: {e}")
+            continue
+        entries[key] = entry
+
+        manifest = entry["manifest"]
+        if manifest.get("agentType") != "mcp":
+            continue
+        name = manifest.get("displayName")
+        entry_point = manifest.get("entryPoint") or {}
+        if not name or not entry_point.get("module") or not entry_point.get("class"):
+            logger.warning(f"MCP清单缺少displayName或entryPoint，已跳过: {manifest_path}")
+            continue
+        manifests[name] = manifest
+
+    if parsed or set(entries) != set(cached):
+        _save_index(index_path, entries)
+    logger.info(f"MCP清单扫描完成: {len(manifests)} 个服务，重新解析 {parsed} 个清单")
+    return manifests
+
 def get_service_info(service_name: str) -> Optional[Dict[str, Any]]:
     """获取指定服务的详细信息
     
@@ -114,14 +261,32 @@ def get_service_statistics() -> Dict[str, Any]:
     return {
         "total_services": total_services,
         "total_tools": total_tools,
+        "loaded_services": [name for name, agent in MCP_REGISTRY.items() if not isinstance(agent, LazyAgent)],
         "registered_services": list(MCP_REGISTRY.keys()),
         "last_update": "动态更新"
     }
 
 # 自动扫描并注册
 def auto_register_mcp():
-    """自动注册所有MCP服务"""
-    registered = scan_and_register_mcp_agents()
+    """自动注册所有MCP服务：清单来自磁盘索引，Agent默认在首次调用时才导入和实例化"""
+    from system.config import config
+    manifests = scan_manifests()
+    registered = []
+    for name, manifest in manifests.items():
+        MANIFEST_CACHE[name] = manifest
+        if name in MCP_REGISTRY and not isinstance(MCP_REGISTRY[name], LazyAgent):
+            registered.append(name)
+            continue
+        agent = LazyAgent(name, manifest)
+        MCP_REGISTRY[name] = agent
+        if not config.mcp.lazy_agent_loading:
+            try:
+                agent.load()
+            except Exception as e:
+                logger.error(f"MCP服务 {name} 加载失败: {e}")
+                del MCP_REGISTRY[name]
+                continue
+        registered.append(name)
     sys.stderr.write(f"MCP注册完成，共注册 {len(registered)} 个服务: {registered}\n")
     return registered
 
@@ -11,9 +11,16 @@ from datetime import datetime, timedelta
 from typing import Dict, Any, List, Optional, Tuple
 from dataclasses import dataclass
 from system.config import config, logger
+from system.worker_pool import WorkerPool
+from .task_store import TaskStore, get_task_store, task_fingerprint
 
 # 能力信息从注册中心获取，由上层管理
 
+# 工具调用中的调度提示字段（不作为工具参数传递）
+# call_id: 调用标识；depends_on: 依赖的 call_id 或序号（列表或单个值）；
+# sequential: 为True时等待此前所有调用完成；timeout: 单次调用超时（秒）
+TOOL_CALL_HINT_KEYS = ("call_id", "depends_on", "sequential", "timeout")
+
 
 @dataclass
 class MCPTask:
@@ -36,70 +43,49 @@ class MCPTask:
 class MCPScheduler:
     """MCP调度器 - 负责任务调度和执行"""
     
-    def __init__(self, mcp_manager=None):
+    def __init__(self, mcp_manager=None, task_store: Optional[TaskStore] = None):
         self.mcp_manager = mcp_manager
         self.active_tasks: Dict[str, MCPTask] = {}
-        self.completed_tasks: Dict[str, MCPTask] = {}
-        self.task_queue = asyncio.Queue()
-        self.worker_tasks: List[asyncio.Task] = []
+        # 任务记录（含已结束任务的历史）统一保存在有界的任务存储中
+        self.task_store = task_store or get_task_store()
         self.max_concurrent = 10
-        self.shutdown_event = asyncio.Event()
-        
-        # 启动工作线程
-        self._start_workers()
-    
-    def _start_workers(self):
-        """启动工作线程"""
-        for i in range(self.max_concurrent):
-            worker = asyncio.create_task(self._worker(f"worker-{i}"))
-            self.worker_tasks.append(worker)
-    
-    async def _worker(self, worker_name: str):
-        """工作线程"""
-        while not self.shutdown_event.is_set():
-            try:
-                # 等待任务或关闭信号
-                task = await asyncio.wait_for(
-                    self.task_queue.get(), 
-                    timeout=1.0
-                )
-                
-                if task is None:  # 关闭信号
-                    break
-                
-                await self._execute_task(task)
-                
-            except asyncio.TimeoutError:
-                continue
-            except Exception as e:
-                logger.error(f"工作线程 {worker_name} 执行任务失败: {e}")
+        # 任务队列与工作协程（空闲时阻塞等待，不轮询）
+        self.worker_pool = WorkerPool(self._execute_task, workers=self.max_concurrent, name="mcp-worker")
+        # 按服务限制并发的信号量
+        self.service_semaphores: Dict[str, asyncio.Semaphore] = {}
+        # 正在执行工具调用的任务，用于取消
+        self.running_calls: Dict[str, asyncio.Task] = {}
         
-        logger.info(f"MCP调度器工作线程 {worker_name} 关闭")
+        # 启动工作协程
+        self.worker_pool.start()
     
     async def _execute_task(self, task: MCPTask):
         """执行单个任务"""
+        if task.status == "cancelled":
+            logger.info(f"MCP任务已取消，跳过执行: {task.id}")
+            return
         try:
             task.status = "running"
             task.started_at = datetime.utcnow().isoformat() + "Z"
+            self._sync_record(task)
             
             logger.info(f"开始执行MCP任务: {task.id} - {task.query[:50]}...")
             
             # 能力分析（已简化/可选）
             # 如需根据能力做路由，可在此从注册中心获取信息
                 
-            # 执行工具调用
-            results = []
-            for tool_call in task.tool_calls:
-                try:
-                    result = await self._execute_single_tool_call(tool_call)
-                    results.append(result)
-                except Exception as e:
-                    logger.error(f"工具调用失败: {tool_call} - {e}")
-                    results.append({
-                        "tool": tool_call.get("tool_name", "unknown"),
-                        "success": False,
-                        "error": str(e)
-                    })
+            # 执行工具调用（互不依赖的调用并发执行，结果顺序与tool_calls一致）
+            calls = asyncio.ensure_future(self._execute_tool_calls(task.tool_calls))
+            self.running_calls[task.id] = calls
+            try:
+                results = await calls
+            except asyncio.CancelledError:
+                if task.status != "cancelled":
+                    raise
+                logger.info(f"MCP任务执行中被取消: {task.id}")
+                return
+            finally:
+                self.running_calls.pop(task.id, None)
             
             # 更新任务状态
             task.status = "completed"
@@ -109,6 +95,7 @@ class MCPScheduler:
                 "results": results,
                 "message": f"成功执行 {len(task.tool_calls)} 个工具调用"
             }
+            self._sync_record(task)
             
             logger.info(f"MCP任务完成: {task.id}")
             # 回调通知（可选）
@@ -124,6 +111,7 @@ class MCPScheduler:
                 "error": str(e),
                 "message": f"任务执行失败: {str(e)}"
             }
+            self._sync_record(task)
             # 回调失败也尝试通知
             try:
                 await self._maybe_callback(task)
@@ -131,19 +119,26 @@ class MCPScheduler:
                 pass
         
         finally:
-            # 移动到已完成任务
-            if task.id in self.active_tasks:
-                del self.active_tasks[task.id]
-            self.completed_tasks[task.id] = task
+            # 结束的任务只保留在任务存储中
+            self.active_tasks.pop(task.id, None)
+
+    def _sync_record(self, task: MCPTask):
+        """把任务状态同步到任务存储"""
+        self.task_store.update(
+            task.id,
+            status=task.status,
+            started_at=task.started_at,
+            completed_at=task.completed_at,
+            result=task.result,
+            error=task.error,
+        )
 
     async def _maybe_callback(self, task: MCPTask) -> None:
-        """如果提供了callback_url，则POST回传任务结果"""
+        """如果提供了callback_url，则通过回调投递器回传任务结果"""
         if not task.callback_url:
             logger.debug(f"任务 {task.id} 没有设置callback_url，跳过回调")
             return
         try:
-            import aiohttp
-            import asyncio
             payload = {
                 "task_id": task.id,
                 "session_id": task.session_id,
@@ -171,35 +166,78 @@ class MCPScheduler:
 
             logger.info(f"[回调调度] 最终使用回调URL: {callback_url}, payload大小: {len(str(payload))}字节")
 
-            # 重试机制：尝试3次，每次间隔0.5秒
-            max_retries = 3
-            for attempt in range(max_retries):
+            # 交给回调投递器：落入发件箱后异步投递，失败退避重试，同一会话的结果合并投递
+            from system.callback_dispatcher import get_callback_dispatcher
+            await get_callback_dispatcher("mcp_server").send(callback_url, payload, coalesce_key=task.session_id)
+        except Exception as e:
+            logger.error(f"[回调调度] 回调通知失败: {e}")
+    
+    def _resolve_dependencies(self, tool_calls: List[Dict[str, Any]]) -> List[List[int]]:
+        """解析调用间的依赖，只允许依赖排在前面的调用（保证无环）"""
+        index_by_id = {}
+        for i, tool_call in enumerate(tool_calls):
+            call_id = tool_call.get("call_id")
+            if call_id is not None:
+                index_by_id[str(call_id)] = i
+        
+        dependencies = []
+        for i, tool_call in enumerate(tool_calls):
+            if tool_call.get("sequential"):
+                dependencies.append(list(range(i)))
+                continue
+            refs = tool_call.get("depends_on") or []
+            if not isinstance(refs, list):
+                refs = [refs]
+            deps = []
+            for ref in refs:
+                j = ref if isinstance(ref, int) and not isinstance(ref, bool) else index_by_id.get(str(ref))
+                if j is None or not 0 <= j < i:
+                    logger.warning(f"忽略无效的工具调用依赖: 第{i}个调用依赖 {ref}")
+                    continue
+                deps.append(j)
+            dependencies.append(deps)
+        return dependencies
+    
+    def _get_service_semaphore(self, service_name: str) -> asyncio.Semaphore:
+        semaphore = self.service_semaphores.get(service_name)
+        if semaphore is None:
+            limit = config.mcp.service_concurrency.get(service_name, config.mcp.per_service_concurrency)
+            semaphore = asyncio.Semaphore(max(1, limit))
+            self.service_semaphores[service_name] = semaphore
+        return semaphore
+    
+    async def _execute_tool_calls(self, tool_calls: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """按依赖关系并发执行一组工具调用，返回与输入顺序一致的结果"""
+        dependencies = self._resolve_dependencies(tool_calls)
+        runners: List[asyncio.Task] = []
+        
+        async def run(index: int) -> Dict[str, Any]:
+            tool_call = tool_calls[index]
+            tool_name = tool_call.get("tool_name", "unknown")
+            if dependencies[index]:
+                upstream = await asyncio.gather(*(runners[j] for j in dependencies[index]))
+                if not all(r.get("success") for r in upstream):
+                    return {"tool": tool_name, "success": False, "error": "依赖的工具调用未成功，已跳过"}
+            
+            timeout = float(tool_call.get("timeout") or config.mcp.tool_call_timeout)
+            async with self._get_service_semaphore(tool_call.get("service_name", "")):
                 try:
-                    logger.info(f"[回调调度] 发送POST请求 (尝试 {attempt + 1}/{max_retries})...")
-                    async with aiohttp.ClientSession() as session:
-                        async with session.post(callback_url, json=payload, timeout=aiohttp.ClientTimeout(total=5)) as response:
-                            logger.info(f"[回调调度] 收到响应状态码: {response.status}")
-                            if response.status == 200:
-                                logger.info(f"[回调调度] 工具结果回调成功: {task.id}")
-                                return
-                            else:
-                                # 读取响应内容以帮助调试
-                                response_text = await response.text()
-                                logger.warning(f"[回调调度] 工具结果回调失败 (尝试 {attempt + 1}/{max_retries}): 状态码={response.status}, 响应={response_text[:200]}")
-                                if attempt < max_retries - 1:
-                                    await asyncio.sleep(0.5)
+                    return await asyncio.wait_for(self._execute_single_tool_call(tool_call), timeout=timeout)
                 except asyncio.TimeoutError:
-                    logger.warning(f"[回调调度] 工具结果回调超时 (尝试 {attempt + 1}/{max_retries})")
-                    if attempt < max_retries - 1:
-                        await asyncio.sleep(0.5)
+                    logger.error(f"工具调用超时({timeout}秒): {tool_call}")
+                    return {"tool": tool_name, "success": False, "error": f"工具调用超时（{timeout}秒）"}
                 except Exception as e:
-                    logger.warning(f"[回调调度] 工具结果回调异常 (尝试 {attempt + 1}/{max_retries}): {e}")
-                    if attempt < max_retries - 1:
-                        await asyncio.sleep(0.5)
-
-            logger.error(f"[回调调度] 工具结果回调失败，已重试{max_retries}次: {task.id}")
-        except Exception as e:
-            logger.error(f"[回调调度] 回调通知失败: {e}")
+                    logger.error(f"工具调用失败: {tool_call} - {e}")
+                    return {"tool": tool_name, "success": False, "error": str(e)}
+        
+        for i in range(len(tool_calls)):
+            runners.append(asyncio.ensure_future(run(i)))
+        try:
+            return list(await asyncio.gather(*runners))
+        except asyncio.CancelledError:
+            for runner in runners:
+                runner.cancel()
+            raise
     
     async def _execute_single_tool_call(self, tool_call: Dict[str, Any]) -> Dict[str, Any]:
         """执行单个工具调用（优先通过mcp_manager统一调用）"""
@@ -210,7 +248,7 @@ class MCPScheduler:
             # 修正参数处理：保留所有非标准字段作为参数
             args = {}
             for key, value in tool_call.items():
-                if key not in ["agentType", "service_name", "tool_name"]:
+                if key not in ["agentType", "service_name", "tool_name"] and key not in TOOL_CALL_HINT_KEYS:
                     args[key] = value
             
             logger.info(f"执行工具调用: {service_name}.{tool_name} with args: {args}")
@@ -248,11 +286,13 @@ class MCPScheduler:
                 created_at=task_info["created_at"]
             )
             
-            # 添加到活跃任务
+            # 添加到活跃任务（直接调用调度器时同样登记到任务存储）
             self.active_tasks[task.id] = task
+            if self.task_store.get(task.id) is None:
+                self.task_store.put(dict(task_info))
             
-            # 加入队列
-            await self.task_queue.put(task)
+            # 加入队列（priority: high / normal / low）
+            await self.worker_pool.submit(task, priority=task_info.get("priority", "normal"))
             
             return {
                 "success": True,
@@ -269,16 +309,9 @@ class MCPScheduler:
             }
     
     async def check_duplicate(self, query: str, tool_calls: List[Dict[str, Any]]) -> Tuple[bool, Optional[str]]:
-        """检查任务重复"""
-        # 简单的重复检查逻辑
-        for task_id, task in self.active_tasks.items():
-            if (task.query == query and 
-                len(task.tool_calls) == len(tool_calls) and
-                all(tc.get("tool_name") == tc2.get("tool_name") 
-                    for tc, tc2 in zip(task.tool_calls, tool_calls))):
-                return True, task_id
-        
-        return False, None
+        """检查任务重复：按任务指纹查找进行中的相同任务"""
+        task_id = self.task_store.find_active_duplicate(task_fingerprint(query, tool_calls))
+        return task_id is not None, task_id
     
     async def cancel_task(self, task_id: str) -> bool:
         """取消任务"""
@@ -287,9 +320,13 @@ class MCPScheduler:
             task.status = "cancelled"
             task.completed_at = datetime.utcnow().isoformat() + "Z"
             
-            # 移动到已完成任务
             del self.active_tasks[task_id]
-            self.completed_tasks[task_id] = task
+            self._sync_record(task)
+            
+            # 正在执行的工具调用一并取消
+            running = self.running_calls.get(task_id)
+            if running is not None:
+                running.cancel()
             
             return True
         
@@ -299,21 +336,24 @@ class MCPScheduler:
         """获取调度器状态"""
         return {
             "active_tasks": len(self.active_tasks),
-            "completed_tasks": len(self.completed_tasks),
-            "queue_size": self.task_queue.qsize(),
+            "completed_tasks": self.task_store.counts().get("completed", 0),
+            "task_store": self.task_store.stats(),
+            "queue_size": self.worker_pool.qsize(),
             "max_concurrent": self.max_concurrent,
-            "workers": len(self.worker_tasks)
+            "workers": self.worker_pool.size,
+            "worker_pool": self.worker_pool.stats()
         }
     
+    def resize(self, max_concurrent: int):
+        """调整并发执行的任务数"""
+        self.max_concurrent = max(1, max_concurrent)
+        self.worker_pool.resize(self.max_concurrent)
+    
     async def shutdown(self):
         """关闭调度器"""
         logger.info("MCP调度器关闭中...")
         
-        # 设置关闭信号
-        self.shutdown_event.set()
-        
-        # 等待工作线程完成
-        if self.worker_tasks:
-            await asyncio.gather(*self.worker_tasks, return_exceptions=True)
+        # 工作协程处理完当前任务后退出，排队中的任务不再执行
+        await self.worker_pool.shutdown()
         
         logger.info("MCP调度器已关闭")
@@ -16,6 +16,7 @@ from fastapi.responses import JSONResponse
 from contextlib import asynccontextmanager
 
 from .mcp_scheduler import MCPScheduler
+from .task_store import TaskStore, get_task_store
 from system.config import config, logger
 # 能力发现逻辑已由注册中心承担，移除独立能力管理器
 # 精简：移除流式工具调用与独立工具解析执行，统一走调度器与管理器
@@ -44,12 +45,22 @@ async def lifespan(app: FastAPI):
         auto_register_mcp()
         logger.info("MCP服务自动注册完成")
 
+        # 后台预热配置的stdio MCP服务，首个调用无需等待进程启动与initialize
+        if config.mcp.stdio_prewarm_services:
+            from mcpserver.stdio_pool import get_stdio_pool
+            get_stdio_pool().prewarm(config.mcp.stdio_prewarm_services)
+
     except Exception as e:
         logger.warning(f"MCP管理器初始化失败: {e}")
         Modules.mcp_manager = None
     
-    # 初始化调度器（注入mcp_manager）
-    Modules.scheduler = MCPScheduler(Modules.mcp_manager)
+    # 初始化任务存储与调度器（注入mcp_manager）
+    Modules.task_store = get_task_store()
+    Modules.scheduler = MCPScheduler(Modules.mcp_manager, Modules.task_store)
+    
+    # 启动回调投递器（重放上次未投递的工具结果回调）
+    from system.callback_dispatcher import get_callback_dispatcher
+    get_callback_dispatcher("mcp_server").start()
     
     logger.info("MCP服务器启动完成")
     
@@ -59,6 +70,11 @@ async def lifespan(app: FastAPI):
     logger.info("MCP服务器关闭中...")
     if Modules.scheduler:
         await Modules.scheduler.shutdown()
+    if Modules.mcp_manager:
+        await Modules.mcp_manager.cleanup()
+    await get_callback_dispatcher("mcp_server").close()
+    if Modules.task_store:
+        Modules.task_store.close()
     logger.info("MCP服务器已关闭")
 
 
@@ -72,10 +88,8 @@ app = FastAPI(
 class Modules:
     """全局模块管理"""
     scheduler: Optional[MCPScheduler] = None
-    # 任务注册表
-    task_registry: Dict[str, Dict[str, Any]] = {}
-    # 幂等性缓存
-    completed_requests: Dict[str, Dict[str, Any]] = {}
+    # 任务存储（任务注册表与幂等性缓存，有界且带索引）
+    task_store: Optional[TaskStore] = None
     # MCP管理器（用于工具调用执行）
     mcp_manager: Optional[Any] = None
 
@@ -102,10 +116,13 @@ async def schedule_mcp_task(payload: Dict[str, Any]):
         if not query and not tool_calls:
             raise HTTPException(400, "query或tool_calls不能同时为空")
         
+        task_store = Modules.task_store or get_task_store()
+        
         # 幂等性检查
-        if request_id in Modules.completed_requests:
+        cached_response = task_store.get_request(request_id)
+        if cached_response is not None:
             logger.info(f"幂等请求命中: {request_id}")
-            return Modules.completed_requests[request_id]
+            return cached_response
         
         # 任务去重检查
         if Modules.scheduler:
@@ -119,7 +136,7 @@ async def schedule_mcp_task(payload: Dict[str, Any]):
                     "idempotent": True,
                     "request_id": request_id
                 }
-                Modules.completed_requests[request_id] = response
+                task_store.remember_request(request_id, response)
                 return response
         
         # 并发控制
@@ -135,18 +152,19 @@ async def schedule_mcp_task(payload: Dict[str, Any]):
             "session_id": session_id,
             "request_id": request_id,
             "callback_url": callback_url,
+            "priority": payload.get("priority", "normal"),
             "status": "queued",
             "created_at": _now_iso(),
             "result": None,
             "error": None
         }
         
-        Modules.task_registry[task_id] = task_info
+        task_store.put(task_info)
         
         # 调度执行
         if Modules.scheduler:
             result = await Modules.scheduler.schedule_task(task_info)
-            task_info.update(result)
+            task_store.update(task_id, **result)
             
             # 缓存结果
             response = {
@@ -156,7 +174,7 @@ async def schedule_mcp_task(payload: Dict[str, Any]):
                 "result": result.get("result"),
                 "request_id": request_id
             }
-            Modules.completed_requests[request_id] = response
+            task_store.remember_request(request_id, response)
             return response
         else:
             raise HTTPException(500, "MCP调度器未初始化")
@@ -171,20 +189,30 @@ async def schedule_mcp_task(payload: Dict[str, Any]):
 async def get_mcp_status():
     """获取MCP服务器状态"""
     try:
+        task_store = Modules.task_store or get_task_store()
+        counts = task_store.counts()
         status = {
             "server": "running",
             "timestamp": _now_iso(),
             "tasks": {
-                "total": len(Modules.task_registry),
-                "active": len([t for t in Modules.task_registry.values() if t.get("status") == "running"]),
-                "completed": len([t for t in Modules.task_registry.values() if t.get("status") == "completed"]),
-                "failed": len([t for t in Modules.task_registry.values() if t.get("status") == "failed"])
+                "total": len(task_store),
+                "active": counts.get("running", 0),
+                "completed": counts.get("completed", 0),
+                "failed": counts.get("failed", 0)
             }
         }
         
         if Modules.scheduler:
             scheduler_status = await Modules.scheduler.get_status()
             status["scheduler"] = scheduler_status
+        
+        # 事件循环阻塞统计（看门狗记录的慢调用）
+        from mcpserver.execution_pools import get_loop_watchdog
+        status["event_loop"] = get_loop_watchdog().stats()
+        
+        # stdio MCP会话状态（重启次数、运行时长、最近错误）
+        from mcpserver.stdio_pool import get_stdio_pool
+        status["stdio_sessions"] = get_stdio_pool().stats()
             
     # 能力统计可由注册中心提供（此处先省略）
         
@@ -197,39 +225,34 @@ async def get_mcp_status():
 @app.get("/tasks/{task_id}")
 async def get_task_status(task_id: str):
     """获取特定任务状态"""
-    if task_id not in Modules.task_registry:
+    task = (Modules.task_store or get_task_store()).get(task_id)
+    if task is None:
         raise HTTPException(404, "任务不存在")
     
-    return Modules.task_registry[task_id]
+    return task
 
 @app.get("/tasks")
-async def list_tasks(status: Optional[str] = None, session_id: Optional[str] = None):
-    """列出任务"""
-    tasks = list(Modules.task_registry.values())
-    
-    if status:
-        tasks = [t for t in tasks if t.get("status") == status]
-    
-    if session_id:
-        tasks = [t for t in tasks if t.get("session_id") == session_id]
-    
+async def list_tasks(status: Optional[str] = None, session_id: Optional[str] = None, limit: int = 200):
+    """列出任务（按状态/会话索引查询，按创建时间倒序）"""
+    tasks = (Modules.task_store or get_task_store()).query(status=status, session_id=session_id,
+                                                           limit=max(1, min(limit, 1000)))
     return {"tasks": tasks, "count": len(tasks)}
 
 @app.delete("/tasks/{task_id}")
 async def cancel_task(task_id: str):
     """取消任务"""
-    if task_id not in Modules.task_registry:
+    task_store = Modules.task_store or get_task_store()
+    task = task_store.get(task_id)
+    if task is None:
         raise HTTPException(404, "任务不存在")
     
-    task = Modules.task_registry[task_id]
     if task.get("status") in ["completed", "failed"]:
         raise HTTPException(400, "任务已完成，无法取消")
     
     if Modules.scheduler:
         await Modules.scheduler.cancel_task(task_id)
     
-    task["status"] = "cancelled"
-    task["cancelled_at"] = _now_iso()
+    task_store.update(task_id, status="cancelled", cancelled_at=_now_iso())
     
     return {"success": True, "message": "任务已取消"}
 
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+stdio MCP会话池
+每个stdio服务由一个常驻的监督协程持有子进程与 ClientSession：可在MCP服务器启动时预热，
+定期ping检查存活，进程退出或检查失败后按指数退避重启（重启时清空工具列表缓存），并限制每个会话的并发调用数
+"""
+
+import asyncio
+import logging
+import time
+from typing import Any, Dict, List, Optional
+
+from nagaagent_core.core import ClientSession, StdioServerParameters
+from mcp.client.stdio import stdio_client
+
+logger = logging.getLogger(__name__)
+
+# 会话稳定运行超过该时长（秒）后，重启退避从头计算
+_STABLE_SECONDS = 60.0
+
+
+def resolve_launch_spec(service_name: str) -> Optional[Dict[str, Any]]:
+    """确定stdio服务的启动参数
+
+    优先使用清单中的 "stdio": {"command", "args", "env", "cwd", "maxConcurrency"}；
+    兼容注册表中以 {"type": "python"/"node", "script_path": ...} 描述的旧式服务
+    """
+    from mcpserver.mcp_registry import MANIFEST_CACHE, MCP_REGISTRY  # 延迟导入
+    spec = (MANIFEST_CACHE.get(service_name) or {}).get("stdio")
+    if isinstance(spec, dict) and spec.get("command"):
+        return spec
+    legacy = MCP_REGISTRY.get(service_name)
+    if isinstance(legacy, dict) and legacy.get("script_path"):
+        return {
+            "command": "python" if legacy.get("type") == "python" else "node",
+            "args": [legacy["script_path"]],
+        }
+    return None
+
+
+class _SupervisedSession:
+    """单个stdio服务的监督者"""
+
+    def __init__(self, name: str, spec: Dict[str, Any], pool: "StdioSessionPool"):
+        self.name = name
+        self.spec = spec
+        self.pool = pool
+        self.session: Optional[ClientSession] = None
+        self.tools: Optional[list] = None
+        self.state = "starting"
+        self.restarts = 0
+        self.last_error: Optional[str] = None
+        self.started_at: Optional[float] = None
+        self.ready = asyncio.Event()
+        self.unhealthy = asyncio.Event()
+        self.stopping = False
+        self.semaphore = asyncio.Semaphore(max(1, int(spec.get("maxConcurrency") or pool.call_concurrency)))
+        self.task = asyncio.get_running_loop().create_task(self._supervise(), name=f"mcp-stdio-{name}")
+
+    async def _supervise(self):
+        failures = 0
+        while not self.stopping:
+            self.state = "starting"
+            try:
+                params = StdioServerParameters(
+                    command=self.spec["command"],
+                    args=list(self.spec.get("args", [])),
+                    env=self.spec.get("env"),
+                    cwd=self.spec.get("cwd"),
+                )
+                async with stdio_client(params) as (read, write):
+                    async with ClientSession(read, write) as session:
+                        await asyncio.wait_for(session.initialize(), timeout=self.pool.startup_timeout)
+                        self.session = session
+                        self.tools = None
+                        self.started_at = time.monotonic()
+                        self.state = "ready"
+                        self.unhealthy.clear()
+                        self.ready.set()
+                        logger.info(f"stdio MCP服务 {self.name} 已就绪")
+                        await self._watch(session)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.last_error = str(e) or type(e).__name__
+                logger.warning(f"stdio MCP服务 {self.name} 异常退出: {self.last_error}")
+            finally:
+                self.ready.clear()
+                self.session = None
+                self.tools = None  # 重启后工具列表可能变化
+
+            if self.stopping:
+                break
+            if self.started_at is not None and time.monotonic() - self.started_at >= _STABLE_SECONDS:
+                failures = 0
+            self.started_at = None
+            failures += 1
+            self.restarts += 1
+            delay = min(self.pool.restart_max_delay, 0.5 * (2 ** (failures - 1)))
+            self.state = "backoff"
+            logger.info(f"stdio MCP服务 {self.name} 将在 {delay:.1f}秒后重启（第{self.restarts}次）")
+            await asyncio.sleep(delay)
+        self.state = "stopped"
+
+    async def _watch(self, session: ClientSession):
+        """定期ping；ping失败、调用方报告连接异常或收到停止请求时返回（退出上下文即结束子进程）"""
+        while not self.stopping:
+            try:
+                await asyncio.wait_for(self.unhealthy.wait(), timeout=self.pool.health_interval)
+                self.last_error = "调用失败，会话被标记为不健康"
+                return
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await asyncio.wait_for(session.send_ping(), timeout=self.pool.ping_timeout)
+            except Exception as e:
+                self.last_error = f"健康检查失败: {e or type(e).__name__}"
+                logger.warning(f"stdio MCP服务 {self.name} {self.last_error}")
+                return
+
+    async def acquire_session(self) -> ClientSession:
+        await asyncio.wait_for(self.ready.wait(), timeout=self.pool.startup_timeout)
+        return self.session
+
+    async def stop(self):
+        self.stopping = True
+        self.unhealthy.set()
+        self.task.cancel()
+        await asyncio.gather(self.task, return_exceptions=True)
+        self.state = "stopped"
+
+
+class StdioSessionPool:
+    """stdio MCP会话池（绑定所在的事件循环，由MCP服务器使用）"""
+
+    def __init__(self, call_concurrency: int = 4, health_interval: float = 30.0, ping_timeout: float = 10.0,
+                 startup_timeout: float = 30.0, restart_max_delay: float = 60.0):
+        self.call_concurrency = call_concurrency
+        self.health_interval = health_interval
+        self.ping_timeout = ping_timeout
+        self.startup_timeout = startup_timeout
+        self.restart_max_delay = restart_max_delay
+        self._sessions: Dict[str, _SupervisedSession] = {}
+
+    def _ensure(self, service_name: str) -> Optional[_SupervisedSession]:
+        supervised = self._sessions.get(service_name)
+        if supervised is not None:
+            return supervised
+        spec = resolve_launch_spec(service_name)
+        if spec is None:
+            return None
+        supervised = _SupervisedSession(service_name, spec, self)
+        self._sessions[service_name] = supervised
+        return supervised
+
+    def prewarm(self, service_names: List[str]):
+        """在后台启动指定的stdio服务（不等待就绪）"""
+        for name in service_names:
+            if self._ensure(name) is None:
+                logger.warning(f"预热跳过: {name} 不是stdio MCP服务")
+
+    async def get_session(self, service_name: str) -> Optional[ClientSession]:
+        """获取就绪的会话，首次使用时启动服务；启动超时或不是stdio服务时返回None"""
+        supervised = self._ensure(service_name)
+        if supervised is None:
+            return None
+        try:
+            return await supervised.acquire_session()
+        except asyncio.TimeoutError:
+            logger.error(f"stdio MCP服务 {service_name} 启动超时: {supervised.last_error or ''}")
+            return None
+
+    async def list_tools(self, service_name: str) -> list:
+        """工具列表（按会话缓存，会话重启后重新获取）"""
+        supervised = self._ensure(service_name)
+        session = await self.get_session(service_name)
+        if session is None:
+            return []
+        if supervised.tools is None:
+            response = await session.list_tools()
+            supervised.tools = response.tools
+        return supervised.tools
+
+    async def call_tool(self, service_name: str, tool_name: str, args: dict):
+        """在会话并发上限内调用工具；连接类异常会触发会话重启"""
+        supervised = self._ensure(service_name)
+        session = await self.get_session(service_name)
+        if session is None:
+            return None
+        async with supervised.semaphore:
+            try:
+                return await session.call_tool(tool_name, args)
+            except (ConnectionError, EOFError, OSError):
+                # 传输层异常说明子进程已不可用，立即重启而不是等待下一次健康检查
+                supervised.unhealthy.set()
+                raise
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            name: {
+                "state": s.state,
+                "restarts": s.restarts,
+                "uptime": round(now - s.started_at, 1) if s.started_at else 0.0,
+                "last_error": s.last_error,
+                "tools_cached": s.tools is not None,
+            }
+            for name, s in self._sessions.items()
+        }
+
+    async def close(self):
+        sessions, self._sessions = list(self._sessions.values()), {}
+        await asyncio.gather(*(s.stop() for s in sessions), return_exceptions=True)
+
+
+# 全局stdio会话池
+_stdio_pool: Optional[StdioSessionPool] = None
+
+
+def get_stdio_pool() -> StdioSessionPool:
+    """获取全局stdio会话池"""
+    global _stdio_pool
+    if _stdio_pool is None:
+        from system.config import config
+        _stdio_pool = StdioSessionPool(
+            call_concurrency=config.mcp.stdio_call_concurrency,
+            health_interval=config.mcp.stdio_health_interval,
+            startup_timeout=config.mcp.stdio_startup_timeout,
+            restart_max_delay=config.mcp.stdio_restart_max_delay,
+        )
+    return _stdio_pool
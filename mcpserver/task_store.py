@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+MCP任务存储
+有界的任务历史：已结束的任务按LRU与TTL淘汰，按状态与会话建立二级索引，
+以任务指纹（查询 + 规范化工具调用的哈希）O(1) 查找进行中的重复任务；可选SQLite持久化，重启后仍可查询历史
+"""
+
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+# 进行中的任务状态：不会被淘汰，参与去重
+ACTIVE_STATUSES = ("queued", "running")
+
+# 不影响调用语义的字段，不参与指纹
+_FINGERPRINT_IGNORED_KEYS = ("call_id", "timeout")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    id TEXT PRIMARY KEY,
+    session_id TEXT,
+    status TEXT NOT NULL,
+    created_at TEXT,
+    updated_at REAL NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks(status, created_at);
+CREATE INDEX IF NOT EXISTS idx_tasks_session ON tasks(session_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_tasks_updated ON tasks(updated_at);
+"""
+
+
+def task_fingerprint(query: str, tool_calls: List[Dict[str, Any]]) -> str:
+    """任务指纹：查询文本与工具调用（键排序、去掉调度提示字段）的规范JSON哈希"""
+    normalized = [
+        {k: v for k, v in tool_call.items() if k not in _FINGERPRINT_IGNORED_KEYS}
+        for tool_call in (tool_calls or []) if isinstance(tool_call, dict)
+    ]
+    raw = json.dumps({"query": (query or "").strip(), "tool_calls": normalized},
+                     ensure_ascii=False, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class TaskStore:
+    """任务存储
+
+    - 任务记录为dict，更新须经 update()，以便同步状态索引与持久化
+    - 进行中的任务常驻内存；已结束的任务超过 max_entries 时按最久未访问淘汰，结束超过 ttl_seconds 后淘汰
+    - db_path 不为空时写透到SQLite：内存淘汰后 get()/query() 仍可从磁盘读取，磁盘记录保留 persist_ttl_seconds
+    - 幂等请求的响应同样按 max_entries 与 ttl_seconds 限制
+    """
+
+    def __init__(self, max_entries: int = 1000, ttl_seconds: float = 24 * 3600,
+                 db_path: Optional[Union[str, Path]] = None, persist_ttl_seconds: float = 7 * 24 * 3600,
+                 sweep_interval: float = 60.0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.persist_ttl_seconds = persist_ttl_seconds
+        self.sweep_interval = sweep_interval
+
+        self._lock = threading.RLock()
+        # task_id -> (任务记录, 最近更新时间)
+        self._tasks: "OrderedDict[str, Tuple[Dict[str, Any], float]]" = OrderedDict()
+        self._by_status: Dict[str, Set[str]] = {}
+        self._by_session: Dict[str, Set[str]] = {}
+        self._fingerprints: Dict[str, str] = {}  # 指纹 -> 进行中的task_id
+        self._requests: "OrderedDict[str, Tuple[Dict[str, Any], float]]" = OrderedDict()
+        self._last_sweep = time.monotonic()
+        self._stats = {"evicted_lru": 0, "evicted_ttl": 0, "disk_reads": 0, "persist_errors": 0}
+
+        self._conn: Optional[sqlite3.Connection] = None
+        if db_path:
+            try:
+                Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+                self._conn = sqlite3.connect(str(db_path), check_same_thread=False, timeout=10)
+                self._conn.execute("PRAGMA journal_mode=WAL")
+                self._conn.execute("PRAGMA synchronous=NORMAL")
+                self._conn.executescript(_SCHEMA)
+                self._mark_interrupted()
+                self._conn.commit()
+            except Exception as e:
+                logger.warning(f"任务持久化不可用，仅在内存中保存任务: {e}")
+                self._conn = None
+
+    # ========== 任务 ==========
+
+    def put(self, task: Dict[str, Any]):
+        """登记新任务"""
+        task.setdefault("fingerprint", task_fingerprint(task.get("query", ""), task.get("tool_calls", [])))
+        with self._lock:
+            old = self._tasks.get(task["id"])
+            if old is not None:
+                self._unindex(task["id"], old[0])
+            self._tasks[task["id"]] = (task, time.time())
+            self._tasks.move_to_end(task["id"])
+            self._index(task["id"], task)
+            self._persist(task)
+            self._maybe_sweep()
+            self._enforce_limit()
+
+    def update(self, task_id: str, **fields) -> Optional[Dict[str, Any]]:
+        """更新任务字段并同步索引，任务不存在时返回None"""
+        with self._lock:
+            task = self.get(task_id)
+            if task is None:
+                return None
+            self._unindex(task_id, task)
+            task.update(fields)
+            self._tasks[task_id] = (task, time.time())
+            self._tasks.move_to_end(task_id)
+            self._index(task_id, task)
+            self._persist(task)
+            self._enforce_limit()
+            return task
+
+    def get(self, task_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._tasks.get(task_id)
+            if entry is not None:
+                self._tasks.move_to_end(task_id)
+                return entry[0]
+            task = self._load(task_id)
+            if task is not None:
+                # 从磁盘读回的历史任务重新放入内存，按正常规则淘汰
+                self._stats["disk_reads"] += 1
+                self._tasks[task_id] = (task, time.time())
+                self._index(task_id, task)
+                self._enforce_limit()
+            return task
+
+    def __contains__(self, task_id: str) -> bool:
+        return self.get(task_id) is not None
+
+    def find_active_duplicate(self, fingerprint: str) -> Optional[str]:
+        """返回指纹相同的进行中任务ID"""
+        with self._lock:
+            return self._fingerprints.get(fingerprint)
+
+    def query(self, status: Optional[str] = None, session_id: Optional[str] = None,
+              limit: int = 200) -> List[Dict[str, Any]]:
+        """按状态和/或会话查询任务，按创建时间倒序，内存不足 limit 条时由磁盘补齐"""
+        with self._lock:
+            if status and session_id:
+                ids = self._by_status.get(status, set()) & self._by_session.get(session_id, set())
+            elif status:
+                ids = self._by_status.get(status, set())
+            elif session_id:
+                ids = self._by_session.get(session_id, set())
+            else:
+                ids = self._tasks.keys()
+            tasks = sorted((self._tasks[i][0] for i in ids), key=lambda t: t.get("created_at") or "", reverse=True)
+            tasks = tasks[:limit]
+            if self._conn is not None and len(tasks) < limit:
+                tasks.extend(self._query_disk(status, session_id, limit - len(tasks), {t["id"] for t in tasks}))
+            return tasks
+
+    def counts(self) -> Dict[str, int]:
+        """内存中各状态的任务数"""
+        with self._lock:
+            return {status: len(ids) for status, ids in self._by_status.items() if ids}
+
+    def __len__(self) -> int:
+        return len(self._tasks)
+
+    # ========== 幂等请求 ==========
+
+    def get_request(self, request_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._requests.get(request_id)
+            if entry is None:
+                return None
+            if self.ttl_seconds > 0 and time.time() - entry[1] > self.ttl_seconds:
+                del self._requests[request_id]
+                return None
+            self._requests.move_to_end(request_id)
+            return entry[0]
+
+    def remember_request(self, request_id: str, response: Dict[str, Any]):
+        with self._lock:
+            self._requests[request_id] = (response, time.time())
+            self._requests.move_to_end(request_id)
+            while len(self._requests) > self.max_entries:
+                self._requests.popitem(last=False)
+
+    # ========== 容量管理 ==========
+
+    def sweep(self) -> int:
+        """淘汰结束超过TTL的任务与过期的幂等记录，并清理过期的磁盘记录，返回淘汰的任务数"""
+        with self._lock:
+            self._last_sweep = time.monotonic()
+            if self.ttl_seconds <= 0:
+                return 0
+            cutoff = time.time() - self.ttl_seconds
+            expired = [task_id for task_id, (task, updated) in self._tasks.items()
+                       if updated < cutoff and task.get("status") not in ACTIVE_STATUSES]
+            for task_id in expired:
+                self._evict(task_id, "evicted_ttl")
+            while self._requests and next(iter(self._requests.values()))[1] < cutoff:
+                self._requests.popitem(last=False)
+            if self._conn is not None and self.persist_ttl_seconds > 0:
+                try:
+                    self._conn.execute("DELETE FROM tasks WHERE updated_at < ?",
+                                       (time.time() - self.persist_ttl_seconds,))
+                    self._conn.commit()
+                except sqlite3.Error as e:
+                    logger.warning(f"清理任务持久化记录失败: {e}")
+        if expired:
+            logger.info(f"淘汰了 {len(expired)} 个已结束的MCP任务")
+        return len(expired)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({
+                "tasks_in_memory": len(self._tasks),
+                "by_status": self.counts(),
+                "active_fingerprints": len(self._fingerprints),
+                "idempotent_requests": len(self._requests),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "persist_enabled": self._conn is not None,
+            })
+        return stats
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def _maybe_sweep(self):
+        if time.monotonic() - self._last_sweep >= self.sweep_interval:
+            self.sweep()
+
+    def _enforce_limit(self):
+        """超过上限时从最久未访问的已结束任务开始淘汰（进行中的任务不淘汰）"""
+        if len(self._tasks) <= self.max_entries:
+            return
+        for task_id in [tid for tid, (task, _) in self._tasks.items()
+                        if task.get("status") not in ACTIVE_STATUSES]:
+            if len(self._tasks) <= self.max_entries:
+                break
+            self._evict(task_id, "evicted_lru")
+
+    def _evict(self, task_id: str, reason: str):
+        task, _ = self._tasks.pop(task_id)
+        self._unindex(task_id, task)
+        self._stats[reason] += 1
+
+    # ========== 索引 ==========
+
+    def _index(self, task_id: str, task: Dict[str, Any]):
+        self._by_status.setdefault(task.get("status") or "unknown", set()).add(task_id)
+        if task.get("session_id"):
+            self._by_session.setdefault(task["session_id"], set()).add(task_id)
+        if task.get("status") in ACTIVE_STATUSES and task.get("fingerprint"):
+            self._fingerprints.setdefault(task["fingerprint"], task_id)
+
+    def _unindex(self, task_id: str, task: Dict[str, Any]):
+        status = task.get("status") or "unknown"
+        self._discard(self._by_status, status, task_id)
+        if task.get("session_id"):
+            self._discard(self._by_session, task["session_id"], task_id)
+        if self._fingerprints.get(task.get("fingerprint")) == task_id:
+            del self._fingerprints[task["fingerprint"]]
+
+    @staticmethod
+    def _discard(index: Dict[str, Set[str]], key: str, task_id: str):
+        ids = index.get(key)
+        if ids is not None:
+            ids.discard(task_id)
+            if not ids:
+                del index[key]
+
+    # ========== 持久化 ==========
+
+    def _persist(self, task: Dict[str, Any]):
+        if self._conn is None:
+            return
+        try:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO tasks (id, session_id, status, created_at, updated_at, data) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (task["id"], task.get("session_id"), task.get("status") or "unknown", task.get("created_at"),
+                 time.time(), json.dumps(task, ensure_ascii=False, default=str))
+            )
+            self._conn.commit()
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            self._stats["persist_errors"] += 1
+            logger.warning(f"任务 {task.get('id')} 持久化失败: {e}")
+
+    def _load(self, task_id: str) -> Optional[Dict[str, Any]]:
+        if self._conn is None:
+            return None
+        row = self._conn.execute("SELECT data FROM tasks WHERE id = ?", (task_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _query_disk(self, status: Optional[str], session_id: Optional[str], limit: int,
+                    exclude: Set[str]) -> List[Dict[str, Any]]:
+        conditions, params = [], []
+        if status:
+            conditions.append("status = ?")
+            params.append(status)
+        if session_id:
+            conditions.append("session_id = ?")
+            params.append(session_id)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        # 多取内存中已有的条数，过滤重复后仍能凑满 limit
+        params.append(limit + len(exclude))
+        try:
+            rows = self._conn.execute(
+                f"SELECT id, data FROM tasks {where} ORDER BY created_at DESC LIMIT ?", params
+            ).fetchall()
+        except sqlite3.Error as e:
+            logger.warning(f"查询任务持久化记录失败: {e}")
+            return []
+        return [json.loads(data) for task_id, data in rows if task_id not in exclude][:limit]
+
+    def _mark_interrupted(self):
+        """上次运行中未结束的任务已随进程退出中断，标记为失败"""
+        rows = self._conn.execute(
+            f"SELECT id, data FROM tasks WHERE status IN ({', '.join('?' * len(ACTIVE_STATUSES))})",
+            ACTIVE_STATUSES
+        ).fetchall()
+        for task_id, data in rows:
+            task = json.loads(data)
+            task.update({"status": "failed", "error": "服务重启，任务已中断"})
+            self._conn.execute("UPDATE tasks SET status = ?, data = ? WHERE id = ?",
+                               ("failed", json.dumps(task, ensure_ascii=False, default=str), task_id))
+        if rows:
+            logger.info(f"{len(rows)} 个上次未完成的MCP任务已标记为中断")
+
+
+# 全局任务存储
+_task_store: Optional[TaskStore] = None
+
+
+def get_task_store() -> TaskStore:
+    """获取全局MCP任务存储"""
+    global _task_store
+    if _task_store is None:
+        from system.config import config
+        mcp_config = config.mcp
+        db_path = Path(config.system.log_dir) / "mcp_tasks.db" if mcp_config.task_persist_enabled else None
+        _task_store = TaskStore(
+            max_entries=mcp_config.task_history_max_entries,
+            ttl_seconds=mcp_config.task_history_ttl_hours * 3600,
+            db_path=db_path,
+            persist_ttl_seconds=mcp_config.task_persist_ttl_hours * 3600,
+        )
+    return _task_store
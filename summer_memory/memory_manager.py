@@ -67,9 +67,8 @@ class GRAGMemoryManager:
                         logger.warning("任务管理器未运行，正在启动...")
                         from .task_manager import start_task_manager
                         await start_task_manager()
-                        await asyncio.sleep(1)  # 等待启动完成
 
-                    logger.info(f"任务管理器状态: running={task_manager.is_running}, workers={len(task_manager.worker_tasks)}")
+                    logger.info(f"任务管理器状态: running={task_manager.is_running}, workers={task_manager.worker_pool.size}")
 
                     task_id = await task_manager.add_task(conversation_text)
                     self.active_tasks.add(task_id)
@@ -17,6 +17,7 @@ try:
 except ImportError:
     logger = logging.getLogger(__name__)
     logger.warning("无法导入 config 模块，使用默认设置")
+from system.worker_pool import WorkerPool
 
 logger = logging.getLogger(__name__)
 
@@ -67,10 +68,10 @@ class QuintupleTaskManager:
 
         # 任务存储
         self.tasks: Dict[str, ExtractionTask] = {}
-        self.task_queue = asyncio.Queue(maxsize=self.max_queue_size)
 
-        # 工作协程管理
-        self.worker_tasks: List[asyncio.Task] = []
+        # 任务队列与工作协程（空闲时阻塞等待，不轮询；队列满时 add_task 等待）
+        self.worker_pool = WorkerPool(self._process_task, workers=self.max_workers,
+                                      name="quintuple-worker", max_queue_size=self.max_queue_size)
         self.is_running = False
         self.lock = asyncio.Lock()
 
@@ -96,21 +97,9 @@ class QuintupleTaskManager:
         self.is_running = True
 
         try:
-            # 确保在事件循环中运行
-            loop = asyncio.get_running_loop()
-
             # 创建工作协程
-            for i in range(self.max_workers):
-                worker_task = loop.create_task(  # 使用当前循环创建任务
-                    self._worker_loop(f"worker-{i + 1}"),
-                    name=f"task_worker_{i}"
-                )
-                self.worker_tasks.append(worker_task)
-
-            # 添加工作协程状态检查
-            await asyncio.sleep(0.5)  # 短暂等待协程启动
-            active_workers = sum(1 for t in self.worker_tasks if not t.done())
-            logger.info(f"活跃工作协程: {active_workers}/{self.max_workers}")
+            self.worker_pool.start()
+            logger.info(f"活跃工作协程: {self.worker_pool.size}/{self.max_workers}")
 
             # 启动自动清理任务 - 添加异常处理
             try:
@@ -135,11 +124,7 @@ class QuintupleTaskManager:
         self.is_running = False
 
         # 取消所有工作协程
-        for task in self.worker_tasks:
-            task.cancel()
-
-        # 等待工作协程完成
-        await asyncio.gather(*self.worker_tasks, return_exceptions=True)
+        await self.worker_pool.shutdown(cancel=True)
 
         # 取消清理任务
         if self.cleanup_task:
@@ -165,7 +150,7 @@ class QuintupleTaskManager:
 
     def is_active(self) -> bool:
         """检查任务管理器是否活跃运行"""
-        return self.is_running and any(not t.done() for t in self.worker_tasks)
+        return self.is_running and self.worker_pool.size > 0
 
     async def add_task(self, text: str) -> str:
         logger.info("add_task被调用")  # 改为INFO级别确保输出
@@ -209,10 +194,10 @@ class QuintupleTaskManager:
 
         # 将任务放入队列
         try:
-            if self.task_queue.full():
-                logger.warning(f"任务队列已满 ({self.task_queue.qsize()}/{self.max_queue_size})")
+            if self.worker_pool.qsize() >= self.max_queue_size:
+                logger.warning(f"任务队列已满 ({self.worker_pool.qsize()}/{self.max_queue_size})")
 
-            await self.task_queue.put(task)
+            await self.worker_pool.submit(task)
             logger.info(f"任务已加入队列: {task_id}")
             return task_id
         except Exception as e:
@@ -245,109 +230,78 @@ class QuintupleTaskManager:
         except asyncio.CancelledError:
             return None, "任务被取消"
 
-    async def _worker_loop(self, worker_id: str):
-        """工作协程主循环"""
-        logger.info(f"工作协程启动: {worker_id}")
+    async def _process_task(self, task: ExtractionTask):
+        """处理单个提取任务（由工作池调用）"""
+        worker_id = asyncio.current_task().get_name()
+        logger.info(f"{worker_id} 获取到任务: {task.task_id}")
 
-        # === 添加启动确认日志 ===
-        logger.info(f"✅ {worker_id} 已进入工作循环，状态: running={self.is_running}")
+        if task.status != TaskStatus.PENDING:
+            logger.warning(f"任务状态异常: {task.task_id} ({task.status.value})")
+            return
 
-        while self.is_running:
-            try:
-                # === 添加队列状态日志 ===
-                logger.debug(f"{worker_id} 正在等待新任务 (队列大小: {self.task_queue.qsize()})")
-
-                # 使用带超时的get，避免永久阻塞
-                try:
-                    task = await asyncio.wait_for(self.task_queue.get(), timeout=1.0)
-                except asyncio.TimeoutError:
-                    # 超时但继续循环检查
-                    continue
-
-                logger.info(f"{worker_id} 获取到任务: {task.task_id}")
-
-                if task.status != TaskStatus.PENDING:
-                    logger.warning(f"任务状态异常: {task.task_id} ({task.status.value})")
-                    self.task_queue.task_done()
-                    continue
-
-                # 更新任务状态
-                task.status = TaskStatus.RUNNING
-                task.started_at = time.time()
-                logger.info(f"{worker_id} 开始处理任务: {task.task_id}")
-
-                # 执行任务
-                result = None
-                error = None
-                try:
-                    # 导入提取函数（避免循环导入）
-                    from .quintuple_extractor import extract_quintuples_async
-                    logger.info(f"{worker_id} 调用五元组提取API: {task.task_id}")
-
-                    # 使用超时控制执行任务
-                    result = await asyncio.wait_for(
-                        extract_quintuples_async(task.text),
-                        timeout=self.task_timeout
-                    )
-                    logger.info(f"{worker_id} 提取到 {len(result)} 个五元组: {task.text}")
-
-                    # 更新任务状态
-                    async with self.lock:
-                        task.status = TaskStatus.COMPLETED
-                        task.result = result
-                        task.completed_at = time.time()
-                        self.completed_tasks += 1
-
-                except asyncio.TimeoutError:
-                    error = "任务执行超时"
-                    logger.warning(f"{worker_id} 任务超时: {task.task_id}")
-                    async with self.lock:
-                        task.status = TaskStatus.FAILED
-                        task.error = error
-                        task.completed_at = time.time()
-                        self.failed_tasks += 1
-
-                except Exception as e:
-                    error = str(e)
-                    logger.error(f"{worker_id} 任务失败: {task.task_id}, 错误: {error}")
-                    traceback.print_exc()
-                    async with self.lock:
-                        task.status = TaskStatus.FAILED
-                        task.error = error
-                        task.completed_at = time.time()
-                        self.failed_tasks += 1
-
-                # 设置future结果
-                if not task.future.done():
-                    if task.status == TaskStatus.COMPLETED:
-                        task.future.set_result(result)
-                    else:
-                        task.future.set_exception(Exception(error or "任务失败"))
-
-                # 触发回调
-                try:
-                    if task.status == TaskStatus.COMPLETED and self.on_task_completed:
-                        self.on_task_completed(task.task_id, result)
-                    elif task.status == TaskStatus.FAILED and self.on_task_failed:
-                        self.on_task_failed(task.task_id, error)
-                except Exception as e:
-                    logger.error(f"任务回调失败: {task.task_id}, 错误: {str(e)}")
-
-                # 标记任务完成
-                self.task_queue.task_done()
-                logger.info(f"{worker_id} 任务处理完成: {task.task_id}")
+        # 更新任务状态
+        task.status = TaskStatus.RUNNING
+        task.started_at = time.time()
+        logger.info(f"{worker_id} 开始处理任务: {task.task_id}")
 
+        # 执行任务
+        result = None
+        error = None
+        try:
+            # 导入提取函数（避免循环导入）
+            from .quintuple_extractor import extract_quintuples_async
+            logger.info(f"{worker_id} 调用五元组提取API: {task.task_id}")
+
+            # 使用超时控制执行任务
+            result = await asyncio.wait_for(
+                extract_quintuples_async(task.text),
+                timeout=self.task_timeout
+            )
+            logger.info(f"{worker_id} 提取到 {len(result)} 个五元组: {task.text}")
+
+            # 更新任务状态
+            async with self.lock:
+                task.status = TaskStatus.COMPLETED
+                task.result = result
+                task.completed_at = time.time()
+                self.completed_tasks += 1
 
-            except asyncio.CancelledError:
-                logger.info(f"{worker_id} 工作协程被取消")
-                break
+        except asyncio.TimeoutError:
+            error = "任务执行超时"
+            logger.warning(f"{worker_id} 任务超时: {task.task_id}")
+            async with self.lock:
+                task.status = TaskStatus.FAILED
+                task.error = error
+                task.completed_at = time.time()
+                self.failed_tasks += 1
 
-            except Exception as e:
-                logger.error(f"{worker_id} 工作协程异常: {str(e)}")
-                logger.error(traceback.format_exc())
-                # 防止异常导致循环崩溃
-                await asyncio.sleep(1)
+        except Exception as e:
+            error = str(e)
+            logger.error(f"{worker_id} 任务失败: {task.task_id}, 错误: {error}")
+            traceback.print_exc()
+            async with self.lock:
+                task.status = TaskStatus.FAILED
+                task.error = error
+                task.completed_at = time.time()
+                self.failed_tasks += 1
+
+        # 设置future结果
+        if not task.future.done():
+            if task.status == TaskStatus.COMPLETED:
+                task.future.set_result(result)
+            else:
+                task.future.set_exception(Exception(error or "任务失败"))
+
+        # 触发回调
+        try:
+            if task.status == TaskStatus.COMPLETED and self.on_task_completed:
+                self.on_task_completed(task.task_id, result)
+            elif task.status == TaskStatus.FAILED and self.on_task_failed:
+                self.on_task_failed(task.task_id, error)
+        except Exception as e:
+            logger.error(f"任务回调失败: {task.task_id}, 错误: {str(e)}")
 
+        logger.info(f"{worker_id} 任务处理完成: {task.task_id}")
 
     async def clear_completed_tasks(self, max_age_hours: int = None):
         """清理已完成的任务"""
@@ -461,9 +415,10 @@ class QuintupleTaskManager:
             "cancelled_tasks": cancelled_tasks,
             "max_workers": self.max_workers,
             "max_queue_size": self.max_queue_size,
-            "queue_size": self.task_queue.qsize(),
-            "queue_usage": f"{self.task_queue.qsize()}/{self.max_queue_size}",
-            "task_timeout": self.task_timeout
+            "queue_size": self.worker_pool.qsize(),
+            "queue_usage": f"{self.worker_pool.qsize()}/{self.max_queue_size}",
+            "task_timeout": self.task_timeout,
+            "worker_pool": self.worker_pool.stats()
         }
 
 
@@ -7,9 +7,9 @@
 
 import asyncio
 import time
-from typing import Dict, Any, List, Optional
+from collections import OrderedDict, deque
+from typing import Callable, Deque, Dict, Any, List, Optional, Tuple
 from system.config import config, logger
-from langchain_openai import ChatOpenAI
 
 from system.config import get_prompt
 
@@ -17,16 +17,11 @@ class ConversationAnalyzer:
     """
     对话分析器模块：分析语音对话轮次以推断潜在任务意图
     输入是跨服务器的文本转录片段；输出是零个或多个标准化的任务查询
+    LLM调用走共享的异步连接池（后台优先级），不占用默认线程池
     """
-    def __init__(self):
-        self.llm = ChatOpenAI(
-            model=config.api.model,
-            base_url=config.api.base_url,
-            api_key=config.api.api_key,
-            temperature=0
-        )
 
-    def _build_prompt(self, messages: List[Dict[str, str]]) -> str:
+    def _build_prompt(self, messages: List[Dict[str, str]], context_summary: Optional[str] = None,
+                      allowed_services: Optional[List[str]] = None) -> str:
         lines = []
         for m in messages[-config.api.max_history_rounds:]:
             role = m.get('role', 'user')
@@ -36,11 +31,18 @@ class ConversationAnalyzer:
             content = content.replace('{', '{{').replace('}', '}}')
             lines.append(f"{role}: {content}")
         conversation = "\n".join(lines)
+        if context_summary:
+            # 增量分析：此前已分析过的对话只以摘要形式提供上下文
+            summary = context_summary.replace('{', '{{').replace('}', '}}')
+            conversation = f"【此前对话摘要（已分析，仅供参考）】\n{summary}\n\n【新增对话】\n{conversation}"
         
         # 获取可用的MCP工具信息，注入到意图识别中
         try:
             from nagaagent_core.stable.mcp import get_registered_services, get_service_info
             registered_services = get_registered_services()
+            if allowed_services:
+                # 预筛已定位到候选服务，只列出这些服务的工具
+                registered_services = [name for name in registered_services if name in allowed_services]
             services_info = {name: get_service_info(name) for name in registered_services}
             
             # 构建工具信息摘要
@@ -75,13 +77,35 @@ class ConversationAnalyzer:
         
         return get_prompt("conversation_analyzer_prompt", conversation=conversation)
 
-    def analyze(self, messages: List[Dict[str, str]]):
+    def _prefilter(self, messages: List[Dict[str, str]]) -> Optional[Dict]:
+        """用MCP清单在本地预筛新增的用户消息，失败时返回None（按原流程调用LLM）"""
+        if not config.api.intent_prefilter_enabled:
+            return None
+        text = "\n".join(m.get("content", "") for m in messages if m.get("role") == "user")
+        if not text:
+            return None
+        try:
+            from nagaagent_core.stable.mcp import MANIFEST_CACHE
+            from system.intent_prefilter import get_intent_prefilter
+            return get_intent_prefilter().evaluate(text, MANIFEST_CACHE)
+        except Exception as e:
+            logger.debug(f"[ConversationAnalyzer] 意图预筛失败: {e}")
+            return None
+
+    async def analyze(self, messages: List[Dict[str, str]], context_summary: Optional[str] = None):
         logger.info(f"[ConversationAnalyzer] 开始分析对话，消息数量: {len(messages)}")
-        prompt = self._build_prompt(messages)
+        prefilter = self._prefilter(messages)
+        if prefilter and prefilter["skip_llm"]:
+            logger.info(f"[ConversationAnalyzer] 预筛判定无需调用工具，跳过LLM: {prefilter['reason']}")
+            return {"tasks": [], "reason": "预筛未发现工具意图", "raw": "", "tool_calls": []}
+        allowed_services = prefilter["services"] if prefilter else None
+        if allowed_services:
+            logger.info(f"[ConversationAnalyzer] 预筛{prefilter['reason']}")
+        prompt = self._build_prompt(messages, context_summary, allowed_services)
         logger.info(f"[ConversationAnalyzer] 构建提示词完成，长度: {len(prompt)}")
 
         # 使用简化的非标准JSON解析
-        result = self._analyze_with_non_standard_json(prompt)
+        result = await self._analyze_with_non_standard_json(prompt)
         if result and result.get("tool_calls"):
             return result
 
@@ -89,17 +113,22 @@ class ConversationAnalyzer:
         logger.info("[ConversationAnalyzer] 未发现可执行任务")
         return {"tasks": [], "reason": "未发现可执行任务", "raw": "", "tool_calls": []}
 
-    def _analyze_with_non_standard_json(self, prompt: str) -> Optional[Dict]:
-        """非标准JSON格式解析 - 直接调用LLM，避免嵌套线程池"""
+    async def _analyze_with_non_standard_json(self, prompt: str) -> Optional[Dict]:
+        """非标准JSON格式解析 - 以后台优先级异步调用LLM"""
         logger.info("[ConversationAnalyzer] 尝试非标准JSON格式解析")
         try:
-            # 直接调用LLM，避免嵌套线程池
-            resp = self.llm.invoke([
-                {"role": "system", "content": "你是精确的任务意图提取器与MCP调用规划器。"},
-                {"role": "user", "content": prompt},
-            ])
-            
-            text = resp.content.strip()
+            from apiserver.llm_service import get_llm_service
+            # 相同对话片段的重复分析由响应缓存复用结果（conversation_analyzer 调用点）
+            text = await get_llm_service().complete(
+                [
+                    {"role": "system", "content": "你是精确的任务意图提取器与MCP调用规划器。"},
+                    {"role": "user", "content": prompt},
+                ],
+                temperature=0,
+                cache_site="conversation_analyzer",
+                background=True,
+            )
+            text = text.strip()
             logger.info(f"[ConversationAnalyzer] LLM响应完成，响应长度: {len(text)}")
             logger.info(f"[ConversationAnalyzer] LLM原始响应内容: {text}")
 
@@ -117,6 +146,8 @@ class ConversationAnalyzer:
                 logger.info("[ConversationAnalyzer] 未发现工具调用")
                 return None
 
+        except asyncio.CancelledError:
+            raise
         except Exception as e:
             logger.error(f"[ConversationAnalyzer] 非标准JSON解析失败: {e}")
             return None
@@ -127,14 +158,138 @@ class ConversationAnalyzer:
         return parse_non_standard_json(text)
 
 
+class _SessionAnalysisState:
+    """单个会话的增量分析状态"""
+
+    def __init__(self):
+        self.dirty = False  # 有尚未分析的新触发
+        self.running = False
+        self.first_trigger_at = 0.0  # 本轮防抖窗口内首次触发的时间
+        self.timer: Optional[asyncio.Task] = None
+        self.get_messages: Optional[Callable[[], List[Dict[str, str]]]] = None
+        self.last_analyzed: Optional[Tuple[str, int]] = None  # 最后一条已分析消息的指纹
+        self.summary_lines: Deque[str] = deque()
+
+
+def _message_fingerprint(message: Dict[str, str]) -> Tuple[str, int]:
+    return message.get("role", ""), hash(message.get("content", ""))
+
+
 class BackgroundAnalyzer:
-    """后台分析器 - 管理异步意图分析"""
+    """后台分析器 - 管理异步意图分析
+
+    request_analysis() 为每个会话做防抖：对话停顿 intent_analysis_debounce 秒后才分析
+    （持续对话时最迟 intent_analysis_max_delay 秒），分析进行中到达的触发记为dirty，
+    当前分析结束后立即补做；每次只分析上次之后的新增消息，更早的对话以摘要提供上下文。
+    """
+    
+    # 保留增量状态的会话数上限
+    MAX_TRACKED_SESSIONS = 256
     
     def __init__(self):
         self.analyzer = ConversationAnalyzer()
         self.running_analyses = {}
+        self._session_states: "OrderedDict[str, _SessionAnalysisState]" = OrderedDict()
+        # 后台分析专用并发限制（按事件循环惰性创建）
+        self._analysis_semaphore: Optional[asyncio.Semaphore] = None
+        self._semaphore_loop: Optional[asyncio.AbstractEventLoop] = None
     
-    async def analyze_intent_async(self, messages: List[Dict[str, str]], session_id: str):
+    def _get_analysis_semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if self._analysis_semaphore is None or self._semaphore_loop is not loop:
+            self._analysis_semaphore = asyncio.Semaphore(config.api.intent_analysis_concurrency)
+            self._semaphore_loop = loop
+        return self._analysis_semaphore
+    
+    # ========== 防抖与增量调度 ==========
+    
+    def request_analysis(self, session_id: str, get_messages: Callable[[], List[Dict[str, str]]]):
+        """登记一次分析触发（需在事件循环中调用）
+
+        get_messages 在真正分析时才调用，以取得会话的最新消息
+        """
+        state = self._session_states.get(session_id)
+        if state is None:
+            state = _SessionAnalysisState()
+            self._session_states[session_id] = state
+            self._trim_session_states()
+        self._session_states.move_to_end(session_id)
+        
+        state.get_messages = get_messages
+        if not state.dirty:
+            state.first_trigger_at = time.monotonic()
+        state.dirty = True
+        if state.running:
+            # 分析进行中：保留dirty标记，结束后补做
+            logger.debug(f"[博弈论] 会话 {session_id} 分析进行中，新触发已标记待处理")
+            return
+        
+        if state.timer is not None and not state.timer.done():
+            state.timer.cancel()
+        waited = time.monotonic() - state.first_trigger_at
+        delay = max(0.0, min(config.api.intent_analysis_debounce, config.api.intent_analysis_max_delay - waited))
+        state.timer = asyncio.create_task(self._debounced_run(session_id, state, delay))
+    
+    async def _debounced_run(self, session_id: str, state: _SessionAnalysisState, delay: float):
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            return
+        state.timer = None
+        state.running = True
+        try:
+            while state.dirty:
+                state.dirty = False
+                await self._analyze_new_turns(session_id, state)
+        except Exception as e:
+            logger.error(f"[博弈论] 会话 {session_id} 增量意图分析失败: {e}")
+        finally:
+            state.running = False
+    
+    async def _analyze_new_turns(self, session_id: str, state: _SessionAnalysisState):
+        """只分析上次分析之后的新增消息"""
+        messages = state.get_messages() if state.get_messages else []
+        if not messages:
+            return
+        
+        window = config.api.intent_analysis_rounds * 2  # 每轮包含用户和助手各一条消息
+        new_messages = messages
+        if state.last_analyzed is not None:
+            for i in range(len(messages) - 1, -1, -1):
+                if _message_fingerprint(messages[i]) == state.last_analyzed:
+                    new_messages = messages[i + 1:]
+                    break
+        new_messages = new_messages[-window:]
+        if not new_messages:
+            logger.debug(f"[博弈论] 会话 {session_id} 没有新增对话，跳过分析")
+            return
+        
+        summary = "\n".join(state.summary_lines) or None
+        logger.info(f"[博弈论] 增量分析会话 {session_id}: 新增 {len(new_messages)} 条消息，摘要 {len(state.summary_lines)} 条")
+        await self.analyze_intent_async(new_messages, session_id, context_summary=summary)
+        
+        state.last_analyzed = _message_fingerprint(new_messages[-1])
+        for message in new_messages:
+            content = (message.get("content") or "").replace("\n", " ")
+            limit = config.api.intent_analysis_summary_chars
+            if len(content) > limit:
+                content = content[:limit] + "…"
+            state.summary_lines.append(f"{message.get('role', 'user')}: {content}")
+        while len(state.summary_lines) > config.api.intent_analysis_summary_turns * 2:
+            state.summary_lines.popleft()
+    
+    def _trim_session_states(self):
+        """淘汰最久未触发且空闲的会话状态"""
+        while len(self._session_states) > self.MAX_TRACKED_SESSIONS:
+            for session_id, state in self._session_states.items():
+                if not state.running and (state.timer is None or state.timer.done()):
+                    del self._session_states[session_id]
+                    break
+            else:
+                return
+    
+    async def analyze_intent_async(self, messages: List[Dict[str, str]], session_id: str,
+                                   context_summary: Optional[str] = None):
         """异步意图分析 - 基于博弈论的背景分析机制"""
         # 检查是否已经有分析在进行中
         if session_id in self.running_analyses:
@@ -147,23 +302,29 @@ class BackgroundAnalyzer:
         
         # 标记分析开始
         self.running_analyses[session_id] = analysis_session_id
-        
+        try:
+            return await self._run_analysis(messages, session_id, analysis_session_id, context_summary)
+        finally:
+            # 清除分析状态标记（含超时与失败的提前返回）
+            if self.running_analyses.get(session_id) == analysis_session_id:
+                del self.running_analyses[session_id]
+                logger.info(f"[博弈论] 会话 {session_id} 分析状态已清除")
+
+    async def _run_analysis(self, messages: List[Dict[str, str]], session_id: str, analysis_session_id: str,
+                            context_summary: Optional[str] = None):
+        """执行一次意图分析并分发发现的工具调用"""
         try:
             logger.info(f"[博弈论] 开始异步意图分析，消息数量: {len(messages)}")
-            loop = asyncio.get_running_loop()
-            # Offload sync LLM call to threadpool to avoid blocking event loop
-            logger.info(f"[博弈论] 在线程池中执行LLM分析...")
+            timeout = config.api.intent_analysis_timeout
 
-            # 添加异步超时机制
-            try:
-                analysis = await asyncio.wait_for(
-                    loop.run_in_executor(None, self.analyzer.analyze, messages),
-                    timeout=60.0  # 60秒超时
-                )
-                logger.info(f"[博弈论] LLM分析完成，结果类型: {type(analysis)}")
-            except asyncio.TimeoutError:
-                logger.error("[博弈论] 意图分析超时（60秒）")
-                return {"has_tasks": False, "reason": "意图分析超时", "tasks": [], "priority": "low"}
+            # 超时会取消协程，进而取消上游HTTP请求，不会残留占用的线程
+            async with self._get_analysis_semaphore():
+                try:
+                    analysis = await asyncio.wait_for(self.analyzer.analyze(messages, context_summary), timeout=timeout)
+                    logger.info(f"[博弈论] LLM分析完成，结果类型: {type(analysis)}")
+                except asyncio.TimeoutError:
+                    logger.error(f"[博弈论] 意图分析超时（{timeout:.0f}秒）")
+                    return {"has_tasks": False, "reason": "意图分析超时", "tasks": [], "priority": "low"}
 
         except Exception as e:
             logger.error(f"[博弈论] 意图分析失败: {e}")
@@ -207,11 +368,6 @@ class BackgroundAnalyzer:
         except Exception as e:
             logger.error(f"任务处理失败: {e}")
             return {"has_tasks": False, "reason": f"处理失败: {e}", "tasks": [], "priority": "low"}
-        finally:
-            # 清除分析状态标记
-            if session_id in self.running_analyses:
-                del self.running_analyses[session_id]
-                logger.info(f"[博弈论] 会话 {session_id} 分析状态已清除")
 
     async def _notify_ui_tool_calls(self, tool_calls: List[Dict[str, Any]], session_id: str):
         """批量通知UI工具调用开始 - 优化网络请求"""
@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+回调投递器
+任务结果回调统一经此投递：共享连接池的HTTP客户端，指数退避（带抖动）重试，
+同一会话的多条结果合并为一次POST；待投递的回调先写入磁盘发件箱，投递成功后删除，重启时重放
+每条回调带有固定的 callback_id（重试与重放时不变），接收方据此去重
+"""
+
+import asyncio
+import itertools
+import json
+import logging
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    url TEXT NOT NULL,
+    coalesce_key TEXT,
+    payload TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL
+);
+"""
+
+# 这些状态码视为接收方暂时不可用，继续重试；其余4xx视为永久失败
+_RETRYABLE_STATUS = {408, 425, 429}
+
+
+@dataclass
+class _Callback:
+    """一条待投递的回调"""
+    id: int
+    url: str
+    coalesce_key: Optional[str]
+    payload: Dict[str, Any]
+    attempts: int = 0
+    next_attempt: float = 0.0
+
+
+class CallbackDispatcher:
+    """回调投递器（绑定首次使用时的事件循环）
+
+    - send() 只负责登记回调（写入发件箱并唤醒投递协程），不等待投递结果；载荷中补充 callback_id，
+      超时后重试的回调接收方可能已经处理过，需按 callback_id 去重
+    - 到期的回调按 (url, coalesce_key) 分组：同组多条合并为 {"session_id": ..., "batch": [...]} 一次POST，
+      单条保持原始载荷
+    - 失败后按 base_delay * 2^attempts（上限 max_delay，带抖动）退避重试，超过 max_attempts 后丢弃并记录错误
+    - outbox_path 不为空时，未投递的回调持久化在SQLite中，start() 时重放
+    """
+
+    def __init__(self, name: str, outbox_path: Optional[Union[str, Path]] = None,
+                 max_attempts: int = 10, base_delay: float = 0.5, max_delay: float = 60.0,
+                 batch_window: float = 0.2, request_timeout: float = 10.0):
+        self.name = name
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.batch_window = batch_window
+        self.request_timeout = request_timeout
+
+        self._pending: Dict[int, _Callback] = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()  # 保护SQLite连接
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._session = None
+        self._stats = {"queued": 0, "delivered": 0, "posts": 0, "coalesced": 0, "retries": 0,
+                       "dropped": 0, "replayed": 0}
+
+        self._conn: Optional[sqlite3.Connection] = None
+        if outbox_path:
+            try:
+                Path(outbox_path).parent.mkdir(parents=True, exist_ok=True)
+                self._conn = sqlite3.connect(str(outbox_path), check_same_thread=False, timeout=10)
+                self._conn.execute("PRAGMA journal_mode=WAL")
+                self._conn.execute("PRAGMA synchronous=NORMAL")
+                self._conn.executescript(_SCHEMA)
+                self._conn.commit()
+            except Exception as e:
+                logger.warning(f"回调发件箱不可用，回调仅保存在内存中: {e}")
+                self._conn = None
+
+    # ========== 对外接口 ==========
+
+    def start(self):
+        """启动投递协程并重放发件箱中未投递的回调（已启动则忽略）"""
+        if self._task is not None and not self._task.done():
+            return
+        self._wakeup = asyncio.Event()
+        self._replay_outbox()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def send(self, url: str, payload: Dict[str, Any], coalesce_key: Optional[str] = None):
+        """登记一条回调；coalesce_key 相同（通常为会话ID）的回调可合并投递"""
+        self.start()
+        payload = {**payload, "callback_id": payload.get("callback_id") or uuid.uuid4().hex}
+        callback_id = self._store(url, coalesce_key, payload)
+        self._pending[callback_id] = _Callback(callback_id, url, coalesce_key, payload)
+        self._stats["queued"] += 1
+        self._wakeup.set()
+
+    async def close(self):
+        """停止投递协程并关闭HTTP会话，未投递的回调留在发件箱中"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def stats(self) -> Dict[str, Any]:
+        stats = dict(self._stats)
+        stats["pending"] = len(self._pending)
+        stats["outbox_enabled"] = self._conn is not None
+        return stats
+
+    # ========== 投递 ==========
+
+    async def _run(self):
+        while True:
+            now = time.monotonic()
+            due = [cb for cb in self._pending.values() if cb.next_attempt <= now]
+            if not due:
+                self._wakeup.clear()
+                delay = min((cb.next_attempt for cb in self._pending.values()), default=now + 3600) - now
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=max(delay, 0.0))
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            # 稍等片刻，让同一会话紧随其后的回调一起合并投递
+            if self.batch_window > 0:
+                await asyncio.sleep(self.batch_window)
+                now = time.monotonic()
+                due = [cb for cb in self._pending.values() if cb.next_attempt <= now]
+
+            groups: Dict[Tuple[str, Any], List[_Callback]] = {}
+            for cb in due:
+                key = (cb.url, cb.coalesce_key if cb.coalesce_key is not None else ("single", cb.id))
+                groups.setdefault(key, []).append(cb)
+            await asyncio.gather(*(self._deliver(group) for group in groups.values()))
+
+    async def _deliver(self, group: List[_Callback]):
+        if len(group) == 1:
+            body = group[0].payload
+        else:
+            body = {"session_id": group[0].coalesce_key, "batch": [cb.payload for cb in group]}
+
+        self._stats["posts"] += 1
+        retry, error = await self._post(group[0].url, body)
+        if error is None:
+            self._finish(group)
+            self._stats["delivered"] += len(group)
+            self._stats["coalesced"] += len(group) - 1
+            logger.info(f"[回调投递] {self.name} 回调成功: {group[0].url} ({len(group)} 条)")
+            return
+
+        if not retry:
+            self._finish(group)
+            self._stats["dropped"] += len(group)
+            logger.error(f"[回调投递] {self.name} 回调被拒绝，已丢弃 {len(group)} 条: {error}")
+            return
+
+        for cb in group:
+            cb.attempts += 1
+            if cb.attempts >= self.max_attempts:
+                self._finish([cb])
+                self._stats["dropped"] += 1
+                logger.error(f"[回调投递] {self.name} 回调已重试{cb.attempts}次仍失败，已丢弃: {cb.url} - {error}")
+                continue
+            delay = min(self.max_delay, self.base_delay * (2 ** (cb.attempts - 1)))
+            cb.next_attempt = time.monotonic() + delay * random.uniform(0.5, 1.0)
+            self._stats["retries"] += 1
+            self._update_attempts(cb)
+        logger.warning(f"[回调投递] {self.name} 回调失败，将退避重试: {group[0].url} - {error}")
+
+    async def _post(self, url: str, body: Dict[str, Any]) -> Tuple[bool, Optional[str]]:
+        """发送一次POST，返回 (失败时是否可重试, 错误信息)"""
+        import aiohttp
+        try:
+            session = await self._get_session()
+            async with session.post(url, json=body) as response:
+                if response.status < 300:
+                    return False, None
+                text = await response.text()
+                retry = response.status >= 500 or response.status in _RETRYABLE_STATUS
+                return retry, f"状态码={response.status}, 响应={text[:200]}"
+        except asyncio.TimeoutError:
+            return True, "请求超时"
+        except aiohttp.ClientError as e:
+            return True, str(e) or type(e).__name__
+
+    async def _get_session(self):
+        import aiohttp
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=16, keepalive_timeout=30),
+                timeout=aiohttp.ClientTimeout(total=self.request_timeout),
+                json_serialize=lambda obj: json.dumps(obj, ensure_ascii=False, default=str),
+            )
+        return self._session
+
+    def _finish(self, group: List[_Callback]):
+        for cb in group:
+            self._pending.pop(cb.id, None)
+        self._delete([cb.id for cb in group])
+
+    # ========== 发件箱 ==========
+
+    def _store(self, url: str, coalesce_key: Optional[str], payload: Dict[str, Any]) -> int:
+        with self._lock:
+            if self._conn is not None:
+                try:
+                    cursor = self._conn.execute(
+                        "INSERT INTO outbox (url, coalesce_key, payload, created_at) VALUES (?, ?, ?, ?)",
+                        (url, coalesce_key, json.dumps(payload, ensure_ascii=False, default=str), time.time())
+                    )
+                    self._conn.commit()
+                    return cursor.lastrowid
+                except sqlite3.Error as e:
+                    logger.warning(f"回调写入发件箱失败，仅保存在内存中: {e}")
+        # 未持久化的回调使用负数ID，避免与发件箱行号冲突
+        return -next(self._ids)
+
+    def _delete(self, callback_ids: List[int]):
+        ids = [(i,) for i in callback_ids if i > 0]
+        if not ids:
+            return
+        with self._lock:
+            if self._conn is not None:
+                self._conn.executemany("DELETE FROM outbox WHERE id = ?", ids)
+                self._conn.commit()
+
+    def _update_attempts(self, cb: _Callback):
+        if cb.id <= 0:
+            return
+        with self._lock:
+            if self._conn is not None:
+                self._conn.execute("UPDATE outbox SET attempts = ? WHERE id = ?", (cb.attempts, cb.id))
+                self._conn.commit()
+
+    def _replay_outbox(self):
+        with self._lock:
+            if self._conn is None:
+                return
+            rows = self._conn.execute(
+                "SELECT id, url, coalesce_key, payload, attempts FROM outbox ORDER BY id"
+            ).fetchall()
+        replayed = 0
+        for callback_id, url, coalesce_key, payload, attempts in rows:
+            if callback_id in self._pending:
+                continue
+            self._pending[callback_id] = _Callback(callback_id, url, coalesce_key, json.loads(payload), attempts)
+            replayed += 1
+        if replayed:
+            self._stats["replayed"] += replayed
+            logger.info(f"[回调投递] {self.name} 从发件箱重放 {replayed} 条未投递的回调")
+
+
+# 按服务名区分的全局投递器（各服务运行在各自的事件循环中）
+_dispatchers: Dict[str, CallbackDispatcher] = {}
+_dispatchers_lock = threading.Lock()
+
+
+def get_callback_dispatcher(name: str) -> CallbackDispatcher:
+    """获取指定服务的回调投递器"""
+    with _dispatchers_lock:
+        dispatcher = _dispatchers.get(name)
+        if dispatcher is None:
+            from system.config import config
+            callback_config = config.callback
+            outbox_path = (Path(config.system.log_dir) / f"callback_outbox_{name}.db"
+                           if callback_config.outbox_enabled else None)
+            dispatcher = CallbackDispatcher(
+                name,
+                outbox_path=outbox_path,
+                max_attempts=callback_config.max_attempts,
+                base_delay=callback_config.base_delay,
+                max_delay=callback_config.max_delay,
+                batch_window=callback_config.batch_window,
+                request_timeout=callback_config.request_timeout,
+            )
+            _dispatchers[name] = dispatcher
+        return dispatcher
@@ -121,7 +121,32 @@ class APIConfig(BaseModel):
     persistent_context: bool = Field(default=True, description="是否启用持久化上下文")
     context_load_days: int = Field(default=3, ge=1, le=30, description="加载历史上下文的天数")
     context_parse_logs: bool = Field(default=True, description="是否从日志文件解析上下文")
+    context_token_budget: int = Field(default=32000, ge=0, le=1000000, description="对话上下文token预算（0为不限制，仅按轮数截断）")
+    context_pin_summaries: bool = Field(default=True, description="超出预算时是否固定保留历史中的system摘要消息")
+    session_max_count: int = Field(default=1000, ge=1, le=100000, description="内存中保留的最大会话数")
+    session_max_memory_mb: int = Field(default=64, ge=0, le=4096, description="会话消息占用内存上限（MB，0为不限制）")
+    session_ttl_hours: float = Field(default=24.0, gt=0, le=720, description="会话空闲多久后淘汰（小时）")
+    session_spill_to_disk: bool = Field(default=True, description="被淘汰的会话是否落盘，再次访问时重新加载")
+    session_spill_ttl_hours: float = Field(default=168.0, ge=0, le=8760, description="落盘会话保留时间（小时，0为不清理）")
     applied_proxy: bool = Field(default=True, description="是否应用代理")
+    http_pool_size: int = Field(default=100, ge=1, le=1000, description="LLM HTTP连接池总连接上限")
+    http_pool_per_host: int = Field(default=20, ge=0, le=500, description="LLM HTTP连接池单主机连接上限（0为不限制）")
+    http_dns_cache_ttl: int = Field(default=300, ge=0, le=86400, description="DNS解析缓存时间（秒，0为不缓存）")
+    http_keepalive_timeout: float = Field(default=60.0, ge=1.0, le=600.0, description="空闲keep-alive连接保持时间（秒）")
+    llm_single_flight: bool = Field(default=True, description="合并完全相同的并发LLM请求，共享同一次上游调用")
+    background_max_defer: float = Field(default=10.0, ge=0.0, le=300.0, description="后台LLM调用为前台对话让行的最长等待时间（秒）")
+    intent_analysis_timeout: float = Field(default=60.0, ge=1.0, le=600.0, description="单次后台意图分析超时（秒），超时即取消上游请求")
+    intent_analysis_concurrency: int = Field(default=1, ge=1, le=16, description="同时进行的后台意图分析数量上限")
+    intent_analysis_rounds: int = Field(default=3, ge=1, le=20, description="单次意图分析最多包含的新增对话轮数")
+    intent_analysis_debounce: float = Field(default=1.5, ge=0.0, le=60.0, description="对话停顿多久后触发意图分析（秒）")
+    intent_analysis_max_delay: float = Field(default=10.0, ge=0.0, le=300.0, description="持续对话时意图分析的最长延迟（秒）")
+    intent_analysis_summary_turns: int = Field(default=6, ge=0, le=50, description="增量分析时作为摘要提供的已分析轮数")
+    intent_analysis_summary_chars: int = Field(default=80, ge=10, le=1000, description="摘要中每条消息保留的最大字符数")
+    intent_prefilter_enabled: bool = Field(default=True, description="意图分析前先用MCP清单做本地预筛，闲聊直接跳过LLM")
+    intent_prefilter_threshold: float = Field(default=3.0, ge=0.0, le=100.0, description="预筛关键词得分阈值，低于该值视为未命中工具（默认需命中两个关键词或完整的命令名）")
+    intent_prefilter_embedding_model: str = Field(default="", description="预筛使用的sentence-transformers模型（为空则只用关键词）")
+    intent_prefilter_embedding_threshold: float = Field(default=0.45, ge=0.0, le=1.0, description="预筛向量相似度阈值")
+    intent_prefilter_max_services: int = Field(default=3, ge=1, le=50, description="预筛命中时提示词中保留的候选服务数")
 
 class APIServerConfig(BaseModel):
     """API服务器配置"""
@@ -131,6 +156,23 @@ class APIServerConfig(BaseModel):
     auto_start: bool = Field(default=True, description="启动时自动启动API服务器")
     docs_enabled: bool = Field(default=True, description="是否启用API文档")
 
+class ResponseCacheConfig(BaseModel):
+    """LLM响应缓存配置（仅作用于非流式调用）"""
+    enabled: bool = Field(default=False, description="是否启用LLM响应缓存")
+    max_entries: int = Field(default=512, ge=1, le=100000, description="内存缓存最大条目数")
+    ttl_seconds: int = Field(default=3600, ge=0, le=30 * 86400, description="缓存有效期（秒，0为不过期）")
+    disk_enabled: bool = Field(default=False, description="是否启用磁盘缓存层")
+    disk_max_entries: int = Field(default=10000, ge=1, le=1000000, description="磁盘缓存最大条目数")
+    sites: Dict[str, bool] = Field(
+        default_factory=lambda: {
+            "chat": False,  # /chat 非流式对话
+            "get_response": True,  # LLMService.get_response（博弈系统等内部调用）
+            "tool_callback": True,  # 工具结果回调的总结回复
+            "conversation_analyzer": True,  # 后台意图分析
+        },
+        description="各调用点是否使用缓存"
+    )
+
 class GRAGConfig(BaseModel):
     """GRAG知识图谱记忆系统配置"""
     enabled: bool = Field(default=False, description="是否启用GRAG记忆系统")
@@ -151,6 +193,36 @@ class HandoffConfig(BaseModel):
     max_loop_non_stream: int = Field(default=5, ge=1, le=20, description="非流式模式最大工具调用循环次数")
     show_output: bool = Field(default=False, description="是否显示工具调用输出")
 
+class MCPConfig(BaseModel):
+    """MCP工具调度配置"""
+    tool_call_timeout: float = Field(default=120.0, ge=1.0, le=3600.0, description="单个工具调用超时时间（秒）")
+    per_service_concurrency: int = Field(default=2, ge=1, le=64, description="同一MCP服务同时执行的工具调用数上限")
+    service_concurrency: Dict[str, int] = Field(default_factory=dict, description="按服务覆盖并发上限，如 {\"agent_playwright_master\": 1}")
+    thread_pool_workers: int = Field(default=8, ge=1, le=128, description="executionClass为thread的工具使用的线程池大小")
+    process_pool_workers: int = Field(default=2, ge=1, le=32, description="executionClass为process的工具使用的进程池大小")
+    loop_lag_threshold: float = Field(default=0.25, ge=0.01, le=10.0, description="事件循环阻塞超过该时长（秒）时记录告警")
+    loop_lag_interval: float = Field(default=0.5, ge=0.05, le=10.0, description="事件循环延迟检测间隔（秒）")
+    task_history_max_entries: int = Field(default=1000, ge=10, le=100000, description="内存中保留的已结束任务数上限（同时限制幂等请求缓存）")
+    task_history_ttl_hours: float = Field(default=24.0, ge=0.0, le=720.0, description="已结束任务在内存中的保留时长（小时，0表示不按时间淘汰）")
+    task_persist_enabled: bool = Field(default=False, description="是否将任务历史持久化到SQLite（logs/mcp_tasks.db）")
+    task_persist_ttl_hours: float = Field(default=168.0, ge=0.0, le=8760.0, description="持久化任务记录的保留时长（小时，0表示永久保留）")
+    manifest_index_cache: bool = Field(default=True, description="是否将解析后的MCP清单缓存到磁盘索引（logs/mcp_manifest_index.json），清单未变化时跳过解析")
+    lazy_agent_loading: bool = Field(default=True, description="MCP Agent是否在首次调用时才导入和实例化（关闭则启动时全部加载）")
+    stdio_prewarm_services: List[str] = Field(default_factory=list, description="MCP服务器启动时预先拉起的stdio MCP服务名")
+    stdio_call_concurrency: int = Field(default=4, ge=1, le=64, description="单个stdio MCP会话同时进行的调用数上限（清单 stdio.maxConcurrency 可覆盖）")
+    stdio_health_interval: float = Field(default=30.0, ge=1.0, le=3600.0, description="stdio MCP会话健康检查（ping）间隔（秒）")
+    stdio_startup_timeout: float = Field(default=30.0, ge=1.0, le=300.0, description="stdio MCP服务启动并完成initialize的超时时间（秒）")
+    stdio_restart_max_delay: float = Field(default=60.0, ge=1.0, le=3600.0, description="stdio MCP服务崩溃后重启的最大退避时间（秒）")
+
+class CallbackConfig(BaseModel):
+    """任务结果回调投递配置"""
+    outbox_enabled: bool = Field(default=True, description="是否将待投递的回调写入磁盘发件箱（logs/callback_outbox_*.db），重启后重放")
+    max_attempts: int = Field(default=10, ge=1, le=100, description="单条回调最多投递次数")
+    base_delay: float = Field(default=0.5, ge=0.05, le=60.0, description="首次重试的退避时间（秒），之后按2倍递增")
+    max_delay: float = Field(default=60.0, ge=1.0, le=3600.0, description="重试退避时间上限（秒）")
+    batch_window: float = Field(default=0.2, ge=0.0, le=5.0, description="合并同一会话回调的等待窗口（秒）")
+    request_timeout: float = Field(default=10.0, ge=1.0, le=120.0, description="单次回调请求超时（秒）")
+
 class BrowserConfig(BaseModel):
     """浏览器配置"""
     playwright_headless: bool = Field(default=False, description="Playwright浏览器是否无头模式")
@@ -178,6 +250,8 @@ class TTSConfig(BaseModel):
     remove_filter: bool = Field(default=False, description="是否移除过滤")
     expand_api: bool = Field(default=True, description="是否扩展API")
     require_api_key: bool = Field(default=False, description="是否需要API密钥")
+    dispatch_workers: int = Field(default=2, ge=1, le=16, description="流式句子投递TTS的共享线程数")
+    dispatch_queue_size: int = Field(default=64, ge=1, le=1024, description="每个流式会话待投递句子队列上限（满时对文本流施加背压）")
 
 class ASRConfig(BaseModel):
     """ASR输入服务配置"""
@@ -258,6 +332,20 @@ class ComputerControlConfig(BaseModel):
     max_dim_size: int = Field(default=1920, description="逻辑空间最大边尺寸")
     dpi_awareness: bool = Field(default=True, description="是否启用DPI感知（Windows）")
     safe_mode: bool = Field(default=True, description="是否启用安全模式（限制高风险操作）")
+    capture_source: str = Field(default="screen", description="截图来源：screen（真实屏幕）/ synthetic（合成帧，用于无显示环境测试）")
+    capture_tile_size: int = Field(default=64, ge=8, le=512, description="帧差分的图块边长（像素）")
+    vision_image_format: str = Field(default="PNG", description="发送给视觉模型的截图编码格式：PNG / JPEG")
+    vision_jpeg_quality: int = Field(default=85, ge=1, le=95, description="JPEG编码质量")
+    analysis_cache_size: int = Field(default=16, ge=1, le=256, description="按帧缓存的视觉分析结果数量")
+    text_match_threshold: float = Field(default=0.8, ge=0.0, le=1.0, description="OCR文本模糊匹配的相似度阈值")
+    template_dirs: List[str] = Field(default_factory=list, description="启动时预加载的模板图像目录/文件")
+    template_scales: List[float] = Field(default_factory=lambda: [1.0, 1.25, 1.5, 0.8], description="模板匹配尝试的缩放比例（应对DPI缩放）")
+    template_pyramid_levels: int = Field(default=2, ge=0, le=5, description="模板粗定位使用的金字塔层数")
+    template_match_threshold: float = Field(default=0.8, ge=0.0, le=1.0, description="模板匹配分数阈值")
+    template_match_mode: str = Field(default="gray", description="模板匹配特征：gray（灰度）/ edges（边缘图，对配色变化更稳健）")
+    settle_timeout: float = Field(default=3.0, ge=0.0, le=30.0, description="动作后等待画面稳定的最长时间（秒）")
+    settle_interval: float = Field(default=0.1, ge=0.02, le=2.0, description="检测画面稳定的采样间隔（秒）")
+    settle_stable_frames: int = Field(default=2, ge=1, le=10, description="连续多少帧无变化视为画面稳定")
 
 # 天气服务使用免费API，无需配置
 
@@ -487,8 +575,11 @@ class NagaConfig(BaseModel):
     system: SystemConfig = Field(default_factory=SystemConfig)
     api: APIConfig = Field(default_factory=APIConfig)
     api_server: APIServerConfig = Field(default_factory=APIServerConfig)
+    response_cache: ResponseCacheConfig = Field(default_factory=ResponseCacheConfig)
     grag: GRAGConfig = Field(default_factory=GRAGConfig)
     handoff: HandoffConfig = Field(default_factory=HandoffConfig)
+    mcp: MCPConfig = Field(default_factory=MCPConfig)
+    callback: CallbackConfig = Field(default_factory=CallbackConfig)
     browser: BrowserConfig = Field(default_factory=BrowserConfig)
     tts: TTSConfig = Field(default_factory=TTSConfig)
     asr: ASRConfig = Field(default_factory=ASRConfig)  # ASR输入服务配置 #
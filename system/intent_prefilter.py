@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+意图预筛
+在调用LLM规划器之前，用MCP清单（服务名称与描述、invocationCommands 的命令名、描述、示例）在本地为最新对话打分：
+关键词字典树 + 可选的CPU向量索引。明显与工具无关的闲聊直接跳过LLM；否则只把候选服务放进提示词
+"""
+
+import json
+import logging
+import math
+import re
+from typing import Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 清单描述中的通用词，不参与打分
+_STOP_WORDS = {
+    "参数", "可选", "必需", "必填", "返回", "调用", "示例", "格式", "内容", "信息", "数据", "指定", "支持",
+    "默认", "用户", "系统", "结果", "工具", "使用", "执行", "获取", "查询",
+    "tool", "tool_name", "name", "query", "json", "str", "int", "true", "false", "null", "the", "and",
+    "for", "with", "from", "city",
+}
+# 表示“要做某事”的通用提示词：命中时即使没有匹配到具体工具也交给LLM判断
+_ACTION_HINTS = (
+    "帮我", "请帮", "麻烦", "给我", "搜", "查", "看看", "打开", "关闭", "启动", "下载", "播放", "设置", "调高", "调低",
+    "调到", "太亮", "太暗", "亮度", "音量", "声音", "大声", "小声", "静音", "开灯", "关灯", "关机", "重启", "睡眠",
+    "锁屏", "开关", "充值", "余额", "额度", "几点", "时间", "天气", "下雨", "下雪", "气温", "温度", "截个图", "截屏", "记得", "回忆", "提醒", "发送", "截图", "网页", "网址", "首页", "http",
+    "写", "保存", "文档", "生成", "创建", "新建", "编辑", "导出",
+    "search", "open", "find", "download", "play", "launch", "weather", "remember", "save", "write",
+    ".doc", ".pdf", ".com", "www",
+)
+_CJK_RUN = re.compile(r"[一-鿿]+")
+_ASCII_WORD = re.compile(r"[A-Za-z][A-Za-z0-9_]{2,}")
+_TERMINAL = "$"
+_NAME_TERMINAL = "#"  # 命令名/服务显示名的完整匹配
+
+
+def _summary_line(text: str) -> str:
+    """取描述的第一句（参数说明之前的部分）"""
+    text = (text or "").split("\n", 1)[0]
+    for sep in ("；参数", "; 参数", "参数:", "参数："):
+        text = text.split(sep, 1)[0]
+    return text
+
+
+def _keywords(text: str) -> Set[str]:
+    """中文取连续汉字的二元组（较短的整词也保留），英文取单词"""
+    words: Set[str] = set()
+    for run in _CJK_RUN.findall(text or ""):
+        if 2 <= len(run) <= 4:
+            words.add(run)
+        words.update(run[i:i + 2] for i in range(len(run) - 1))
+    words.update(w.lower() for w in _ASCII_WORD.findall(text or ""))
+    return {w for w in words if w not in _STOP_WORDS}
+
+
+def _service_document(service_name: str, manifest: Dict) -> str:
+    """拼接服务级别用于打分的文本：显示名、描述、能力分组的描述与工具名、示例描述"""
+    parts = [service_name, manifest.get("displayName", ""), manifest.get("description", "")]
+    for value in (manifest.get("capabilities") or {}).values():
+        if not isinstance(value, dict):
+            continue
+        if isinstance(value.get("description"), str):
+            parts.append(value["description"])
+        # 没有 invocationCommands 的清单以分组列出工具名（如 create_document），拆成单词参与匹配
+        for tool in value.get("tools") or []:
+            if isinstance(tool, str):
+                parts.append(tool.replace("_", " "))
+    for example in manifest.get("examples") or []:
+        if isinstance(example, dict) and isinstance(example.get("description"), str):
+            parts.append(example["description"])
+    return " ".join(p for p in parts if p)
+
+
+def _tool_document(service_name: str, manifest: Dict, command: Dict) -> str:
+    """拼接单个工具用于打分的文本"""
+    parts = [
+        service_name,
+        manifest.get("displayName", ""),
+        _summary_line(manifest.get("description", "")),
+        command.get("command", ""),
+        _summary_line(command.get("description", "")),
+    ]
+    try:
+        example = json.loads(command.get("example") or "{}")
+        if isinstance(example, dict) and isinstance(example.get("query"), str):
+            parts.append(example["query"])
+    except (ValueError, TypeError):
+        pass
+    return " ".join(p for p in parts if p)
+
+
+class IntentPrefilter:
+    """基于MCP清单的本地意图预筛
+
+    - 关键词以字典树存储，对文本的每个起点沿树匹配，耗时与文本长度成正比
+    - 关键词权重为按服务计算的IDF（越多服务共有的词权重越低，同一服务各命令共有的词不受影响），
+      工具得分为命中关键词权重之和；完整命中命令名或服务显示名视为强命中
+    - 没有 invocationCommands 的服务以服务级文本（描述、能力分组、示例）建立一个条目，与其他工具一样参与打分
+    - embedding_model 不为空且安装了 sentence-transformers 时，额外以余弦相似度打分
+    - 清单集合变化时自动重建索引
+    """
+
+    def __init__(self, threshold: float = 3.0, embedding_model: str = "",
+                 embedding_threshold: float = 0.45, max_candidates: int = 3):
+        self.threshold = threshold
+        self.embedding_model = embedding_model
+        self.embedding_threshold = embedding_threshold
+        self.max_candidates = max_candidates
+        self._signature: Optional[Tuple] = None
+        self._trie: Dict = {}
+        self._tools: List[Tuple[str, str]] = []  # (service_name, command)，无命令的服务 command 为空
+        self._encoder = None
+        self._tool_vectors = None
+
+    # ========== 索引 ==========
+
+    def _ensure_index(self, manifests: Dict[str, Dict]):
+        signature = tuple(sorted(
+            (name, len(m.get("capabilities", {}).get("invocationCommands", []))) for name, m in manifests.items()
+        ))
+        if signature == self._signature:
+            return
+        self._build(manifests)
+        self._signature = signature
+
+    def _build(self, manifests: Dict[str, Dict]):
+        tools: List[Tuple[str, str]] = []
+        documents: List[str] = []
+        tool_keywords: List[Set[str]] = []
+        tool_names: List[Set[str]] = []
+        for service_name, manifest in manifests.items():
+            display_name = manifest.get("displayName", "")
+            commands = manifest.get("capabilities", {}).get("invocationCommands", [])
+            if not commands:
+                document = _service_document(service_name, manifest)
+                tools.append((service_name, ""))
+                documents.append(document)
+                tool_keywords.append(_keywords(document))
+                tool_names.append({display_name})
+                continue
+            service_document = _service_document(service_name, manifest)
+            for command in commands:
+                document = f"{service_document} {_tool_document(service_name, manifest, command)}"
+                tools.append((service_name, command.get("command", "")))
+                documents.append(document)
+                tool_keywords.append(_keywords(document))
+                tool_names.append({display_name, command.get("command", "")})
+
+        # 文档频率按服务统计
+        service_words: Dict[str, Set[str]] = {}
+        for (service_name, _), words in zip(tools, tool_keywords):
+            service_words.setdefault(service_name, set()).update(words)
+        document_freq: Dict[str, int] = {}
+        for words in service_words.values():
+            for word in words:
+                document_freq[word] = document_freq.get(word, 0) + 1
+
+        trie: Dict = {}
+        total = max(len(service_words), 1)
+        for tool_index, words in enumerate(tool_keywords):
+            for word in words:
+                weight = math.log(1 + total / document_freq[word])
+                node = trie
+                for ch in word.lower():
+                    node = node.setdefault(ch, {})
+                node.setdefault(_TERMINAL, []).append((tool_index, weight))
+            for name in tool_names[tool_index]:
+                name = name.strip().lower()
+                if len(name) < 2:
+                    continue
+                node = trie
+                for ch in name:
+                    node = node.setdefault(ch, {})
+                node.setdefault(_NAME_TERMINAL, []).append(tool_index)
+
+        self._trie = trie
+        self._tools = tools
+        self._tool_vectors = self._embed(documents) if documents else None
+        logger.info(f"意图预筛索引已构建: {len(tools)} 个工具, {len(document_freq)} 个关键词")
+
+    def _embed(self, texts: List[str]):
+        """可选的向量索引：未配置模型或依赖缺失时返回None"""
+        if not self.embedding_model:
+            return None
+        try:
+            if self._encoder is None:
+                from sentence_transformers import SentenceTransformer
+                self._encoder = SentenceTransformer(self.embedding_model, device="cpu")
+            return self._encoder.encode(texts, normalize_embeddings=True)
+        except ImportError:
+            logger.warning("未安装sentence-transformers，意图预筛仅使用关键词匹配")
+        except Exception as e:
+            logger.warning(f"意图预筛向量模型不可用，仅使用关键词匹配: {e}")
+        self.embedding_model = ""
+        return None
+
+    # ========== 打分 ==========
+
+    def _keyword_scores(self, text: str) -> Dict[int, float]:
+        """在文本中查找所有命中的关键词，同一关键词只计一次；命中完整命令名/显示名的工具直接记为强命中"""
+        text = text.lower()
+        matched: Dict[int, Dict[int, float]] = {}  # tool_index -> {id(关键词节点): 权重}
+        strong: Set[int] = set()
+        for start in range(len(text)):
+            node = self._trie
+            for end, ch in enumerate(text[start:], start + 1):
+                node = node.get(ch)
+                if node is None:
+                    break
+                if (_TERMINAL in node or _NAME_TERMINAL in node) and not self._is_whole_word(text, start, end):
+                    continue
+                for tool_index, weight in node.get(_TERMINAL, ()):
+                    matched.setdefault(tool_index, {})[id(node)] = weight
+                strong.update(node.get(_NAME_TERMINAL, ()))
+        scores = {tool_index: sum(words.values()) for tool_index, words in matched.items()}
+        for tool_index in strong:
+            scores[tool_index] = max(scores.get(tool_index, 0.0), self.threshold * 2)
+        return scores
+
+    @staticmethod
+    def _is_whole_word(text: str, start: int, end: int) -> bool:
+        """英文关键词/名称需要完整单词匹配（time 不应命中 sometimes），中文不限制"""
+        def is_word_char(ch: str) -> bool:
+            return ch.isascii() and ch.isalnum()
+        if is_word_char(text[start]) and start > 0 and is_word_char(text[start - 1]):
+            return False
+        if is_word_char(text[end - 1]) and end < len(text) and is_word_char(text[end]):
+            return False
+        return True
+
+    def evaluate(self, text: str, manifests: Dict[str, Dict]) -> Dict:
+        """为文本打分
+
+        Returns:
+            {"skip_llm": 是否可确定无需调用工具, "services": 候选服务名(按得分降序),
+             "candidates": [(服务, 命令, 得分)], "reason": 说明}
+        """
+        if not manifests:
+            return {"skip_llm": False, "services": [], "candidates": [], "reason": "无可用工具清单"}
+        self._ensure_index(manifests)
+        if not self._tools:
+            return {"skip_llm": False, "services": [], "candidates": [], "reason": "工具清单为空"}
+
+        scores = {i: s for i, s in self._keyword_scores(text).items() if s >= self.threshold}
+        if self._tool_vectors is not None:
+            try:
+                query = self._encoder.encode([text], normalize_embeddings=True)[0]
+                similarities = self._tool_vectors @ query
+                for i, similarity in enumerate(similarities):
+                    if similarity >= self.embedding_threshold:
+                        # 向量命中折算为至少达到阈值的得分
+                        scores[i] = max(scores.get(i, 0.0), self.threshold * float(similarity) / self.embedding_threshold)
+            except Exception as e:
+                logger.debug(f"意图预筛向量打分失败: {e}")
+
+        if not scores:
+            lowered = text.lower()
+            hint = next((h for h in _ACTION_HINTS if h in lowered), None)
+            if hint:
+                # 有操作意图但未定位到具体工具：不跳过，也不缩小工具列表
+                return {"skip_llm": False, "services": [], "candidates": [], "reason": f"命中操作提示词: {hint}"}
+            return {"skip_llm": True, "services": [], "candidates": [], "reason": "未命中任何工具关键词"}
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        candidates = [(self._tools[i][0], self._tools[i][1], round(score, 3)) for i, score in ranked]
+        if ranked[0][1] < self.threshold * 2:
+            # 命中较弱：交给LLM判断，但不缩小工具列表，避免漏掉真正需要的工具
+            return {"skip_llm": False, "services": [], "candidates": candidates[:10], "reason": "弱命中，保留全部工具"}
+        services: List[str] = []
+        for service_name, _, _ in candidates:
+            if service_name not in services:
+                services.append(service_name)
+            if len(services) >= self.max_candidates:
+                break
+        return {"skip_llm": False, "services": services, "candidates": candidates[:10],
+                "reason": f"候选服务: {', '.join(services)}"}
+
+
+# 全局预筛实例
+_intent_prefilter: Optional[IntentPrefilter] = None
+
+
+def get_intent_prefilter() -> IntentPrefilter:
+    """获取全局意图预筛实例"""
+    global _intent_prefilter
+    if _intent_prefilter is None:
+        from system.config import config
+        _intent_prefilter = IntentPrefilter(
+            threshold=config.api.intent_prefilter_threshold,
+            embedding_model=config.api.intent_prefilter_embedding_model,
+            embedding_threshold=config.api.intent_prefilter_embedding_threshold,
+            max_candidates=config.api.intent_prefilter_max_services,
+        )
+    return _intent_prefilter
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+LLM响应缓存
+以 (模型, 消息哈希, 温度, max_tokens) 为键缓存非流式调用的结果：内存LRU + 可选SQLite磁盘层，带TTL与命中统计
+"""
+
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_responses_created ON responses(created_at);
+"""
+
+
+def make_cache_key(model: str, messages: List[Dict], temperature: float, max_tokens: int) -> str:
+    """生成缓存键：消息按规范JSON序列化后取哈希"""
+    raw = json.dumps(
+        {"model": model, "messages": messages, "temperature": round(float(temperature), 4),
+         "max_tokens": max_tokens},
+        ensure_ascii=False, sort_keys=True, separators=(",", ":")
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """LLM响应缓存
+
+    - 内存层为LRU，超过 max_entries 时淘汰最久未用的条目
+    - disk_path 不为空时启用SQLite磁盘层：内存未命中时查询磁盘，命中后回填内存
+    - 条目超过 ttl_seconds 即视为失效（<=0 表示不过期）
+    - 线程安全，同步接口可在事件循环与线程池中直接调用
+    """
+
+    def __init__(self, max_entries: int = 512, ttl_seconds: float = 3600,
+                 disk_path: Optional[Union[str, Path]] = None, disk_max_entries: int = 10000):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.disk_max_entries = disk_max_entries
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._stats = {"hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "expired": 0}
+        self._conn: Optional[sqlite3.Connection] = None
+        if disk_path:
+            try:
+                Path(disk_path).parent.mkdir(parents=True, exist_ok=True)
+                self._conn = sqlite3.connect(str(disk_path), check_same_thread=False, timeout=10)
+                self._conn.execute("PRAGMA journal_mode=WAL")
+                self._conn.execute("PRAGMA synchronous=NORMAL")
+                self._conn.executescript(_SCHEMA)
+                self._conn.commit()
+            except Exception as e:
+                logger.warning(f"响应缓存磁盘层不可用，仅使用内存缓存: {e}")
+                self._conn = None
+
+    def _expired(self, created_at: float, now: float) -> bool:
+        return self.ttl_seconds > 0 and now - created_at > self.ttl_seconds
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        expired = False
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if not self._expired(entry[1], now):
+                    self._memory.move_to_end(key)
+                    self._stats["hits"] += 1
+                    return entry[0]
+                del self._memory[key]
+                expired = True
+
+            if self._conn is not None:
+                row = self._conn.execute(
+                    "SELECT value, created_at FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    value, created_at = row
+                    if not self._expired(created_at, now):
+                        self._put_memory(key, value, created_at)
+                        self._stats["hits"] += 1
+                        self._stats["disk_hits"] += 1
+                        return value
+                    self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self._conn.commit()
+                    expired = True
+
+            self._stats["misses"] += 1
+            if expired:
+                self._stats["expired"] += 1
+            return None
+
+    def set(self, key: str, value: str):
+        now = time.time()
+        with self._lock:
+            self._put_memory(key, value, now)
+            self._stats["stores"] += 1
+            if self._conn is not None:
+                try:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO responses (key, value, created_at) VALUES (?, ?, ?)",
+                        (key, value, now)
+                    )
+                    if self._stats["stores"] % 100 == 0:
+                        self._trim_disk(now)
+                    self._conn.commit()
+                except sqlite3.Error as e:
+                    logger.warning(f"写入响应缓存磁盘层失败: {e}")
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            if self._conn is not None:
+                self._conn.execute("DELETE FROM responses")
+                self._conn.commit()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_entries"] = len(self._memory)
+            stats["disk_enabled"] = self._conn is not None
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        return stats
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def _put_memory(self, key: str, value: str, created_at: float):
+        self._memory[key] = (value, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _trim_disk(self, now: float):
+        """删除过期条目，并把磁盘层条目数控制在上限内（按写入时间保留最新的）"""
+        if self.ttl_seconds > 0:
+            self._conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl_seconds,))
+        self._conn.execute(
+            "DELETE FROM responses WHERE key IN (SELECT key FROM responses "
+            "ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+            (self.disk_max_entries,)
+        )
+
+
+# 全局响应缓存实例
+_response_cache: Optional[ResponseCache] = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache(site: Optional[str] = None) -> Optional[ResponseCache]:
+    """获取全局响应缓存；未启用缓存或指定调用点未开启时返回None"""
+    global _response_cache
+    from system.config import config
+    cache_config = config.response_cache
+    if not cache_config.enabled:
+        return None
+    if site is not None and not cache_config.sites.get(site, False):
+        return None
+    if _response_cache is None:
+        with _response_cache_lock:
+            if _response_cache is None:
+                disk_path = Path(config.system.log_dir) / "llm_response_cache.db" if cache_config.disk_enabled else None
+                _response_cache = ResponseCache(
+                    max_entries=cache_config.max_entries,
+                    ttl_seconds=cache_config.ttl_seconds,
+                    disk_path=disk_path,
+                    disk_max_entries=cache_config.disk_max_entries,
+                )
+    return _response_cache
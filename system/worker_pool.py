@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+异步工作池
+事件驱动的队列消费者：空闲时工作协程阻塞在队列上不轮询，停止通过哨兵通知；
+支持优先级通道、队列深度与等待时长统计，以及运行时调整工作协程数量
+"""
+
+import asyncio
+import itertools
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# 优先级通道，数值越小越先处理
+PRIORITY_LANES: Dict[str, int] = {"high": 0, "normal": 1, "low": 2}
+
+# 哨兵优先级：立即停止排在所有任务之前，排空后停止排在所有任务之后
+_STOP_NOW = -1
+_STOP_AFTER_DRAIN = len(PRIORITY_LANES)
+_STOP = object()
+
+
+class WorkerPool:
+    """异步工作池
+
+    - submit() 把任务放入对应优先级通道，工作协程按 (优先级, 提交顺序) 取出后调用 handler
+    - max_queue_size > 0 时限制排队任务数，队列满时 submit() 等待（背压）
+    - resize() 增加时立即启动新的工作协程，减少时投放高优先级哨兵，工作协程处理完当前任务后退出
+    - shutdown(drain=True) 先处理完已排队的任务再停止；cancel=True 直接取消工作协程
+    - 需在事件循环中调用 start()
+    """
+
+    def __init__(self, handler: Callable[[Any], Awaitable[Any]], workers: int = 4,
+                 name: str = "worker", max_queue_size: int = 0):
+        self.handler = handler
+        self.name = name
+        self.max_queue_size = max_queue_size
+        self._target = max(1, workers)
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._workers: Set[asyncio.Task] = set()
+        self._seq = itertools.count()
+        self._worker_ids = itertools.count(1)
+        self._lane_depth: Dict[str, int] = {lane: 0 for lane in PRIORITY_LANES}
+        self._busy = 0
+        self._waits: Deque[float] = deque(maxlen=512)
+        self._stats = {"submitted": 0, "processed": 0, "failed": 0, "max_wait": 0.0}
+
+    @property
+    def size(self) -> int:
+        """当前存活的工作协程数"""
+        return sum(1 for worker in self._workers if not worker.done())
+
+    @property
+    def running(self) -> bool:
+        return self._queue is not None
+
+    def start(self):
+        if self._queue is not None:
+            return
+        self._queue = asyncio.PriorityQueue()
+        self._slots = asyncio.Semaphore(self.max_queue_size) if self.max_queue_size > 0 else None
+        self._spawn(self._target)
+        logger.info(f"工作池 {self.name} 已启动，工作协程数: {self._target}")
+
+    async def submit(self, item: Any, priority: str = "normal"):
+        """提交任务；未知的优先级按 normal 处理"""
+        if self._queue is None:
+            raise RuntimeError(f"工作池 {self.name} 未启动")
+        lane = priority if priority in PRIORITY_LANES else "normal"
+        if self._slots is not None:
+            await self._slots.acquire()
+        self._lane_depth[lane] += 1
+        self._stats["submitted"] += 1
+        self._queue.put_nowait((PRIORITY_LANES[lane], next(self._seq), time.monotonic(), lane, item))
+
+    def resize(self, workers: int):
+        """调整工作协程数量"""
+        workers = max(1, workers)
+        if self._queue is None:
+            self._target = workers
+            return
+        current = self._target
+        self._target = workers
+        if workers > current:
+            self._spawn(workers - current)
+        else:
+            for _ in range(current - workers):
+                self._queue.put_nowait((_STOP_NOW, next(self._seq), 0.0, None, _STOP))
+        logger.info(f"工作池 {self.name} 工作协程数调整: {current} -> {workers}")
+
+    async def shutdown(self, drain: bool = False, cancel: bool = False):
+        """停止工作池"""
+        if self._queue is None:
+            return
+        workers = list(self._workers)
+        if cancel:
+            for worker in workers:
+                worker.cancel()
+        else:
+            priority = _STOP_AFTER_DRAIN if drain else _STOP_NOW
+            for _ in range(self._target):
+                self._queue.put_nowait((priority, next(self._seq), 0.0, None, _STOP))
+        await asyncio.gather(*workers, return_exceptions=True)
+        self._workers.clear()
+        self._queue = None
+        self._slots = None
+        # 未处理的任务随队列丢弃
+        self._lane_depth = {lane: 0 for lane in PRIORITY_LANES}
+        logger.info(f"工作池 {self.name} 已停止")
+
+    def qsize(self) -> int:
+        """排队中的任务数（不含哨兵）"""
+        return sum(self._lane_depth.values())
+
+    def stats(self) -> Dict[str, Any]:
+        waits = sorted(self._waits)
+        stats = dict(self._stats)
+        stats.update({
+            "workers": self.size,
+            "busy": self._busy,
+            "queue_size": self.qsize(),
+            "lanes": dict(self._lane_depth),
+            "max_queue_size": self.max_queue_size,
+            "avg_wait": round(sum(waits) / len(waits), 4) if waits else 0.0,
+            "p95_wait": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))], 4) if waits else 0.0,
+            "max_wait": round(stats["max_wait"], 4),
+        })
+        return stats
+
+    def _spawn(self, count: int):
+        loop = asyncio.get_running_loop()
+        for _ in range(count):
+            worker_name = f"{self.name}-{next(self._worker_ids)}"
+            worker = loop.create_task(self._worker(worker_name), name=worker_name)
+            self._workers.add(worker)
+            worker.add_done_callback(self._workers.discard)
+
+    async def _worker(self, worker_name: str):
+        queue = self._queue
+        while True:
+            _, _, enqueued_at, lane, item = await queue.get()
+            if item is _STOP:
+                break
+            self._lane_depth[lane] -= 1
+            if self._slots is not None:
+                self._slots.release()
+            wait = time.monotonic() - enqueued_at
+            self._waits.append(wait)
+            self._stats["max_wait"] = max(self._stats["max_wait"], wait)
+            self._busy += 1
+            try:
+                await self.handler(item)
+                self._stats["processed"] += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._stats["failed"] += 1
+                logger.error(f"工作协程 {worker_name} 处理任务失败: {e}")
+            finally:
+                self._busy -= 1
+        logger.debug(f"工作协程 {worker_name} 退出")
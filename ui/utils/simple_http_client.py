@@ -23,13 +23,28 @@ class SimpleHttpClient(QThread):
     def __init__(self, url, payload, parent=None):
         super().__init__(parent)
         self.url = url
-        self.payload = payload
+        self.payload = dict(payload)
+        # 请求UTF-8 SSE格式（文本为JSON字符串），无需base64解码；旧服务器忽略该字段仍返回base64
+        self.payload.setdefault("stream_format", "sse")
         self._cancelled = False
         self.last_session_id = None  # 保存从服务器返回的会话ID
         
     def cancel(self):
         """取消请求"""
         self._cancelled = True
+    
+    @staticmethod
+    def _decode_text(data_str: str) -> str:
+        """解码文本帧：sse格式为JSON字符串，旧版为base64，均失败则原样返回"""
+        if data_str.startswith('"'):
+            try:
+                return json.loads(data_str)
+            except ValueError:
+                pass
+        try:
+            return base64.b64decode(data_str, validate=True).decode('utf-8')
+        except Exception:
+            return data_str
         
     def run(self):
         """执行HTTP请求"""
@@ -78,15 +93,9 @@ class SimpleHttpClient(QThread):
                             elif data_str.startswith('audio_url: '):
                                 continue  # 忽略音频URL，由apiserver处理
                             else:
-                                # 解码base64内容
-                                try:
-                                    decoded = base64.b64decode(data_str).decode('utf-8')
-                                    complete_text += decoded
-                                    self.chunk_received.emit(decoded)
-                                except:
-                                    # 如果不是base64，直接使用原始内容
-                                    complete_text += data_str
-                                    self.chunk_received.emit(data_str)
+                                decoded = self._decode_text(data_str)
+                                complete_text += decoded
+                                self.chunk_received.emit(decoded)
                     except Exception as e:
                         logger.warning(f"处理响应行时出错: {e}")
                         continue
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+流式断句器
+对逐块到达的文本按句切分，每个字符只扫描一次，供apiserver流式TTS与语音集成共用
+"""
+
+from typing import Iterable, List, Optional
+
+# 默认断句标点（中英文）
+DEFAULT_SENTENCE_ENDINGS = "。？！；….?!;"
+# 紧跟在句末标点后、应归属于上一句的闭合符号
+DEFAULT_CLOSING_MARKS = "”’」』）》】\"')"
+# 以英文句点结尾但不构成句末的常见缩写（小写、不含末尾句点）
+DEFAULT_ABBREVIATIONS = ("mr", "mrs", "ms", "dr", "prof", "st", "vs", "e.g", "i.e")
+
+# 扫描状态
+_STATE_TEXT = 0      # 普通文本
+_STATE_ENDING = 1    # 已遇到句末标点，继续吸收连续标点与闭合符号
+_STATE_DOT = 2       # 遇到英文句点，需看下一个字符才能判断（小数、域名、缩写）
+
+
+class SentenceSegmenter:
+    """线性时间的流式断句器
+
+    - feed() 只扫描新到达的字符，未完成的句子以分片列表保存，不做字符串重复拼接
+    - 连续句末标点（如“？！”、“...”）与其后的闭合引号/括号归入同一句
+    - 英文句点后紧跟字母或数字时不断句（3.14、example.com），已知缩写后不断句
+    - 句末判断可能依赖下一个字符，因此块末尾的句子会在下一块到达或 flush() 时输出
+    """
+
+    def __init__(self,
+                 endings: str = DEFAULT_SENTENCE_ENDINGS,
+                 closing_marks: str = DEFAULT_CLOSING_MARKS,
+                 abbreviations: Iterable[str] = DEFAULT_ABBREVIATIONS):
+        self.endings = frozenset(endings)
+        self.closing_marks = frozenset(closing_marks)
+        self.abbreviations = frozenset(a.lower().rstrip(".") for a in abbreviations)
+        self.reset()
+
+    def reset(self):
+        """清空未完成的句子与扫描状态"""
+        self._parts: List[str] = []
+        self._state = _STATE_TEXT
+        self._word: List[str] = []  # 当前末尾的英文单词（用于缩写判断）
+
+    @property
+    def pending(self) -> str:
+        """尚未输出的文本"""
+        return "".join(self._parts)
+
+    def feed(self, text: str) -> List[str]:
+        """输入一段文本，返回其中已完整的句子（保留原始空白）"""
+        sentences: List[str] = []
+        if not text:
+            return sentences
+
+        seg_start = 0
+        for i, ch in enumerate(text):
+            state = self._state
+            if state == _STATE_DOT:
+                if ch.isascii() and ch.isalnum():
+                    # 小数点/域名/e.g等，句点属于正文
+                    self._state = state = _STATE_TEXT
+                    self._word.append(".")
+                else:
+                    self._state = state = _STATE_ENDING
+                    self._word.clear()
+
+            if state == _STATE_ENDING:
+                if ch in self.endings or ch in self.closing_marks:
+                    continue
+                # 句末标点序列结束，在当前字符之前断句
+                sentences.append(self._take(text, seg_start, i))
+                seg_start = i
+                self._state = _STATE_TEXT
+
+            if ch in self.endings:
+                if ch == "." and self._is_abbreviation():
+                    self._word.append(ch)
+                    continue
+                if ch == ".":
+                    self._state = _STATE_DOT
+                else:
+                    self._state = _STATE_ENDING
+                    self._word.clear()
+            elif ch.isascii() and ch.isalpha():
+                self._word.append(ch)
+            elif self._word:
+                self._word.clear()
+
+        if seg_start < len(text):
+            self._parts.append(text[seg_start:])
+        return sentences
+
+    def flush(self) -> Optional[str]:
+        """流结束时取出剩余文本（可能不是完整句子）"""
+        remaining = self.pending
+        self.reset()
+        return remaining or None
+
+    def _take(self, text: str, start: int, end: int) -> str:
+        """取出当前句子：已缓存的分片 + 本块中的片段"""
+        self._parts.append(text[start:end])
+        sentence = "".join(self._parts)
+        self._parts = []
+        return sentence
+
+    def _is_abbreviation(self) -> bool:
+        return bool(self._word) and "".join(self._word).lower() in self.abbreviations
+
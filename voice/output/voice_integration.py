@@ -23,12 +23,10 @@ from queue import Queue, Empty
 # 添加项目根目录到Python路径
 sys.path.insert(0, str(Path(__file__).parent.parent))
 from system.config import config, AI_NAME
+from voice.output.sentence_segmenter import SentenceSegmenter
 
 logger = logging.getLogger("VoiceIntegration")
 
-# 简化的句子结束标点（依赖apiserver的预处理）
-SENTENCE_ENDINGS = ["。", "！", "？", "；", ".", "!", "?", ";"]
-
 class VoiceIntegration:
     """语音集成模块 - 重构版本：依赖apiserver的流式TTS实现"""
     
@@ -48,7 +46,7 @@ class VoiceIntegration:
         self.audio_temp_dir.mkdir(parents=True, exist_ok=True)
         
         # 流式处理状态
-        self.text_buffer = ""  # 文本缓冲区
+        self.segmenter = SentenceSegmenter()  # 流式断句器，未完成的句子保存在其中
         self.is_processing = False  # 是否正在处理
         self.sentence_queue = Queue()  # 句子队列
         self.audio_queue = Queue()  # 音频队列
@@ -125,6 +123,16 @@ class VoiceIntegration:
             logger.debug(f"接收文本片段: {text[:50]}...")
             self._process_text_stream(text.strip())
 
+    def receive_sentence(self, sentence: str):
+        """接收已断好句的完整句子 - 直接加入句子队列（apiserver的流式切割器已完成断句，不再经本地断句器）"""
+        if not config.system.voice_enabled:
+            return
+            
+        sentence = sentence.strip() if sentence else ""
+        if sentence:
+            self.sentence_queue.put(sentence)
+            logger.info(f"加入句子队列: {sentence[:50]}...")
+
     def receive_audio_url(self, audio_url: str):
         """接收音频URL - 直接播放apiserver生成的音频（保持原始逻辑）"""
         if not config.system.voice_enabled:
@@ -140,37 +148,22 @@ class VoiceIntegration:
         if not text:
             return
             
-        # 将文本添加到缓冲区
-        self.text_buffer += text
-        
-        # 检查是否形成完整句子（简单的标点检测）
-        self._check_and_queue_sentences()
+        # 断句器只扫描新文本，一次可产出多个完整句子
+        self._check_and_queue_sentences(text)
         
-    def _check_and_queue_sentences(self):
-        """检查并加入句子队列 - 简化版本，依赖apiserver的预处理（保持原始逻辑）"""
-        if not self.text_buffer:
-            return
-            
-        # 简单的句子结束检测（apiserver已经处理过复杂的标点分割）
-        sentence_endings = SENTENCE_ENDINGS
+    @property
+    def text_buffer(self) -> str:
+        """尚未形成完整句子的文本"""
+        return self.segmenter.pending
         
-        for ending in sentence_endings:
-            if ending in self.text_buffer:
-                # 找到句子结束位置
-                end_pos = self.text_buffer.find(ending) + 1
-                sentence = self.text_buffer[:end_pos]
-                
-                # 检查句子是否有效
-                if sentence.strip():
-                    # 加入句子队列
-                    self.sentence_queue.put(sentence)
-                    logger.info(f"加入句子队列: {sentence[:50]}...")
-                    
-                    # 音频处理线程始终在运行，无需检查启动状态
-                
-                # 更新缓冲区
-                self.text_buffer = self.text_buffer[end_pos:]
-                break
+    def _check_and_queue_sentences(self, text: str):
+        """断句并将完整句子加入句子队列"""
+        for sentence in self.segmenter.feed(text):
+            # 检查句子是否有效
+            if sentence.strip():
+                # 加入句子队列（音频处理线程始终在运行，无需检查启动状态）
+                self.sentence_queue.put(sentence)
+                logger.info(f"加入句子队列: {sentence[:50]}...")
         
     def _start_audio_processing(self):
         """启动音频处理线程（保持原始逻辑）"""
@@ -195,7 +188,7 @@ class VoiceIntegration:
                 break
                 
         # 重置状态（不重置is_processing，因为线程是持续运行的）
-        self.text_buffer = ""
+        self.segmenter.reset()
         
         logger.debug("语音处理状态已重置")
         
@@ -535,17 +528,13 @@ class VoiceIntegration:
 
     def finish_processing(self):
         """完成处理，清理剩余内容（保持原始逻辑）"""
-        # 处理剩余的文本
-        if self.text_buffer.strip():
-            # 将剩余文本作为最后一个句子处理
-            remaining_text = self.text_buffer.strip()
-            if remaining_text:
-                self.sentence_queue.put(remaining_text)
-                logger.debug(f"处理剩余文本: {remaining_text[:50]}...")
+        # 处理剩余的文本：将剩余文本作为最后一个句子处理，同时清空断句器
+        remaining_text = (self.segmenter.flush() or "").strip()
+        if remaining_text:
+            self.sentence_queue.put(remaining_text)
+            logger.debug(f"处理剩余文本: {remaining_text[:50]}...")
         
         # 不再发送完成信号，因为线程是持续运行的
-        # 只需要清空文本缓冲区
-        self.text_buffer = ""
 
     def get_debug_info(self) -> Dict[str, Any]:
         """获取调试信息（保持原始逻辑，更新音频状态标识）"""